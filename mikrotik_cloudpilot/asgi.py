@@ -7,10 +7,56 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mikrotik_cloudpilot.settings')
 
-application = get_asgi_application()
+
+class CancelOnDisconnectMiddleware:
+    """Cancel the request handler when the HTTP client disconnects
+
+    Django 4.2 stops reading from the client once the request body is in, so
+    an abandoned request keeps running (and keeps waiting on its router)
+    until it finishes. This wrapper keeps listening after the body and
+    cancels the handler on ``http.disconnect``, which propagates into the
+    async router views and cancels their in-flight router calls.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        body_complete = asyncio.Event()
+
+        async def app_receive():
+            message = await receive()
+            if message['type'] == 'http.disconnect' or not message.get('more_body', False):
+                body_complete.set()
+            return message
+
+        async def watch_disconnect():
+            await body_complete.wait()
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    handler.cancel()
+                    return
+
+        handler = asyncio.ensure_future(self.app(scope, app_receive, send))
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not watcher.done():
+                raise
+        finally:
+            watcher.cancel()
+
+
+application = CancelOnDisconnectMiddleware(get_asgi_application())
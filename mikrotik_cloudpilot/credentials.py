@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from cryptography.fernet import Fernet, MultiFernet
+from django.conf import settings
+
+
+@lru_cache(maxsize=4)
+def _build_fernet(keys):
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+def get_fernet():
+    """Return the shared MultiFernet for ENCRYPTION_KEY (+ ENCRYPTION_KEY_FALLBACKS).
+
+    New tokens are encrypted with ENCRYPTION_KEY; fallback keys are only used
+    to decrypt values written before a key rotation.
+    """
+    if not hasattr(settings, 'ENCRYPTION_KEY'):
+        raise ValueError("ENCRYPTION_KEY not configured in settings")
+
+    keys = [settings.ENCRYPTION_KEY] + list(getattr(settings, 'ENCRYPTION_KEY_FALLBACKS', []))
+    keys = tuple(key.encode() if isinstance(key, str) else bytes(key) for key in keys)
+    return _build_fernet(keys)
+
+
+def _as_bytes(token):
+    """BinaryField values come back as memoryview on PostgreSQL"""
+    if isinstance(token, memoryview):
+        return bytes(token)
+    if isinstance(token, str):
+        return token.encode('utf-8')
+    return token
+
+
+class CredentialCache:
+    """Process-local cache of decrypted secrets
+
+    Entries are keyed by (model label, pk, updated_at) and remember the
+    ciphertext they were decrypted from, so an unsaved change to the
+    encrypted field is never answered from the cache. Bounded by
+    ``max_entries`` (LRU) and ``ttl`` seconds.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def decrypt(self, instance, token):
+        """Return the decrypted text for ``token`` stored on ``instance``"""
+        token = _as_bytes(token)
+        if instance.pk is None or self.max_entries <= 0:
+            return get_fernet().decrypt(token).decode()
+
+        key = (instance._meta.label, instance.pk, instance.updated_at)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now and entry[1] == token:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        plaintext = get_fernet().decrypt(token).decode()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, token, plaintext)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return plaintext
+
+    def evict(self, instance):
+        """Drop every cached secret for a model instance"""
+        label, pk = instance._meta.label, instance.pk
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == label and k[1] == pk]:
+                del self._entries[key]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+credential_cache = CredentialCache(
+    max_entries=getattr(settings, 'CREDENTIAL_CACHE_MAX_ENTRIES', 1024),
+    ttl=getattr(settings, 'CREDENTIAL_CACHE_TTL', 300),
+)
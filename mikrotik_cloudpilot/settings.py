@@ -216,6 +216,8 @@ CORS_ALLOW_HEADERS = [
     'x-csrftoken',
     'x-requested-with',
     'x-public-key',  # Our custom header
+    'idempotency-key',  # Payment initiation retries
+    'prefer',  # Prefer: respond-async for async STK push
 ]
 
 # Allow common methods
@@ -232,4 +234,155 @@ CORS_ALLOW_METHODS = [
 # Generate a new key with: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
 ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY', '6WfDngP4K_1pEDVef5h59ANAnhhq9bZzakrAKqYugHQ=').encode()
 
-
+# Previous encryption keys, still accepted for decryption after a key rotation (comma-separated)
+ENCRYPTION_KEY_FALLBACKS = [key.strip().encode() for key in os.environ.get('ENCRYPTION_KEY_FALLBACKS', '').split(',') if key.strip()]
+
+# Decrypted router passwords / payment private keys are cached in-process
+CREDENTIAL_CACHE_MAX_ENTRIES = int(os.environ.get('CREDENTIAL_CACHE_MAX_ENTRIES', 1024))
+CREDENTIAL_CACHE_TTL = int(os.environ.get('CREDENTIAL_CACHE_TTL', 300))  # seconds
+
+# Mikrotik connection pool
+# Clients (HTTP session + decrypted credentials) are reused per router until the
+# router row changes, the pool is full (LRU eviction) or they sit idle too long.
+MIKROTIK_POOL_MAX_SIZE = int(os.environ.get('MIKROTIK_POOL_MAX_SIZE', 64))
+MIKROTIK_POOL_IDLE_TIMEOUT = int(os.environ.get('MIKROTIK_POOL_IDLE_TIMEOUT', 300))  # seconds
+MIKROTIK_POOL_CONNECTIONS_PER_ROUTER = int(os.environ.get('MIKROTIK_POOL_CONNECTIONS_PER_ROUTER', 4))
+
+# Native RouterOS API transport (Router.api_transport = 'api')
+# api-ssl usually runs with a self-signed certificate, so verification is opt-in.
+ROUTEROS_API_VERIFY_SSL = os.environ.get('ROUTEROS_API_VERIFY_SSL', 'False').lower() == 'true'
+
+# Fleet command fan-out (/routers/fleet/execute-command/)
+MIKROTIK_FLEET_MAX_WORKERS = int(os.environ.get('MIKROTIK_FLEET_MAX_WORKERS', 32))
+MIKROTIK_FLEET_TIMEOUT = float(os.environ.get('MIKROTIK_FLEET_TIMEOUT', 10))  # seconds per router
+MIKROTIK_DEVICE_INFO_DEADLINE = float(os.environ.get('MIKROTIK_DEVICE_INFO_DEADLINE', 8))  # total, for /routers/device-info/
+MIKROTIK_SUBREQUEST_WORKERS = int(os.environ.get('MIKROTIK_SUBREQUEST_WORKERS', 16))  # never fewer than MIKROTIK_FLEET_MAX_WORKERS
+
+# Batched commands (/routers/<id>/execute-batch/)
+MIKROTIK_BATCH_MAX_STEPS = int(os.environ.get('MIKROTIK_BATCH_MAX_STEPS', 100))
+
+# Compiled scripts (/routers/<id>/execute-script/): write operations run as one uploaded .rsc
+MIKROTIK_SCRIPT_MAX_OPERATIONS = int(os.environ.get('MIKROTIK_SCRIPT_MAX_OPERATIONS', 1000))
+
+# Router response cache for read-only (GET) commands
+# TTLs in seconds per command path prefix (longest prefix wins); other paths are
+# only cached if MIKROTIK_CACHE_DEFAULT_TTL is above 0.
+MIKROTIK_CACHE_TTLS = {
+    'system/resource': 5,
+    'system/identity': 60,
+    'system/routerboard': 300,
+    'interface': 10,
+    'ip/hotspot/user/profile': 30,
+}
+MIKROTIK_CACHE_DEFAULT_TTL = int(os.environ.get('MIKROTIK_CACHE_DEFAULT_TTL', 0))
+MIKROTIK_CACHE_MAX_ENTRIES = int(os.environ.get('MIKROTIK_CACHE_MAX_ENTRIES', 2048))
+
+# Per-router circuit breaker: after this many consecutive connection failures a
+# router's circuit opens and requests fail fast (HTTP 503) until the reset timeout
+# passes and a trial request succeeds.
+MIKROTIK_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('MIKROTIK_CIRCUIT_FAILURE_THRESHOLD', 3))
+MIKROTIK_CIRCUIT_RESET_TIMEOUT = int(os.environ.get('MIKROTIK_CIRCUIT_RESET_TIMEOUT', 30))  # seconds
+MIKROTIK_CIRCUIT_HALF_OPEN_MAX_CALLS = int(os.environ.get('MIKROTIK_CIRCUIT_HALF_OPEN_MAX_CALLS', 1))
+
+# Background router health monitor (python manage.py monitor_routers)
+ROUTER_MONITOR_WORKERS = int(os.environ.get('ROUTER_MONITOR_WORKERS', 32))
+ROUTER_MONITOR_INTERVAL = int(os.environ.get('ROUTER_MONITOR_INTERVAL', 60))  # seconds
+ROUTER_MONITOR_MIN_INTERVAL = int(os.environ.get('ROUTER_MONITOR_MIN_INTERVAL', 15))
+ROUTER_MONITOR_MAX_INTERVAL = int(os.environ.get('ROUTER_MONITOR_MAX_INTERVAL', 600))
+ROUTER_MONITOR_HEARTBEAT = int(os.environ.get('ROUTER_MONITOR_HEARTBEAT', 600))  # refresh last_checked at least this often
+ROUTER_MONITOR_PROBE_TIMEOUT = int(os.environ.get('ROUTER_MONITOR_PROBE_TIMEOUT', 3))
+
+# IntaSend webhook (/payments/webhook/): callbacks must carry this challenge unless
+# the payment owner's IntaSend credentials set their own webhook_challenge
+INTASEND_WEBHOOK_CHALLENGE = os.environ.get('INTASEND_WEBHOOK_CHALLENGE', '')
+
+# Ready-to-use IntaSend SDK services are cached per credentials version; live
+# connectivity probes run at most once per interval per credentials
+INTASEND_SERVICE_CACHE_MAX_ENTRIES = int(os.environ.get('INTASEND_SERVICE_CACHE_MAX_ENTRIES', 256))
+INTASEND_HEALTH_PROBE_INTERVAL = int(os.environ.get('INTASEND_HEALTH_PROBE_INTERVAL', 300))  # seconds
+
+# Payment status checks: concurrent checks of one payment share a single IntaSend
+# call, and its result is reused for this many seconds (0 disables reuse)
+INTASEND_STATUS_CACHE_TTL = int(os.environ.get('INTASEND_STATUS_CACHE_TTL', 5))
+INTASEND_STATUS_CACHE_MAX_ENTRIES = int(os.environ.get('INTASEND_STATUS_CACHE_MAX_ENTRIES', 1024))
+
+# Payment initiation retries: responses are replayed for the same Idempotency-Key
+# header (kept for the TTL), or without the header for the same router, package,
+# phone and MAC within the window
+PAYMENT_IDEMPOTENCY_KEY_TTL = int(os.environ.get('PAYMENT_IDEMPOTENCY_KEY_TTL', 86400))  # seconds
+PAYMENT_IDEMPOTENCY_WINDOW = int(os.environ.get('PAYMENT_IDEMPOTENCY_WINDOW', 120))  # seconds
+
+# Recorded payment webhook callbacks are deleted by the payment poller after this
+# many days (0 keeps them forever)
+PAYMENT_WEBHOOK_EVENT_RETENTION_DAYS = int(os.environ.get('PAYMENT_WEBHOOK_EVENT_RETENTION_DAYS', 90))
+
+# Async STK push: /payments/intasend/initiate/ answers 202 right away and a local
+# worker pool sends the push, when the client sends "Prefer: respond-async" or
+# PAYMENT_STK_PUSH_ASYNC is on. Pushes that never reached IntaSend are retried
+# PAYMENT_STK_PUSH_RETRIES times; ones that may have reached it are never resent.
+PAYMENT_STK_PUSH_ASYNC = os.environ.get('PAYMENT_STK_PUSH_ASYNC', 'False').lower() == 'true'
+PAYMENT_STK_PUSH_WORKERS = int(os.environ.get('PAYMENT_STK_PUSH_WORKERS', 8))
+PAYMENT_STK_PUSH_RETRIES = int(os.environ.get('PAYMENT_STK_PUSH_RETRIES', 1))
+PAYMENT_STK_PUSH_RETRY_DELAY = int(os.environ.get('PAYMENT_STK_PUSH_RETRY_DELAY', 2))  # seconds, grows per retry
+
+# Background pending-payment poller (python manage.py poll_payments)
+PAYMENT_POLLER_WORKERS = int(os.environ.get('PAYMENT_POLLER_WORKERS', 8))
+PAYMENT_POLLER_PER_OWNER = int(os.environ.get('PAYMENT_POLLER_PER_OWNER', 4))  # concurrent calls per credentials owner
+PAYMENT_POLLER_EXPIRE_AFTER = int(os.environ.get('PAYMENT_POLLER_EXPIRE_AFTER', 1800))  # seconds
+PAYMENT_POLLER_TICK = int(os.environ.get('PAYMENT_POLLER_TICK', 5))  # seconds between passes
+
+# Payment status long-poll (/payments/<id>/events/): requests wait up to the timeout
+# for the payment to settle; settlements made by other processes are picked up by
+# re-checking waited-on payments every sweep interval
+PAYMENT_EVENTS_TIMEOUT = int(os.environ.get('PAYMENT_EVENTS_TIMEOUT', 25))  # seconds
+PAYMENT_EVENTS_MAX_TIMEOUT = int(os.environ.get('PAYMENT_EVENTS_MAX_TIMEOUT', 60))
+PAYMENT_EVENTS_SWEEP_INTERVAL = int(os.environ.get('PAYMENT_EVENTS_SWEEP_INTERVAL', 2))
+# A payment still pending this many seconds after creation is checked with IntaSend
+# by the long-poll itself, in case neither the webhook nor the poller runs (0 disables)
+PAYMENT_EVENTS_CHECK_AFTER = int(os.environ.get('PAYMENT_EVENTS_CHECK_AFTER', 15))
+
+# Hotspot provisioning: a completed payment gets a hotspot user (and, with a known
+# MAC/IP, a logged-in session) on its router. Completions are batched per router;
+# failed attempts are retried with exponential backoff (python manage.py provision_payments
+# retries and resumes provisioning outside the web process)
+PAYMENT_PROVISIONING_ENABLED = os.environ.get('PAYMENT_PROVISIONING_ENABLED', 'True').lower() == 'true'
+PAYMENT_PROVISIONING_WORKERS = int(os.environ.get('PAYMENT_PROVISIONING_WORKERS', 4))  # routers provisioned at once
+PAYMENT_PROVISIONING_LINGER = int(os.environ.get('PAYMENT_PROVISIONING_LINGER', 1))  # seconds to collect a batch
+PAYMENT_PROVISIONING_MAX_ATTEMPTS = int(os.environ.get('PAYMENT_PROVISIONING_MAX_ATTEMPTS', 6))
+PAYMENT_PROVISIONING_BACKOFF = int(os.environ.get('PAYMENT_PROVISIONING_BACKOFF', 15))  # seconds, doubles per attempt
+PAYMENT_PROVISIONING_MAX_BACKOFF = int(os.environ.get('PAYMENT_PROVISIONING_MAX_BACKOFF', 900))
+
+# Expired access sweeper (python manage.py sweep_expired_access): removes the hotspot
+# users and sessions of expired packages from routers, checking every interval
+PAYMENT_EXPIRY_SWEEP_WORKERS = int(os.environ.get('PAYMENT_EXPIRY_SWEEP_WORKERS', 8))  # routers swept at once
+PAYMENT_EXPIRY_SWEEP_INTERVAL = int(os.environ.get('PAYMENT_EXPIRY_SWEEP_INTERVAL', 2))  # seconds
+
+# Router reconciliation (python manage.py reconcile_routers): routers' hotspot users are
+# compared with unexpired payments and corrected, this many routers at once and with
+# this many commands per batch
+ROUTER_RECONCILE_WORKERS = int(os.environ.get('ROUTER_RECONCILE_WORKERS', 8))
+ROUTER_RECONCILE_BATCH_SIZE = int(os.environ.get('ROUTER_RECONCILE_BATCH_SIZE', 500))
+
+# Package profiles: every active package is pushed to its router as a hotspot user
+# profile carrying its rate limit, in the background after a package is saved or
+# deleted (python manage.py sync_package_profiles syncs the whole fleet)
+ROUTER_PROFILE_SYNC_ON_SAVE = os.environ.get('ROUTER_PROFILE_SYNC_ON_SAVE', 'True').lower() == 'true'
+ROUTER_PROFILE_SYNC_WORKERS = int(os.environ.get('ROUTER_PROFILE_SYNC_WORKERS', 8))  # routers synced at once
+
+# Vouchers: batches of prepaid codes are uploaded to their router as generated import
+# scripts of at most VOUCHER_SCRIPT_MAX_LINES vouchers each, in the background
+VOUCHER_CODE_LENGTH = int(os.environ.get('VOUCHER_CODE_LENGTH', 8))
+VOUCHER_BATCH_MAX = int(os.environ.get('VOUCHER_BATCH_MAX', 10000))  # vouchers per batch
+VOUCHER_UPLOAD_WORKERS = int(os.environ.get('VOUCHER_UPLOAD_WORKERS', 2))  # batches uploaded at once
+VOUCHER_SCRIPT_MAX_LINES = int(os.environ.get('VOUCHER_SCRIPT_MAX_LINES', 5000))
+
+# RADIUS server (python manage.py radius_server): routers send hotspot logins and
+# accounting here instead of getting a hotspot user per payment. All routers share
+# RADIUS_SECRET and are recognised by their source address (Router.host)
+RADIUS_SECRET = os.environ.get('RADIUS_SECRET', '')
+RADIUS_HOST = os.environ.get('RADIUS_HOST', '0.0.0.0')
+RADIUS_AUTH_PORT = int(os.environ.get('RADIUS_AUTH_PORT', 1812))
+RADIUS_ACCT_PORT = int(os.environ.get('RADIUS_ACCT_PORT', 1813))
+RADIUS_REFRESH_INTERVAL = int(os.environ.get('RADIUS_REFRESH_INTERVAL', 2))  # seconds between incremental refreshes
+RADIUS_FULL_REFRESH_INTERVAL = int(os.environ.get('RADIUS_FULL_REFRESH_INTERVAL', 300))  # seconds between full reloads
+RADIUS_INTERIM_INTERVAL = int(os.environ.get('RADIUS_INTERIM_INTERVAL', 300))  # Acct-Interim-Interval, 0 to leave to the router
@@ -138,6 +138,35 @@ def health_check(request):
         "allowed_hosts": settings.ALLOWED_HOSTS,
     }
     
+    # Router connection pool and response cache counters
+    try:
+        from routers.mikrotik_api import client_pool, response_cache, circuit_breakers
+        mikrotik_info = {
+            "client_pool": client_pool.stats(),
+            "response_cache": response_cache.stats(),
+            "circuit_breakers": circuit_breakers.stats(),
+        }
+        from routers.async_mikrotik_api import async_client_pool
+        mikrotik_info["async_client_pool"] = async_client_pool.stats()
+        from .credentials import credential_cache
+        mikrotik_info["credential_cache"] = credential_cache.stats()
+        from payments.intasend_api import intasend_services, intasend_health, intasend_status
+        mikrotik_info["intasend_services"] = intasend_services.stats()
+        mikrotik_info["intasend_health"] = intasend_health.stats()
+        mikrotik_info["intasend_status"] = intasend_status.stats()
+        from payments.events import payment_events
+        mikrotik_info["payment_events"] = payment_events.stats()
+        from payments.stk_push import stk_push_queue
+        mikrotik_info["stk_push_queue"] = stk_push_queue.stats()
+        from routers.profile_sync import profile_sync
+        mikrotik_info["profile_sync"] = profile_sync.stats()
+        from payments.provisioning import hotspot_provisioner
+        mikrotik_info["hotspot_provisioner"] = hotspot_provisioner.stats()
+        from payments.vouchers import voucher_uploads
+        mikrotik_info["voucher_uploads"] = voucher_uploads.stats()
+    except Exception as e:
+        mikrotik_info = {"error": str(e)}
+    
     # Determine overall health status
     overall_status = "healthy"
     if db_status != "healthy" or cache_status != "healthy":
@@ -154,6 +183,7 @@ def health_check(request):
         "cache": cache_status,
         "system": system_info,
         "application": app_info,
+        "mikrotik": mikrotik_info,
     }
     
     # Return appropriate HTTP status code
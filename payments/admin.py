@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import PaymentCredentials, Payment
+from .models import PaymentCredentials, Payment, PaymentWebhookEvent, PaymentIdempotencyKey, PaymentProvisioning, VoucherBatch, Voucher, HotspotSession
 
 @admin.register(PaymentCredentials)
 class PaymentCredentialsAdmin(admin.ModelAdmin):
@@ -26,7 +26,7 @@ class PaymentCredentialsAdmin(admin.ModelAdmin):
             'fields': ('provider', 'environment', 'is_active')
         }),
         ('API Credentials', {
-            'fields': ('api_key',)
+            'fields': ('api_key', 'webhook_challenge')
         }),
         ('Security & Metadata', {
             'fields': ('encrypted_private_key_display', 'private_key_hash_display', 'created_at', 'updated_at'),
@@ -150,3 +150,174 @@ class PaymentAdmin(admin.ModelAdmin):
     
     is_expired.boolean = True
     is_expired.short_description = 'Expired'
+
+
+@admin.register(PaymentWebhookEvent)
+class PaymentWebhookEventAdmin(admin.ModelAdmin):
+    """Admin interface for PaymentWebhookEvent model"""
+    
+    list_display = [
+        'received_at', 'provider', 'invoice_id', 'state', 'outcome', 'payment'
+    ]
+    
+    list_filter = [
+        'provider', 'outcome', 'state', 'received_at'
+    ]
+    
+    search_fields = [
+        'invoice_id', 'payment__id', 'payment__phone_number'
+    ]
+    
+    readonly_fields = [
+        'provider', 'payment', 'invoice_id', 'state', 'payload', 'outcome', 'error_message', 'received_at'
+    ]
+    
+    def get_queryset(self, request):
+        """Optimize queryset with payment information"""
+        return super().get_queryset(request).select_related('payment')
+    
+    def has_add_permission(self, request):
+        """Webhook events are only created by the webhook endpoint"""
+        return False
+
+
+@admin.register(PaymentIdempotencyKey)
+class PaymentIdempotencyKeyAdmin(admin.ModelAdmin):
+    """Admin interface for PaymentIdempotencyKey model"""
+    
+    list_display = [
+        'created_at', 'user', 'endpoint', 'key', 'response_status', 'payment', 'expires_at'
+    ]
+    
+    list_filter = [
+        'endpoint', 'response_status', 'created_at'
+    ]
+    
+    search_fields = [
+        'key', 'user__username', 'payment__id'
+    ]
+    
+    readonly_fields = [
+        'user', 'endpoint', 'key', 'request_hash', 'payment', 'response_status', 'response_body', 'created_at', 'expires_at'
+    ]
+    
+    def get_queryset(self, request):
+        """Optimize queryset with user and payment information"""
+        return super().get_queryset(request).select_related('user', 'payment')
+    
+    def has_add_permission(self, request):
+        """Keys are only created by the payment initiation endpoints"""
+        return False
+
+
+@admin.register(PaymentProvisioning)
+class PaymentProvisioningAdmin(admin.ModelAdmin):
+    """Admin interface for PaymentProvisioning model"""
+    
+    list_display = [
+        'payment', 'username', 'status', 'logged_in', 'attempts', 'next_attempt_at', 'provisioned_at'
+    ]
+    
+    list_filter = [
+        'status', 'logged_in', 'provisioned_at'
+    ]
+    
+    search_fields = [
+        'username', 'payment__id', 'payment__router__name'
+    ]
+    
+    readonly_fields = [
+        'payment', 'username', 'password', 'logged_in', 'attempts', 'error_message', 'provisioned_at', 'revoked_at', 'created_at', 'updated_at'
+    ]
+    
+    def get_queryset(self, request):
+        """Optimize queryset with payment information"""
+        return super().get_queryset(request).select_related('payment')
+    
+    def has_add_permission(self, request):
+        """Provisioning is only created when a payment completes"""
+        return False
+
+
+@admin.register(VoucherBatch)
+class VoucherBatchAdmin(admin.ModelAdmin):
+    """Admin interface for VoucherBatch model"""
+    
+    list_display = [
+        'id', 'router', 'package', 'count', 'uploaded_count', 'status', 'created_at', 'completed_at'
+    ]
+    
+    list_filter = [
+        'status', 'created_at'
+    ]
+    
+    search_fields = [
+        'router__name', 'package__name', 'user__email'
+    ]
+    
+    readonly_fields = [
+        'uploaded_count', 'chunks', 'error_message', 'created_at', 'updated_at', 'completed_at'
+    ]
+    
+    def get_queryset(self, request):
+        """Optimize queryset with router and package information"""
+        return super().get_queryset(request).select_related('router', 'package')
+
+
+@admin.register(Voucher)
+class VoucherAdmin(admin.ModelAdmin):
+    """Admin interface for Voucher model"""
+    
+    list_display = [
+        'code', 'router', 'package', 'status', 'redeemed_at', 'expires_at'
+    ]
+    
+    list_filter = [
+        'status', 'redeemed_at'
+    ]
+    
+    search_fields = [
+        'code', 'mac_address', 'router__name'
+    ]
+    
+    readonly_fields = [
+        'batch', 'router', 'package', 'code', 'redeemed_at', 'expires_at', 'created_at'
+    ]
+    
+    def get_queryset(self, request):
+        """Optimize queryset with router and package information"""
+        return super().get_queryset(request).select_related('router', 'package')
+    
+    def has_add_permission(self, request):
+        """Vouchers are only created in batches"""
+        return False
+
+
+@admin.register(HotspotSession)
+class HotspotSessionAdmin(admin.ModelAdmin):
+    """Admin interface for HotspotSession model"""
+    
+    list_display = [
+        'username', 'router', 'mac_address', 'ip_address', 'status', 'session_time', 'started_at', 'stopped_at'
+    ]
+    
+    list_filter = [
+        'status', 'terminate_cause', 'started_at'
+    ]
+    
+    search_fields = [
+        'username', 'mac_address', 'session_id', 'router__name'
+    ]
+    
+    readonly_fields = [
+        'router', 'session_id', 'username', 'mac_address', 'ip_address', 'status', 'input_octets',
+        'output_octets', 'session_time', 'terminate_cause', 'started_at', 'updated_at', 'stopped_at'
+    ]
+    
+    def get_queryset(self, request):
+        """Optimize queryset with router information"""
+        return super().get_queryset(request).select_related('router')
+    
+    def has_add_permission(self, request):
+        """Sessions are only recorded from RADIUS accounting"""
+        return False
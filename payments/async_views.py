@@ -0,0 +1,160 @@
+"""Async payment endpoints
+
+``payment_status_events`` is a long-poll: the request is held until the payment
+settles or the timeout passes, so the captive portal makes one request
+instead of polling check-status every few seconds. Waiting requests are
+parked on payments.events.payment_events and hold no thread under ASGI.
+
+The webhook and the payment poller settle payments without being asked.
+So a portal does not hang when neither is running, a payment still
+pending PAYMENT_EVENTS_CHECK_AFTER seconds after it was created is also
+checked with IntaSend once per long-poll, through the shared single-flight
+status cache.
+
+Like the DRF payment views these use PublicKeyAuthentication; EventSource
+cannot send the X-Public-Key header, which is why this is a long-poll
+rather than a server-sent event stream.
+"""
+import logging
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+
+from .authentication import PublicKeyAuthentication
+from .events import payment_events
+from .intasend_api import IntaSendAPI, intasend_status
+from .models import Payment, PaymentProvisioning
+from .serializers import PaymentSerializer, PaymentProvisioningSerializer
+from .webhooks import apply_intasend_state
+
+logger = logging.getLogger(__name__)
+
+
+def _authenticate(request):
+    """Return (user, None) or (None, error message)"""
+    try:
+        user, _ = PublicKeyAuthentication().authenticate(Request(request))
+    except AuthenticationFailed as e:
+        return None, str(e.detail)
+    return user, None
+
+
+def async_public_key_view(methods):
+    """Require a valid X-Public-Key and one of ``methods`` for an async view"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return JsonResponse({
+                    'error': f'Method "{request.method}" not allowed.'
+                }, status=405)
+
+            user, error = await sync_to_async(_authenticate)(request)
+            if user is None:
+                return JsonResponse({'error': error}, status=401)
+
+            request.user = user
+            return await view(request, *args, **kwargs)
+
+        # Header-authenticated; see routers.async_views.async_jwt_view
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def _payment_state(payment_id, user):
+    """Serialized payment for the events response, or None"""
+    payment = Payment.objects.filter(pk=payment_id, user=user).first()
+    if payment is None:
+        return None
+
+    if payment.is_successful:
+        message = 'Payment completed successfully!'
+    elif payment.is_pending:
+        message = 'Payment is still being processed'
+    else:
+        message = f'Payment {payment.status}'
+
+    provisioning = None
+    if payment.is_successful:
+        record = PaymentProvisioning.objects.filter(payment=payment).first()
+        provisioning = PaymentProvisioningSerializer(record).data if record else None
+    
+    return {
+        'message': message,
+        'payment': PaymentSerializer(payment).data,
+        'provisioning': provisioning,
+        'status': payment.status,
+        'state': payment.intasend_state or 'UNKNOWN',
+        'settled': not payment.is_pending
+    }
+
+
+def _check_intasend(payment_id, user):
+    """Ask IntaSend about a payment pending longer than PAYMENT_EVENTS_CHECK_AFTER
+
+    Returns True if the payment's status changed. Concurrent checks of the
+    same payment (other waiters, check-status, the poller) share one call.
+    """
+    check_after = getattr(settings, 'PAYMENT_EVENTS_CHECK_AFTER', 15)
+    if check_after <= 0:
+        return False
+    payment = Payment.objects.filter(
+        pk=payment_id, user=user, status__in=Payment.PENDING_STATUSES, payment_provider='instasend',
+        created_at__lte=timezone.now() - timedelta(seconds=check_after),
+    ).exclude(intasend_payment_id='', intasend_invoice_id='').first()
+    if payment is None:
+        return False
+
+    try:
+        result, _ = intasend_status.check(
+            payment.pk, lambda: IntaSendAPI.for_user(user).check_payment_status(payment)
+        )
+    except Exception as e:
+        logger.warning("Status check for payment %s failed: %s", payment_id, e)
+        return False
+    if not result.get('success'):
+        return False
+    outcome, _ = apply_intasend_state(payment, result['state'])
+    return outcome == 'applied'
+
+
+@async_public_key_view(['GET'])
+async def payment_status_events(request, pk):
+    """Wait for a payment to settle (long-poll).
+
+    Returns as soon as the payment is completed/failed/cancelled, or after
+    ``timeout`` seconds with ``settled: false``; the client then asks again.
+    A payment pending for a while is checked with IntaSend before waiting.
+    """
+    default_timeout = getattr(settings, 'PAYMENT_EVENTS_TIMEOUT', 25)
+    max_timeout = getattr(settings, 'PAYMENT_EVENTS_MAX_TIMEOUT', 60)
+    try:
+        timeout = float(request.GET.get('timeout', default_timeout))
+    except ValueError:
+        return JsonResponse({
+            'error': 'timeout must be a number of seconds'
+        }, status=400)
+    timeout = min(max(timeout, 0), max_timeout)
+
+    waiter = payment_events.subscribe(pk)
+    try:
+        state = await sync_to_async(_payment_state)(pk, request.user)
+        if state is None:
+            return JsonResponse({
+                'error': 'Payment not found or access denied'
+            }, status=404)
+
+        if not state['settled'] and await sync_to_async(_check_intasend)(pk, request.user):
+            state = await sync_to_async(_payment_state)(pk, request.user)
+        if not state['settled'] and timeout > 0 and await payment_events.wait(pk, waiter, timeout):
+            state = await sync_to_async(_payment_state)(pk, request.user)
+        return JsonResponse(state)
+    finally:
+        payment_events.unsubscribe(pk, waiter)
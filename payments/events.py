@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Payment
+
+logger = logging.getLogger(__name__)
+
+SETTLED_STATUSES = ['completed', 'failed', 'cancelled']
+
+
+class PaymentEventHub:
+    """In-process fan-out of "payment settled" notifications
+
+    Waiters (the /payments/<id>/events/ long-poll requests) park an asyncio
+    future per payment, so a waiting client costs a future and a dict entry.
+    Payments settled in this process (webhook, check-status) are published
+    from a payment_status_changed receiver. Payments settled elsewhere (the
+    poller or another worker process) are picked up by a single sweeper
+    thread that checks all waited-on payments in one query every
+    ``sweep_interval`` seconds. The thread only runs while someone is
+    waiting.
+
+    Each waiter is woken at most once; it then reads the payment itself.
+    """
+
+    def __init__(self, sweep_interval=2):
+        self.sweep_interval = sweep_interval
+        self._waiters = defaultdict(list)
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.published = 0
+        self.swept = 0
+
+    def subscribe(self, payment_id):
+        """Register a waiter on the running loop and return its future
+
+        Subscribe before reading the payment, so a settlement between the
+        read and the wait is not missed.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._waiters[str(payment_id)].append((loop, future))
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(
+                    target=self._sweep, name='payment-events', daemon=True
+                )
+                self._sweeper.start()
+        return future
+
+    def unsubscribe(self, payment_id, future):
+        key = str(payment_id)
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if not waiters:
+                return
+            waiters[:] = [w for w in waiters if w[1] is not future]
+            if not waiters:
+                del self._waiters[key]
+
+    async def wait(self, payment_id, future, timeout):
+        """Wait until the payment is published or ``timeout`` passes; True if published"""
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.unsubscribe(payment_id, future)
+
+    def publish(self, payment_id):
+        """Wake everyone waiting on the payment; safe to call from any thread"""
+        with self._lock:
+            waiters = self._waiters.pop(str(payment_id), [])
+            self.published += len(waiters)
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                # The waiter's loop is already closed
+                pass
+        return len(waiters)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'payments': len(self._waiters),
+                'waiters': sum(len(waiters) for waiters in self._waiters.values()),
+                'sweeper_running': self._sweeper is not None,
+                'published': self.published,
+                'swept': self.swept,
+                'sweep_interval': self.sweep_interval,
+            }
+
+    def _sweep(self):
+        """Publish payments settled outside this process; exits when nobody waits"""
+        while True:
+            time.sleep(self.sweep_interval)
+            with self._lock:
+                ids = list(self._waiters)
+                if not ids:
+                    self._sweeper = None
+                    return
+
+            try:
+                settled = Payment.objects.filter(
+                    pk__in=ids, status__in=SETTLED_STATUSES
+                ).values_list('pk', flat=True)
+                for payment_id in settled:
+                    self.swept += 1
+                    self.publish(payment_id)
+            except Exception:
+                logger.exception("Payment event sweep failed")
+            finally:
+                connections.close_all()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+payment_events = PaymentEventHub(
+    sweep_interval=getattr(settings, 'PAYMENT_EVENTS_SWEEP_INTERVAL', 2),
+)
@@ -0,0 +1,272 @@
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from routers import hotspot
+from routers.mikrotik_api import MikrotikAPIManager
+from .models import PaymentProvisioning, Voucher
+
+logger = logging.getLogger(__name__)
+
+# Provisioning rows whose hotspot user may exist (or is about to) on the router
+LIVE_STATUSES = ['pending', 'running', 'provisioned']
+
+
+class ExpiredAccessSweeper:
+    """Takes hotspot access away once a payment's package expires
+
+    Every ``interval`` seconds the sweeper reads the provisioned payments
+    whose ``package_expiry_time`` passed since the previous pass. That is a
+    range scan of the package_expiry_time index, so a pass costs what has
+    just expired rather than what is still active. Every
+    ``full_scan_interval`` seconds the lower bound is dropped to catch up on
+    anything missed (failed removals, a sweeper that was not running).
+
+    Expired users are grouped by router and removed ``workers`` routers at a
+    time: one read of the router's active sessions, then one batch removing
+    the hotspot users followed by their sessions. A customer who still holds
+    another unexpired payment on the router keeps the user. Rows are marked
+    revoked once the router confirms; failed routers are retried next pass.
+
+    Redeemed vouchers whose ``expires_at`` passed are swept the same way,
+    by the status/expires_at index, and marked expired.
+    """
+
+    # Expiries this close behind the previous pass are read again, in case they committed late
+    OVERLAP = 60
+
+    def __init__(self, workers=None, interval=None, full_scan_interval=300, batch_size=1000):
+        self.workers = workers or getattr(settings, 'PAYMENT_EXPIRY_SWEEP_WORKERS', 8)
+        self.interval = interval or getattr(settings, 'PAYMENT_EXPIRY_SWEEP_INTERVAL', 2)
+        self.full_scan_interval = full_scan_interval
+        self.batch_size = batch_size
+        self._swept_until = None
+        self._last_full_scan = 0
+
+    def run_forever(self, stdout=None):
+        """Sweep expired access until interrupted"""
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='expiry-sweeper') as executor:
+            while True:
+                started = time.monotonic()
+                summary = self.run_once(executor)
+                if stdout and (summary['expired'] or summary['errors']):
+                    stdout.write(self.format_summary(summary))
+                time.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    def run_once(self, executor=None, full=False):
+        """Revoke access for every payment and voucher that expired since the last pass (or ever, when ``full``)"""
+        now = timezone.now()
+        clock = time.monotonic()
+        if self._swept_until is None or clock - self._last_full_scan >= self.full_scan_interval:
+            full = True
+
+        summary = {
+            'expired': 0, 'expired_vouchers': 0, 'routers': 0, 'removed_users': 0, 'removed_sessions': 0,
+            'kept': 0, 'errors': 0, 'cancelled': self._cancel_unprovisioned(now),
+        }
+
+        after = None if full else (self._swept_until - timedelta(seconds=self.OVERLAP), 0)
+        summary['expired'] = self._sweep(
+            executor, summary, lambda after: self._due(now, after), self._revoke_group, after,
+            key=lambda record: (record.payment.package_expiry_time, record.pk),
+            router_id=lambda record: record.payment.router_id,
+        )
+        summary['expired_vouchers'] = self._sweep(
+            executor, summary, lambda after: self._due_vouchers(now, after), self._expire_voucher_group, after,
+            key=lambda voucher: (voucher.expires_at, voucher.pk),
+            router_id=lambda voucher: voucher.router_id,
+        )
+
+        self._swept_until = now
+        if full:
+            self._last_full_scan = clock
+        return summary
+
+    def _sweep(self, executor, summary, due, revoke_group, after, key, router_id):
+        """Page through ``due(after)`` and revoke each page per router; returns the rows read"""
+        expired = 0
+        while True:
+            records = due(after)
+            if not records:
+                break
+            after = key(records[-1])
+            expired += len(records)
+
+            by_router = defaultdict(list)
+            for record in records:
+                by_router[router_id(record)].append(record)
+            summary['routers'] += len(by_router)
+
+            if executor is None:
+                with ThreadPoolExecutor(max_workers=min(self.workers, len(by_router))) as pool:
+                    outcomes = list(pool.map(revoke_group, by_router.values()))
+            else:
+                outcomes = list(executor.map(revoke_group, by_router.values()))
+            for outcome in outcomes:
+                for name, count in outcome.items():
+                    summary[name] += count
+
+            if len(records) < self.batch_size:
+                break
+        return expired
+
+    @staticmethod
+    def format_summary(summary):
+        return (
+            f"Expired {summary['expired']} payments and {summary['expired_vouchers']} vouchers "
+            f"on {summary['routers']} routers: "
+            f"{summary['removed_users']} users and {summary['removed_sessions']} sessions removed, "
+            f"{summary['kept']} kept for newer payments, {summary['errors']} errors, "
+            f"{summary['cancelled']} unprovisioned cancelled"
+        )
+
+    def revoke(self, router, records, now=None):
+        """Remove the hotspot users and sessions of ``records`` (all for ``router``)
+
+        Returns (summary counts, error); on error nothing is marked revoked.
+        """
+        now = now or timezone.now()
+        names = {record.username for record in records}
+        renewed = set(
+            PaymentProvisioning.objects.filter(
+                payment__router_id=router.pk,
+                username__in=names,
+                status__in=LIVE_STATUSES,
+                payment__status='completed',
+                payment__package_expiry_time__gt=now,
+            ).values_list('username', flat=True)
+        )
+        remove = sorted(names - renewed)
+        counts = {'removed_users': 0, 'removed_sessions': 0, 'kept': len(names) - len(remove)}
+        if not remove:
+            return counts, None
+
+        removed_sessions, error = self._remove(router, remove)
+        if error:
+            return counts, error
+        counts['removed_users'] = len(remove)
+        counts['removed_sessions'] = removed_sessions
+        return counts, None
+
+    def revoke_vouchers(self, router, vouchers):
+        """Remove the hotspot users and sessions of expired ``vouchers`` (all for ``router``)
+
+        The user of a voucher is its code. Vouchers redeemed over RADIUS have
+        no user on the router, only sessions. Returns (summary counts, error).
+        """
+        codes = sorted({voucher.code for voucher in vouchers})
+        removed_sessions, error = self._remove(router, codes)
+        if error:
+            return {'removed_users': 0, 'removed_sessions': 0}, error
+        return {'removed_users': len(codes), 'removed_sessions': removed_sessions}, None
+
+    @staticmethod
+    def _remove(router, names):
+        """Remove hotspot users ``names`` and their sessions; returns (sessions removed, error)"""
+        result = MikrotikAPIManager.execute_batch(router, [
+            {'command': 'ip/hotspot/active', 'params': {'.proplist': '.id,user'}},
+        ])
+        if not result['success']:
+            return 0, result.get('error') or result['steps'][0]['error']
+        active = hotspot.as_rows(result['steps'][0]['result'])
+        removing = set(names)
+        sessions = [session['.id'] for session in active if session.get('user') in removing]
+
+        # Users first, so a removed session cannot log straight back in
+        steps = [
+            {'command': 'ip/hotspot/user/remove', 'method': 'POST', 'data': {'numbers': name}}
+            for name in names
+        ]
+        if sessions:
+            steps.append({
+                'command': 'ip/hotspot/active/remove',
+                'method': 'POST',
+                'data': {'numbers': ','.join(sessions)},
+            })
+        result = MikrotikAPIManager.execute_batch(router, steps)
+        if not result['steps']:
+            return 0, result['error']
+
+        for line in result['steps']:
+            # A user or session already removed on the router is not an error
+            if not line['success'] and 'no such item' not in str(line.get('error', '')):
+                return 0, line['error']
+        return len(sessions), None
+
+    def _due(self, now, after):
+        """Provisioned payments that expired after ``after`` (expiry, pk) and by ``now``, oldest first"""
+        records = PaymentProvisioning.objects.filter(
+            status='provisioned', payment__package_expiry_time__lte=now
+        )
+        if after is not None:
+            expiry, pk = after
+            records = records.filter(
+                Q(payment__package_expiry_time__gt=expiry) |
+                Q(payment__package_expiry_time=expiry, pk__gt=pk)
+            )
+        return list(
+            records.select_related('payment__router')
+            .only('id', 'username', 'status', 'payment__router', 'payment__package_expiry_time')
+            .order_by('payment__package_expiry_time', 'pk')[:self.batch_size]
+        )
+
+    def _due_vouchers(self, now, after):
+        """Redeemed vouchers that expired after ``after`` (expiry, pk) and by ``now``, oldest first"""
+        vouchers = Voucher.objects.filter(status='redeemed', expires_at__lte=now)
+        if after is not None:
+            expiry, pk = after
+            vouchers = vouchers.filter(Q(expires_at__gt=expiry) | Q(expires_at=expiry, pk__gt=pk))
+        return list(
+            vouchers.select_related('router')
+            .only('id', 'code', 'status', 'router', 'expires_at')
+            .order_by('expires_at', 'pk')[:self.batch_size]
+        )
+
+    @staticmethod
+    def _cancel_unprovisioned(now):
+        """Stop provisioning payments that expired before they were provisioned"""
+        return PaymentProvisioning.objects.filter(
+            status__in=['pending', 'failed'], payment__package_expiry_time__lte=now
+        ).update(status='revoked', revoked_at=now, updated_at=now)
+
+    def _revoke_group(self, records):
+        router = records[0].payment.router
+        now = timezone.now()
+        try:
+            counts, error = self.revoke(router, records, now)
+            if error:
+                logger.warning("Removing expired hotspot users from router %s failed: %s", router.pk, error)
+                return dict(counts, errors=len(records))
+            PaymentProvisioning.objects.filter(
+                pk__in=[record.pk for record in records], status='provisioned'
+            ).update(status='revoked', revoked_at=now, updated_at=now)
+            return dict(counts, errors=0)
+        except Exception:
+            logger.exception("Expiry sweep on router %s crashed", router.pk)
+            return {'errors': len(records)}
+        finally:
+            connections.close_all()
+
+    def _expire_voucher_group(self, vouchers):
+        router = vouchers[0].router
+        try:
+            counts, error = self.revoke_vouchers(router, vouchers)
+            if error:
+                logger.warning("Removing expired vouchers from router %s failed: %s", router.pk, error)
+                return dict(counts, errors=len(vouchers))
+            Voucher.objects.filter(
+                pk__in=[voucher.pk for voucher in vouchers], status='redeemed'
+            ).update(status='expired')
+            return dict(counts, errors=0)
+        except Exception:
+            logger.exception("Voucher expiry sweep on router %s crashed", router.pk)
+            return {'errors': len(vouchers)}
+        finally:
+            connections.close_all()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import PaymentIdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+# Request fields that identify "the same purchase" when no Idempotency-Key is sent
+DERIVED_KEY_FIELDS = ['router_id', 'package_id', 'phone_number', 'mac_address']
+
+
+def request_hash(data):
+    """SHA-256 of the request body, independent of key order"""
+    body = json.dumps(dict(data.items()), sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def derived_key(data):
+    """Key for clients that send no Idempotency-Key: the purchase itself"""
+    parts = '|'.join(str(data.get(field) or '').strip().lower() for field in DERIVED_KEY_FIELDS)
+    return 'derived:' + hashlib.sha256(parts.encode()).hexdigest()
+
+
+def _claim(user, endpoint, key, body_hash, ttl):
+    """Create the key row for this request, or return the existing one
+
+    Returns (record, created). An expired row is replaced.
+    """
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                record = PaymentIdempotencyKey.objects.create(
+                    user=user,
+                    endpoint=endpoint,
+                    key=key,
+                    request_hash=body_hash,
+                    expires_at=timezone.now() + timedelta(seconds=ttl)
+                )
+            return record, True
+        except IntegrityError:
+            record = PaymentIdempotencyKey.objects.filter(user=user, endpoint=endpoint, key=key).first()
+            if record is None:
+                continue
+            if not record.is_expired:
+                return record, False
+            PaymentIdempotencyKey.objects.filter(pk=record.pk, expires_at__lt=timezone.now()).delete()
+    return record, False
+
+
+def idempotent(endpoint):
+    """Replay the first response for retried payment initiation requests
+
+    Requests are matched by the ``Idempotency-Key`` header, kept for
+    PAYMENT_IDEMPOTENCY_KEY_TTL seconds. Requests without the header are
+    matched by router, package, phone number and MAC address for
+    PAYMENT_IDEMPOTENCY_WINDOW seconds. The first request runs the view. A
+    retry of a finished request gets the stored response (with an
+    ``Idempotent-Replayed: true`` header) without a new Payment or a second
+    IntaSend call. A retry that arrives while the first request is still
+    running gets 409. Reusing a header key with a different body gets 422.
+
+    Only successful (2xx) responses are stored; after an error the key is
+    released so the client can simply try again.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not request.user or request.user.is_anonymous:
+                return view(request, *args, **kwargs)
+
+            header_key = request.headers.get('Idempotency-Key', '').strip()
+            if len(header_key) > 255:
+                return Response({
+                    'error': 'Idempotency-Key must be at most 255 characters'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            if header_key:
+                key, ttl = header_key, getattr(settings, 'PAYMENT_IDEMPOTENCY_KEY_TTL', 86400)
+            else:
+                key, ttl = derived_key(request.data), getattr(settings, 'PAYMENT_IDEMPOTENCY_WINDOW', 120)
+            body_hash = request_hash(request.data)
+
+            record, created = _claim(request.user, endpoint, key, body_hash, ttl)
+            if not created:
+                return _replay(record, body_hash, check_body=bool(header_key))
+
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+
+            if not 200 <= response.status_code < 300:
+                record.delete()
+                return response
+
+            payment_id = (response.data.get('payment') or {}).get('id') if isinstance(response.data, dict) else None
+            record.payment_id = payment_id
+            record.response_status = response.status_code
+            record.response_body = response.data
+            try:
+                record.save(update_fields=['payment', 'response_status', 'response_body'])
+            except Exception:
+                # The response is still correct; only replays are lost
+                logger.exception("Failed to store idempotent response for key %s", key)
+            return response
+
+        return wrapper
+    return decorator
+
+
+def _replay(record, body_hash, check_body):
+    if record is None:
+        return Response({
+            'error': 'A request with this Idempotency-Key is still being processed'
+        }, status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+
+    # Derived keys cover the identifying fields only, so other fields may differ
+    if check_body and record.request_hash != body_hash:
+        return Response({
+            'error': 'Idempotency-Key was already used with a different request'
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    if record.response_status is None:
+        return Response({
+            'error': 'A request with this Idempotency-Key is still being processed'
+        }, status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+
+    return Response(
+        record.response_body,
+        status=record.response_status,
+        headers={'Idempotent-Replayed': 'true'}
+    )
@@ -1,20 +1,59 @@
 from django.conf import settings
+from django.utils import timezone
 from .models import PaymentCredentials
 from intasend import APIService
+from intasend.exceptions import IntaSendBadRequest, IntaSendNotAllowed, IntaSendUnauthorized
+from collections import OrderedDict
+from urllib3.exceptions import NewConnectionError
+import requests
+import threading
+import time
+
+
+def get_latest_intasend_credentials(user):
+    """Get the latest active IntaSend credentials for the user, or None"""
+    try:
+        return PaymentCredentials.objects.filter(
+            user=user,
+            provider='instasend',
+            is_active=True
+        ).latest('created_at')
+    except PaymentCredentials.DoesNotExist:
+        return None
+
+
+def stk_push_outcome(error):
+    """What an exception from an STK push call says about the push
+
+    'unsent' when the connection to IntaSend was never made (safe to send
+    again), 'rejected' when IntaSend answered with an error (no prompt was
+    sent), and 'unknown' for anything else: a read timeout or a failure
+    after the call may come after IntaSend already prompted the phone.
+    """
+    if isinstance(error, (IntaSendBadRequest, IntaSendNotAllowed, IntaSendUnauthorized)):
+        return 'rejected'
+    if isinstance(error, requests.ConnectTimeout):
+        return 'unsent'
+    if isinstance(error, requests.ConnectionError):
+        reason = getattr(error.args[0] if error.args else None, 'reason', None)
+        if isinstance(reason, NewConnectionError):
+            return 'unsent'
+    return 'unknown'
 
 
 class IntaSendAPI:
     """IntaSend API integration class using official SDK"""
     
-    def __init__(self, user):
+    def __init__(self, user, credentials=None):
         """
         Initialize IntaSend API with user
         
         Args:
             user: User instance to get credentials for
+            credentials: PaymentCredentials to use (defaults to the user's latest active ones)
         """
         self.user = user
-        self.credentials = self._get_latest_credentials()
+        self.credentials = credentials or self._get_latest_credentials()
         
         if not self.credentials:
             raise ValueError("No active IntaSend credentials found for this user")
@@ -42,39 +81,27 @@ class IntaSendAPI:
             publishable_key=self.api_key,
             test=self.sandbox
         )
-        
-        # Test API connectivity
-        self._test_api_connection()
     
-    def _test_api_connection(self):
-        """Test if we can connect to IntaSend API using SDK"""
+    @classmethod
+    def for_user(cls, user):
+        """Return a ready-to-use IntaSendAPI for the user from the service cache"""
+        return intasend_services.get(user)
+    
+    def check_connectivity(self):
+        """Make a live authenticated call to IntaSend; returns (ok, error)
+        
+        Not called on normal payment requests; use intasend_health.check()
+        for a cached, rate-limited result.
+        """
         try:
-            # Test SDK initialization
-            if self.service:
-                # Test a simple API call to verify connectivity
-                try:
-                    # Try to get payment requests (this will test authentication)
-                    response = self.service.collect.get_payment_requests()
-                    # If we get here, connection is successful
-                    pass
-                except Exception as e:
-                    # Connection test failed, but don't raise error
-                    pass
-                    
+            self.service.collect.get_payment_requests()
+            return True, None
         except Exception as e:
-            # Connection test failed, but don't raise error
-            pass
+            return False, str(e)
     
     def _get_latest_credentials(self):
         """Get the latest active IntaSend credentials for the user"""
-        try:
-            return PaymentCredentials.objects.filter(
-                user=self.user,
-                provider='instasend',
-                is_active=True
-            ).latest('created_at')
-        except PaymentCredentials.DoesNotExist:
-            return None
+        return get_latest_intasend_credentials(self.user)
     
     def create_payment_link(self, payment):
         """Create a payment link for the given payment using IntaSend SDK"""
@@ -110,7 +137,7 @@ class IntaSendAPI:
             if hasattr(response, 'state'):
                 payment.intasend_state = response.state
             if hasattr(response, 'url'):
-                payment.save()
+                payment.save(update_fields=['intasend_invoice_id', 'intasend_state', 'updated_at'])
             
             return {
                 'success': True,
@@ -169,8 +196,8 @@ class IntaSendAPI:
                     if hasattr(invoice, 'state'):
                         payment.intasend_state = invoice.state
             
-            payment.status = 'processing'
-            payment.save()
+            payment.save(update_fields=['intasend_payment_id', 'intasend_invoice_id', 'intasend_state', 'updated_at'])
+            payment.mark_processing()
             
             # Return the extracted data
             invoice_id = None
@@ -191,7 +218,8 @@ class IntaSendAPI:
             print(f"Error initiating STK push: {str(e)}")
             return {
                 'success': False,
-                'error': str(e)
+                'error': str(e),
+                'outcome': stk_push_outcome(e)
             }
     
     def check_payment_status(self, payment):
@@ -303,10 +331,10 @@ class IntaSendAPI:
         try:
             from django.contrib.sites.models import Site
             site = Site.objects.get_current()
-            return f"https://{site.domain}/api/payments/webhook/"
+            return f"https://{site.domain}/payments/webhook/"
         except (ImportError, Exception):
             # Fallback to a generic webhook URL
-            return "https://yourdomain.com/api/payments/webhook/"
+            return "https://yourdomain.com/payments/webhook/"
     
     def _get_success_url(self, payment_id):
         """Get the success URL"""
@@ -335,3 +363,232 @@ class IntaSendAPI:
         except (ImportError, Exception):
             # Fallback to a generic failure URL
             return f"https://yourdomain.com/payment/failed/{payment_id}/"
+
+
+class IntaSendServiceCache:
+    """Process-wide cache of ready-to-use IntaSendAPI instances
+    
+    Keyed by (user id, credentials id, credentials updated_at), so editing or
+    rotating credentials builds a fresh service on the next request, in every
+    process. A hit costs one indexed credentials lookup instead of a private
+    key decryption plus SDK setup. Bounded by ``max_entries`` (LRU).
+    """
+    
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, user):
+        """Return the IntaSendAPI for the user's latest active credentials"""
+        credentials = get_latest_intasend_credentials(user)
+        if not credentials:
+            raise ValueError("No active IntaSend credentials found for this user")
+        return self.for_credentials(credentials, user=user)
+    
+    def for_credentials(self, credentials, user=None):
+        """Return the IntaSendAPI for a specific credentials row"""
+        key = (credentials.user_id, credentials.pk, credentials.updated_at)
+        with self._lock:
+            api = self._entries.get(key)
+            if api is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return api
+            self.misses += 1
+        
+        api = IntaSendAPI(user or credentials.user, credentials=credentials)
+        with self._lock:
+            # Older versions of these credentials will never be asked for again
+            for stale in [k for k in self._entries if k[1] == credentials.pk]:
+                del self._entries[stale]
+            self._entries[key] = api
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return api
+    
+    def evict(self, credentials_id):
+        """Drop the cached service for a credentials row"""
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == credentials_id]:
+                del self._entries[key]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class _StatusFlight:
+    """One in-progress upstream status call that others can wait on"""
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.fetched_at = None
+
+
+class IntaSendStatusCache:
+    """Single-flight, short-TTL cache of IntaSend payment status results
+    
+    Concurrent status checks for the same payment (repeated taps, two tabs,
+    the poller) share one upstream call. Successful results are then reused
+    for ``ttl`` seconds. Callers get the result together with its age, so
+    responses can say how fresh the state is. Failed calls are shared with
+    the callers already waiting on them but are not cached.
+    """
+    
+    def __init__(self, ttl=5, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+    
+    def check(self, payment_id, fetch):
+        """Return (result, age in seconds) for the payment
+        
+        ``fetch`` makes the upstream call and returns a check_payment_status()
+        style result; it only runs when there is no fresh result and no call
+        already in flight. Exceptions raised by ``fetch`` propagate to the
+        caller that ran it.
+        """
+        key = str(payment_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], now - entry[1]
+            
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _StatusFlight()
+                self.misses += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        
+        if not leader:
+            flight.event.wait()
+            return flight.result, time.monotonic() - flight.fetched_at
+        
+        flight.result = {'success': False, 'error': 'Status check was interrupted'}
+        try:
+            flight.result = fetch()
+        except Exception as e:
+            flight.result = {'success': False, 'error': str(e)}
+            raise
+        finally:
+            flight.fetched_at = time.monotonic()
+            with self._lock:
+                self._flights.pop(key, None)
+                if flight.result.get('success') and self.ttl > 0:
+                    self._entries[key] = (flight.result, flight.fetched_at)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            flight.event.set()
+        return flight.result, 0.0
+    
+    def forget(self, payment_id):
+        with self._lock:
+            self._entries.pop(str(payment_id), None)
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'size': len(self._entries),
+                'in_flight': len(self._flights),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_rate': round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+                'ttl': self.ttl,
+            }
+
+
+class IntaSendHealthProbe:
+    """Cached, rate-limited IntaSend connectivity check
+    
+    Each credentials row is probed with a live API call at most once per
+    ``interval`` seconds; callers in between get the last result. While a
+    probe is running, concurrent callers get the previous result (or
+    ``None`` for ``ok`` if there is none yet) instead of probing again.
+    """
+    
+    def __init__(self, interval=300):
+        self.interval = interval
+        self._results = {}
+        self._probing = set()
+        self._lock = threading.Lock()
+    
+    def check(self, api):
+        """Return {'ok', 'error', 'checked_at', 'cached'} for the api's credentials"""
+        key = api.credentials.pk
+        now = time.monotonic()
+        with self._lock:
+            result = self._results.get(key)
+            fresh = result is not None and now - result['_at'] < self.interval
+            if fresh or key in self._probing:
+                return self._public(result, cached=True)
+            self._probing.add(key)
+        
+        try:
+            ok, error = api.check_connectivity()
+            result = {'ok': ok, 'error': error, 'checked_at': timezone.now().isoformat(), '_at': time.monotonic()}
+            with self._lock:
+                self._results[key] = result
+        finally:
+            with self._lock:
+                self._probing.discard(key)
+        return self._public(result, cached=False)
+    
+    def forget(self, credentials_id):
+        with self._lock:
+            self._results.pop(credentials_id, None)
+    
+    def stats(self):
+        with self._lock:
+            results = list(self._results.values())
+        return {
+            'tracked': len(results),
+            'failing': sum(1 for r in results if not r['ok']),
+        }
+    
+    @staticmethod
+    def _public(result, cached):
+        if result is None:
+            return {'ok': None, 'error': None, 'checked_at': None, 'cached': cached}
+        return {'ok': result['ok'], 'error': result['error'], 'checked_at': result['checked_at'], 'cached': cached}
+
+
+intasend_services = IntaSendServiceCache(
+    max_entries=getattr(settings, 'INTASEND_SERVICE_CACHE_MAX_ENTRIES', 256),
+)
+
+intasend_health = IntaSendHealthProbe(
+    interval=getattr(settings, 'INTASEND_HEALTH_PROBE_INTERVAL', 300),
+)
+
+intasend_status = IntaSendStatusCache(
+    ttl=getattr(settings, 'INTASEND_STATUS_CACHE_TTL', 5),
+    max_entries=getattr(settings, 'INTASEND_STATUS_CACHE_MAX_ENTRIES', 1024),
+)
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from payments.poller import PendingPaymentPoller
+
+
+class Command(BaseCommand):
+    help = 'Continuously check pending IntaSend payments and settle or expire them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Check every pending payment once and exit',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Maximum number of IntaSend status calls in flight',
+        )
+        parser.add_argument(
+            '--per-owner',
+            type=int,
+            help='Maximum number of status calls in flight per credentials owner',
+        )
+        parser.add_argument(
+            '--expire-after',
+            type=int,
+            help='Mark payments failed if still unconfirmed after this many seconds',
+        )
+
+    def handle(self, *args, **options):
+        poller = PendingPaymentPoller(
+            workers=options['workers'],
+            per_owner=options['per_owner'],
+            expire_after=options['expire_after'],
+        )
+
+        if options['once']:
+            summary = poller.run_once(force=True)
+            self.stdout.write(self.style.SUCCESS(poller.format_summary(summary)))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Polling pending payments with {poller.workers} workers '
+            f'(expire after {poller.expire_after}s)'
+        ))
+        try:
+            poller.run_forever(stdout=self.stdout)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Payment poller stopped'))
@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from payments.models import PaymentProvisioning
+from payments.provisioning import HotspotProvisioner, hotspot_provisioner
+
+
+class Command(BaseCommand):
+    help = 'Grant hotspot access for completed payments whose provisioning is due or failed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Provision everything that is due once and exit',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Maximum number of routers provisioned at once',
+        )
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Give payments whose provisioning failed a fresh set of attempts',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=5,
+            help='Seconds between passes',
+        )
+
+    def handle(self, *args, **options):
+        provisioner = HotspotProvisioner(
+            workers=options['workers'] or hotspot_provisioner.workers,
+            max_attempts=hotspot_provisioner.max_attempts,
+            backoff=hotspot_provisioner.backoff,
+            max_backoff=hotspot_provisioner.max_backoff,
+        )
+
+        if options['retry_failed']:
+            count = PaymentProvisioning.objects.filter(status='failed').update(
+                status='pending', attempts=0, next_attempt_at=timezone.now(), updated_at=timezone.now()
+            )
+            self.stdout.write(f'Retrying {count} failed provisioning records')
+
+        if options['once']:
+            summary = provisioner.run_due()
+            self.stdout.write(self.style.SUCCESS(provisioner.format_summary(summary)))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Provisioning completed payments with {provisioner.workers} workers'
+        ))
+        try:
+            with ThreadPoolExecutor(max_workers=provisioner.workers, thread_name_prefix='provisioning') as executor:
+                while True:
+                    summary = provisioner.run_due(executor)
+                    if summary['routers']:
+                        self.stdout.write(provisioner.format_summary(summary))
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Provisioning stopped'))
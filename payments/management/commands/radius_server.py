@@ -0,0 +1,52 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from payments.radius import RadiusServer
+
+
+class Command(BaseCommand):
+    help = 'Run the RADIUS server that authorizes hotspot logins from paid packages and vouchers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--host',
+            default=getattr(settings, 'RADIUS_HOST', '0.0.0.0'),
+            help='Address to listen on',
+        )
+        parser.add_argument(
+            '--auth-port',
+            type=int,
+            default=getattr(settings, 'RADIUS_AUTH_PORT', 1812),
+            help='UDP port for Access-Request',
+        )
+        parser.add_argument(
+            '--acct-port',
+            type=int,
+            default=getattr(settings, 'RADIUS_ACCT_PORT', 1813),
+            help='UDP port for Accounting-Request',
+        )
+
+    def handle(self, *args, **options):
+        secret = getattr(settings, 'RADIUS_SECRET', '')
+        if not secret:
+            raise CommandError('Set RADIUS_SECRET to the secret configured on the routers')
+
+        server = RadiusServer(
+            secret,
+            refresh_interval=getattr(settings, 'RADIUS_REFRESH_INTERVAL', 2),
+            full_refresh_interval=getattr(settings, 'RADIUS_FULL_REFRESH_INTERVAL', 300),
+            interim_interval=getattr(settings, 'RADIUS_INTERIM_INTERVAL', 300),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"RADIUS server listening on {options['host']} "
+            f"(auth {options['auth_port']}, accounting {options['acct_port']})"
+        ))
+        try:
+            asyncio.run(server.serve(
+                options['host'], options['auth_port'], options['acct_port'], stdout=self.stdout
+            ))
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('RADIUS server stopped'))
+        except OSError as e:
+            raise CommandError(f'Could not listen: {e}')
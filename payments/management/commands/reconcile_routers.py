@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from payments.reconcile import RouterReconciler
+from routers.models import Router
+
+
+class Command(BaseCommand):
+    help = 'Make routers\' hotspot users match the unexpired payments in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--router',
+            type=int,
+            action='append',
+            dest='routers',
+            help='Router id to reconcile (repeatable; default all routers)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the changes without applying them',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Maximum number of routers reconciled at the same time',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Commands per batch sent to a router',
+        )
+
+    def handle(self, *args, **options):
+        reconciler = RouterReconciler(workers=options['workers'], batch_size=options['batch_size'])
+        routers = Router.objects.all()
+        if options['routers']:
+            routers = routers.filter(pk__in=options['routers'])
+        dry_run = options['dry_run']
+
+        failed = 0
+        for report in reconciler.reconcile_fleet(routers, dry_run=dry_run):
+            router = report['router']
+            if report.get('error'):
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'{router.name} ({router.pk}): {report["error"]}'))
+                continue
+
+            self.stdout.write(
+                f'{router.name} ({router.pk}): {report["router_users"]} users, '
+                f'{report["router_sessions"]} sessions; '
+                f'{len(report["add"])} to add, {len(report["update"])} to update, '
+                f'{len(report["remove_users"])} users and {len(report["remove_sessions"])} sessions to remove, '
+                f'{report["unchanged"]} in sync'
+            )
+            if dry_run:
+                for step in report['profiles']:
+                    self.stdout.write(f'  profile {step["data"]["name"]}: rate-limit {step["data"]["rate-limit"]}')
+                for name in report['add']:
+                    self.stdout.write(f'  + {name}')
+                for name, changes in report['update'].items():
+                    self.stdout.write(f'  ~ {name} ({", ".join(changes)})')
+                for name in report['remove_users']:
+                    self.stdout.write(f'  - {name}')
+                for session in report['remove_sessions']:
+                    self.stdout.write(f'  - session {session}')
+            else:
+                self.stdout.write(f'  applied {report["applied"]} changes')
+                for error in report['errors']:
+                    self.stdout.write(self.style.WARNING(f'  {error}'))
+                failed += bool(report['errors'])
+
+        summary = f'{"Checked" if dry_run else "Reconciled"} routers ({failed} with errors)'
+        self.stdout.write(self.style.SUCCESS(summary) if not failed else self.style.WARNING(summary))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from payments.expiry import ExpiredAccessSweeper
+
+
+class Command(BaseCommand):
+    help = 'Continuously remove hotspot users and sessions of expired packages from routers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Remove every expired user once and exit',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Maximum number of routers swept at the same time',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            help='Seconds between passes',
+        )
+
+    def handle(self, *args, **options):
+        sweeper = ExpiredAccessSweeper(
+            workers=options['workers'],
+            interval=options['interval'],
+        )
+
+        if options['once']:
+            summary = sweeper.run_once(full=True)
+            self.stdout.write(self.style.SUCCESS(sweeper.format_summary(summary)))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Sweeping expired access every {sweeper.interval}s with {sweeper.workers} workers'
+        ))
+        try:
+            sweeper.run_forever(stdout=self.stdout)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Expiry sweeper stopped'))
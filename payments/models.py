@@ -1,12 +1,22 @@
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import F
+from django.dispatch import Signal
 from django.contrib.auth.models import User
 from django.conf import settings
-from cryptography.fernet import Fernet
+from django.utils import timezone
+from datetime import timedelta
+from mikrotik_cloudpilot.credentials import get_fernet, credential_cache
 import hashlib
 import uuid
 
 # Create your models here.
 
+# Sent once per status change won by Payment.transition()/bulk_transition(),
+# after the change is committed: sender=Payment, payment=<Payment>,
+# previous_status=<str>, status=<str>
+payment_status_changed = Signal()
+
 class PaymentCredentials(models.Model):
     """Store user payment API credentials for different payment providers"""
     
@@ -22,6 +32,7 @@ class PaymentCredentials(models.Model):
     private_key_hash = models.CharField(max_length=64, help_text="SHA-256 hash of the private key for verification", null=True, blank=True)
     environment = models.CharField(max_length=10, choices=[('sandbox', 'Sandbox'), ('live', 'Live')], default='sandbox')
     is_active = models.BooleanField(default=True, help_text="Whether these credentials are currently active")
+    webhook_challenge = models.CharField(max_length=255, blank=True, help_text="Challenge set on the provider's webhook; callbacks must carry it")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -35,9 +46,9 @@ class PaymentCredentials(models.Model):
         return f"{self.user.username} - {self.provider} ({self.environment})"
     
     def _get_fernet(self):
-        """Get Fernet instance for encryption/decryption"""
+        """Get the shared Fernet instance for encryption/decryption"""
         try:
-            return Fernet(settings.ENCRYPTION_KEY)
+            return get_fernet()
         except Exception as e:
             raise ValueError(f"Invalid encryption key: {e}")
     
@@ -59,18 +70,9 @@ class PaymentCredentials(models.Model):
             return None
         
         try:
-            fernet = self._get_fernet()
-            
-            # Convert memoryview to bytes if needed (PostgreSQL returns memoryview)
-            encrypted_data = self.encrypted_private_key
-            if isinstance(encrypted_data, memoryview):
-                encrypted_data = bytes(encrypted_data)
-            elif isinstance(encrypted_data, str):
-                # Handle case where data might be stored as string
-                encrypted_data = encrypted_data.encode('utf-8')
-            
-            decrypted_data = fernet.decrypt(encrypted_data)
-            return decrypted_data.decode()
+            # Decrypted keys are cached per (pk, updated_at); memoryview/str
+            # values (PostgreSQL) are normalised to bytes by the cache
+            return credential_cache.decrypt(self, self.encrypted_private_key)
         except Exception as e:
             raise ValueError(f"Failed to decrypt private key: {e}")
     
@@ -108,6 +110,17 @@ class Payment(models.Model):
         ('cancelled', 'Cancelled'),
     ]
     
+    PENDING_STATUSES = ['pending', 'processing']
+    
+    # Legal status changes; completed, failed and cancelled are final
+    TRANSITIONS = {
+        'pending': ['processing', 'completed', 'failed', 'cancelled'],
+        'processing': ['completed', 'failed', 'cancelled'],
+        'completed': [],
+        'failed': [],
+        'cancelled': [],
+    }
+    
     PAYMENT_METHODS = [
         ('mpesa', 'M-Pesa'),
         ('card', 'Card'),
@@ -156,9 +169,11 @@ class Payment(models.Model):
         indexes = [
             models.Index(fields=['status', 'created_at']),
             models.Index(fields=['intasend_payment_id']),
+            models.Index(fields=['intasend_invoice_id']),
             models.Index(fields=['phone_number']),
             models.Index(fields=['package_expiry_time']),
             models.Index(fields=['router', 'status']),
+            models.Index(fields=['completed_at']),
         ]
         verbose_name = "Payment"
         verbose_name_plural = "Payments"
@@ -189,7 +204,6 @@ class Payment(models.Model):
         """Check if the package access has expired"""
         if not self.package_expiry_time:
             return False
-        from django.utils import timezone
         return timezone.now() > self.package_expiry_time
     
     @property
@@ -202,28 +216,357 @@ class Payment(models.Model):
         if not self.package or not self.completed_at:
             return None
         
-        from django.utils import timezone
-        from datetime import timedelta
-        
         # Calculate expiry time based on package duration in hours
         expiry_time = self.completed_at + timedelta(hours=self.package.duration_hours)
         return expiry_time
     
-    def mark_completed(self):
-        """Mark payment as completed and calculate expiry time"""
-        from django.utils import timezone
-        self.status = 'completed'
-        self.completed_at = timezone.now()
-        self.package_expiry_time = self.calculate_expiry_time()
-        self.save()
+    @classmethod
+    def can_transition(cls, from_status, to_status):
+        return to_status in cls.TRANSITIONS.get(from_status, [])
     
-    def mark_failed(self, error_message=""):
-        """Mark payment as failed"""
-        self.status = 'failed'
-        self.error_message = error_message
-        self.save()
+    @classmethod
+    def sources_for(cls, to_status):
+        """Statuses a payment may move to ``to_status`` from"""
+        return [status for status, targets in cls.TRANSITIONS.items() if to_status in targets]
+    
+    def transition(self, to_status, **fields):
+        """Move the payment to ``to_status`` unless another request got there first
+        
+        Issues a single ``UPDATE ... WHERE status IN (<legal sources>)``, so of
+        several concurrent callers exactly one wins. The winner gets True, its
+        instance is updated, and payment_status_changed is sent once the
+        transaction commits. Losers get False and their instance is refreshed
+        from the database.
+        """
+        if to_status not in self.TRANSITIONS:
+            raise ValueError(f"Unknown payment status: {to_status}")
+        
+        previous_status = self.status
+        values = dict(fields, status=to_status, updated_at=timezone.now())
+        won = Payment.objects.filter(
+            pk=self.pk, status__in=self.sources_for(to_status)
+        ).update(**values) == 1
+        
+        if not won:
+            self.refresh_from_db()
+            return False
+        
+        for name, value in values.items():
+            setattr(self, name, value)
+        transaction.on_commit(lambda: payment_status_changed.send(
+            sender=Payment, payment=self, previous_status=previous_status, status=to_status
+        ))
+        return True
+    
+    @classmethod
+    def bulk_transition(cls, ids, to_status, **fields):
+        """Move many payments to ``to_status``; returns the ids this call moved
+        
+        The rows that are still in a legal source status are locked and then
+        updated in one statement, so every winner is known and gets exactly
+        one payment_status_changed.
+        """
+        if to_status not in cls.TRANSITIONS:
+            raise ValueError(f"Unknown payment status: {to_status}")
+        if not ids:
+            return []
+        
+        values = dict(fields, status=to_status, updated_at=timezone.now())
+        with transaction.atomic():
+            rows = list(
+                cls.objects.select_for_update()
+                .filter(pk__in=ids, status__in=cls.sources_for(to_status))
+                .values_list('pk', 'status')
+            )
+            won = [pk for pk, _ in rows]
+            if won:
+                cls.objects.filter(pk__in=won).update(**values)
+            
+            previous = dict(rows)
+            
+            def notify():
+                for payment in cls.objects.filter(pk__in=won):
+                    payment_status_changed.send(
+                        sender=cls, payment=payment,
+                        previous_status=previous[payment.pk], status=to_status
+                    )
+            
+            if won:
+                transaction.on_commit(notify)
+        return won
+    
+    def mark_processing(self, **fields):
+        """Mark payment as sent to the provider"""
+        return self.transition('processing', **fields)
+    
+    def mark_completed(self, **fields):
+        """Mark payment as completed and calculate expiry time; True if this call completed it"""
+        completed_at = timezone.now()
+        return self.transition(
+            'completed',
+            completed_at=completed_at,
+            package_expiry_time=completed_at + timedelta(hours=self.package.duration_hours),
+            **fields
+        )
+    
+    def mark_failed(self, error_message="", **fields):
+        """Mark payment as failed; True if this call failed it"""
+        return self.transition('failed', error_message=error_message, **fields)
     
     def increment_retry(self):
         """Increment retry count"""
-        self.retry_count += 1
-        self.save()
+        Payment.objects.filter(pk=self.pk).update(
+            retry_count=F('retry_count') + 1, updated_at=timezone.now()
+        )
+        self.refresh_from_db(fields=['retry_count', 'updated_at'])
+
+
+class PaymentWebhookEvent(models.Model):
+    """Raw payment provider callback, kept for auditing and replay"""
+    
+    OUTCOMES = [
+        ('applied', 'Applied'),
+        ('duplicate', 'Duplicate'),
+        ('recorded', 'Recorded'),
+        ('unmatched', 'Unmatched'),
+        ('rejected', 'Rejected'),
+    ]
+    
+    provider = models.CharField(max_length=20, choices=Payment.PAYMENT_PROVIDERS, default='instasend')
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='webhook_events')
+    invoice_id = models.CharField(max_length=100, blank=True, db_index=True)
+    state = models.CharField(max_length=50, blank=True)
+    payload = models.JSONField(default=dict, help_text="Callback body as received (challenge removed); empty for unmatched and rejected callbacks")
+    outcome = models.CharField(max_length=10, choices=OUTCOMES)
+    error_message = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-received_at']
+        indexes = [
+            models.Index(fields=['payment', 'received_at']),
+            models.Index(fields=['received_at']),
+        ]
+        verbose_name = "Payment Webhook Event"
+        verbose_name_plural = "Payment Webhook Events"
+    
+    def __str__(self):
+        return f"{self.provider} {self.invoice_id or '-'} {self.state or '-'} ({self.outcome})"
+    
+    @classmethod
+    def purge_expired(cls):
+        """Delete events older than PAYMENT_WEBHOOK_EVENT_RETENTION_DAYS; returns how many were removed"""
+        days = getattr(settings, 'PAYMENT_WEBHOOK_EVENT_RETENTION_DAYS', 90)
+        if days <= 0:
+            return 0
+        deleted, _ = cls.objects.filter(received_at__lt=timezone.now() - timedelta(days=days)).delete()
+        return deleted
+
+
+class PaymentIdempotencyKey(models.Model):
+    """Result of a payment initiation request, replayed for retries with the same key
+    
+    One row per (user, endpoint, key); the unique constraint decides which of
+    several concurrent retries does the work. ``response_status`` stays empty
+    while that request is in progress.
+    """
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='payment_idempotency_keys')
+    endpoint = models.CharField(max_length=50)
+    key = models.CharField(max_length=255, help_text="Idempotency-Key header, or a key derived from the request")
+    request_hash = models.CharField(max_length=64, help_text="SHA-256 of the request body")
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='idempotency_keys')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'endpoint', 'key'], name='unique_payment_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+        verbose_name = "Payment Idempotency Key"
+        verbose_name_plural = "Payment Idempotency Keys"
+    
+    def __str__(self):
+        return f"{self.endpoint} {self.key} ({self.response_status or 'in progress'})"
+    
+    @property
+    def is_expired(self):
+        return timezone.now() > self.expires_at
+    
+    @classmethod
+    def purge_expired(cls):
+        """Delete expired keys; returns how many were removed"""
+        deleted, _ = cls.objects.filter(expires_at__lt=timezone.now()).delete()
+        return deleted
+
+
+class PaymentProvisioning(models.Model):
+    """Hotspot access granted on the router for a completed payment
+    
+    Created when the payment completes and worked off by
+    payments.provisioning.hotspot_provisioner. A failed attempt goes back to
+    pending with ``next_attempt_at`` pushed out; after the last attempt it
+    stays failed until retried by hand. Once the package expires,
+    payments.expiry removes the access and marks the row revoked.
+    """
+    
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('provisioned', 'Provisioned'),
+        ('failed', 'Failed'),
+        ('revoked', 'Revoked'),
+    ]
+    
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='provisioning')
+    status = models.CharField(max_length=12, choices=STATUSES, default='pending')
+    username = models.CharField(max_length=64, help_text="Hotspot user name on the router")
+    password = models.CharField(max_length=32, help_text="Hotspot user password on the router")
+    logged_in = models.BooleanField(default=False, help_text="Whether the payment's device was logged in to the hotspot")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    error_message = models.TextField(blank=True)
+    provisioned_at = models.DateTimeField(null=True, blank=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+            models.Index(fields=['username']),
+            models.Index(fields=['updated_at']),
+        ]
+        verbose_name = "Payment Provisioning"
+        verbose_name_plural = "Payment Provisioning"
+    
+    def __str__(self):
+        return f"{self.username} on payment {self.payment_id} ({self.status})"
+
+
+class VoucherBatch(models.Model):
+    """Prepaid voucher codes for one package, created and uploaded to the router together
+    
+    ``chunks`` records one entry per uploaded script: its index, the number
+    of vouchers it carried, how many the router confirmed, the error if any
+    and the time it took.
+    """
+    
+    STATUSES = [
+        ('created', 'Created'),
+        ('uploading', 'Uploading'),
+        ('uploaded', 'Uploaded'),
+        ('partial', 'Partially Uploaded'),
+        ('failed', 'Failed'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='voucher_batches')
+    router = models.ForeignKey('routers.Router', on_delete=models.CASCADE, related_name='voucher_batches')
+    package = models.ForeignKey('routers.Package', on_delete=models.CASCADE, related_name='voucher_batches')
+    count = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUSES, default='created')
+    uploaded_count = models.PositiveIntegerField(default=0)
+    chunks = models.JSONField(default=list, blank=True)
+    error_message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Voucher Batch"
+        verbose_name_plural = "Voucher Batches"
+    
+    def __str__(self):
+        return f"{self.count} x {self.package.name} on {self.router.name} ({self.status})"
+    
+    @property
+    def progress(self):
+        """Share of the batch's vouchers confirmed on the router, 0-100"""
+        if not self.count:
+            return 100
+        return round(self.uploaded_count * 100 / self.count, 1)
+
+
+class Voucher(models.Model):
+    """Prepaid access code; the code is the hotspot user name on the router"""
+    
+    STATUSES = [
+        ('created', 'Created'),
+        ('uploaded', 'Uploaded'),
+        ('redeemed', 'Redeemed'),
+        ('expired', 'Expired'),
+    ]
+    
+    batch = models.ForeignKey(VoucherBatch, on_delete=models.CASCADE, related_name='vouchers')
+    router = models.ForeignKey('routers.Router', on_delete=models.CASCADE, related_name='vouchers')
+    package = models.ForeignKey('routers.Package', on_delete=models.CASCADE, related_name='vouchers')
+    code = models.CharField(max_length=32)
+    status = models.CharField(max_length=10, choices=STATUSES, default='created')
+    mac_address = models.CharField(max_length=17, blank=True)
+    ip_address = models.CharField(max_length=45, blank=True)
+    redeemed_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True, help_text="Redemption time plus the package duration")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['batch', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['router', 'code'], name='unique_voucher_code_per_router'),
+        ]
+        indexes = [
+            models.Index(fields=['batch', 'status']),
+            models.Index(fields=['created_at']),
+            models.Index(fields=['redeemed_at']),
+            models.Index(fields=['status', 'expires_at']),
+        ]
+        verbose_name = "Voucher"
+        verbose_name_plural = "Vouchers"
+    
+    def __str__(self):
+        return f"{self.code} ({self.status})"
+
+
+class HotspotSession(models.Model):
+    """Hotspot session as reported by its router's RADIUS accounting"""
+    
+    STATUSES = [
+        ('active', 'Active'),
+        ('stopped', 'Stopped'),
+    ]
+    
+    router = models.ForeignKey('routers.Router', on_delete=models.CASCADE, related_name='hotspot_sessions')
+    session_id = models.CharField(max_length=64, help_text="Acct-Session-Id sent by the router")
+    username = models.CharField(max_length=64)
+    mac_address = models.CharField(max_length=17, blank=True)
+    ip_address = models.CharField(max_length=45, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default='active')
+    input_octets = models.BigIntegerField(default=0)
+    output_octets = models.BigIntegerField(default=0)
+    session_time = models.PositiveIntegerField(default=0, help_text="Seconds")
+    terminate_cause = models.CharField(max_length=32, blank=True)
+    started_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    stopped_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-started_at']
+        constraints = [
+            models.UniqueConstraint(fields=['router', 'session_id'], name='unique_hotspot_session_per_router'),
+        ]
+        indexes = [
+            models.Index(fields=['router', 'status']),
+            models.Index(fields=['username']),
+        ]
+        verbose_name = "Hotspot Session"
+        verbose_name_plural = "Hotspot Sessions"
+    
+    def __str__(self):
+        return f"{self.username} on {self.router.name} ({self.status})"
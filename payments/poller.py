@@ -0,0 +1,226 @@
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.utils import timezone
+
+from .intasend_api import intasend_services, intasend_status
+from .models import Payment, PaymentIdempotencyKey, PaymentWebhookEvent
+from .webhooks import INTASEND_COMPLETED_STATES, INTASEND_FAILED_STATES
+
+logger = logging.getLogger(__name__)
+
+PENDING_STATUSES = Payment.PENDING_STATUSES
+
+
+class PendingPaymentPoller:
+    """Settles pending IntaSend payments without waiting for the browser
+
+    Each pass reads pending/processing payments through the
+    (status, created_at) index and asks IntaSend for the status of those that
+    are due. Young payments are polled often and older ones less often (see
+    ``BACKOFF``). Calls are grouped by payment owner, so each owner's cached
+    IntaSend service is used. Each owner's payments are split into at most
+    ``per_owner`` batches checked one payment after another, so one owner
+    with many pending payments cannot take every one of the ``workers``
+    threads. Results are written with a few conditional UPDATEs. A payment
+    that the webhook settled in the meantime is not touched. Payments still
+    unsettled after ``expire_after`` seconds are marked failed.
+    """
+
+    # (payment age below N seconds, poll every M seconds); last entry applies to older payments
+    BACKOFF = [(120, 10), (600, 30), (None, 120)]
+
+    def __init__(self, workers=None, per_owner=None, expire_after=None, tick=None):
+        self.workers = workers or getattr(settings, 'PAYMENT_POLLER_WORKERS', 8)
+        self.per_owner = per_owner or getattr(settings, 'PAYMENT_POLLER_PER_OWNER', 4)
+        self.expire_after = expire_after or getattr(settings, 'PAYMENT_POLLER_EXPIRE_AFTER', 1800)
+        self.tick = tick or getattr(settings, 'PAYMENT_POLLER_TICK', 5)
+        self._next_due = {}
+
+    def run_forever(self, stdout=None):
+        """Poll due payments until interrupted"""
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='payment-poller') as executor:
+            while True:
+                summary = self.run_once(executor)
+                if stdout and (summary['polled'] or summary['expired']):
+                    stdout.write(self.format_summary(summary))
+                time.sleep(self.tick)
+
+    def run_once(self, executor=None, force=False):
+        """Poll every due payment (or all of them when ``force``) and expire stale ones"""
+        now = timezone.now()
+        clock = time.monotonic()
+        cutoff = now - timedelta(seconds=self.expire_after)
+
+        expired = self._expire_unsubmitted(cutoff)
+        PaymentIdempotencyKey.purge_expired()
+        PaymentWebhookEvent.purge_expired()
+
+        payments = list(
+            Payment.objects.filter(status__in=PENDING_STATUSES, payment_provider='instasend')
+            .exclude(intasend_invoice_id='', intasend_payment_id='')
+            .select_related('package')
+            .only(
+                'id', 'user_id', 'status', 'created_at', 'intasend_invoice_id',
+                'intasend_payment_id', 'intasend_state', 'package__duration_hours'
+            )
+            .order_by('created_at')
+        )
+        self._forget_settled(payments)
+
+        due = []
+        for payment in payments:
+            if force or payment.created_at <= cutoff or self._next_due.get(payment.pk, 0) <= clock:
+                due.append(payment)
+                self._next_due[payment.pk] = clock + self._poll_interval(now - payment.created_at)
+
+        summary = {'polled': len(due), 'completed': 0, 'failed': 0, 'updated': 0, 'errors': 0, 'expired': expired}
+        if not due:
+            return summary
+
+        if executor is None:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(due))) as pool:
+                results = self._poll(pool, due)
+        else:
+            results = self._poll(executor, due)
+
+        summary.update(self._apply(due, results, now))
+        summary['expired'] += self._expire_polled(due, results, cutoff)
+        return summary
+
+    @staticmethod
+    def format_summary(summary):
+        return (
+            f"Polled {summary['polled']} payments: {summary['completed']} completed, "
+            f"{summary['failed']} failed, {summary['updated']} updated, "
+            f"{summary['errors']} errors, {summary['expired']} expired"
+        )
+
+    def _poll_interval(self, age):
+        seconds = age.total_seconds()
+        for limit, interval in self.BACKOFF:
+            if limit is None or seconds < limit:
+                return interval
+        return self.BACKOFF[-1][1]
+
+    def _poll(self, executor, payments):
+        """Check every payment with IntaSend; returns {payment id: status result}"""
+        by_owner = defaultdict(list)
+        for payment in payments:
+            by_owner[payment.user_id].append(payment)
+        users = User.objects.in_bulk([user_id for user_id in by_owner if user_id])
+
+        results = {}
+        batches = []
+        for user_id, owned in by_owner.items():
+            user = users.get(user_id)
+            try:
+                if user is None:
+                    raise ValueError("Payment has no owner")
+                api = intasend_services.get(user)
+            except Exception as e:
+                for payment in owned:
+                    results[payment.pk] = {'success': False, 'error': str(e)}
+                continue
+
+            # per_owner sequential batches, so an owner never holds more pool threads than that
+            for offset in range(min(self.per_owner, len(owned))):
+                batches.append(executor.submit(self._check_batch, api, owned[offset::self.per_owner]))
+
+        for batch in batches:
+            results.update(batch.result())
+        return results
+
+    @staticmethod
+    def _check_batch(api, payments):
+        results = {}
+        try:
+            for payment in payments:
+                try:
+                    # Shares the call with any check-status request for the same payment
+                    results[payment.pk], _ = intasend_status.check(
+                        payment.pk, lambda payment=payment: api.check_payment_status(payment)
+                    )
+                except Exception as e:
+                    results[payment.pk] = {'success': False, 'error': str(e)}
+        finally:
+            connections.close_all()
+        return results
+
+    def _apply(self, payments, results, now):
+        """Write status changes in bulk
+
+        Only rows that are still pending change, and each status change
+        sends payment_status_changed once.
+        """
+        completed = defaultdict(list)
+        failed = defaultdict(list)
+        updated = defaultdict(list)
+        errors = 0
+
+        for payment in payments:
+            result = results.get(payment.pk) or {}
+            if not result.get('success'):
+                errors += 1
+                logger.warning("Status check for payment %s failed: %s", payment.pk, result.get('error'))
+                continue
+
+            state = str(result.get('state') or '').upper()
+            if state in INTASEND_COMPLETED_STATES:
+                completed[(state, payment.package.duration_hours)].append(payment.pk)
+            elif state in INTASEND_FAILED_STATES:
+                message = result.get('failed_reason') or f'Payment {state.lower()} on IntaSend'
+                failed[(state, message)].append(payment.pk)
+            elif state and state != payment.intasend_state:
+                updated[state].append(payment.pk)
+
+        counts = {'completed': 0, 'failed': 0, 'updated': 0, 'errors': errors}
+        for (state, duration_hours), ids in completed.items():
+            counts['completed'] += len(Payment.bulk_transition(
+                ids, 'completed',
+                intasend_state=state,
+                completed_at=now,
+                package_expiry_time=now + timedelta(hours=duration_hours)
+            ))
+        for (state, message), ids in failed.items():
+            counts['failed'] += len(Payment.bulk_transition(
+                ids, 'failed', intasend_state=state, error_message=message
+            ))
+        pending = Payment.objects.filter(status__in=PENDING_STATUSES)
+        for state, ids in updated.items():
+            counts['updated'] += pending.filter(pk__in=ids).update(intasend_state=state, updated_at=now)
+        return counts
+
+    def _expire_polled(self, payments, results, cutoff):
+        """Fail payments past the deadline whose final check did not settle them"""
+        settled = INTASEND_COMPLETED_STATES + INTASEND_FAILED_STATES
+        ids = [
+            payment.pk for payment in payments
+            if payment.created_at <= cutoff
+            and str((results.get(payment.pk) or {}).get('state') or '').upper() not in settled
+        ]
+        return len(Payment.bulk_transition(ids, 'failed', error_message=self._expiry_message()))
+
+    def _expire_unsubmitted(self, cutoff):
+        """Fail stale payments that never reached IntaSend (nothing to poll)"""
+        ids = list(Payment.objects.filter(
+            status__in=PENDING_STATUSES,
+            created_at__lte=cutoff,
+            intasend_invoice_id='',
+            intasend_payment_id=''
+        ).values_list('pk', flat=True))
+        return len(Payment.bulk_transition(ids, 'failed', error_message=self._expiry_message()))
+
+    def _expiry_message(self):
+        return f'Payment expired: not confirmed within {self.expire_after // 60} minutes'
+
+    def _forget_settled(self, payments):
+        ids = {payment.pk for payment in payments}
+        for payment_id in [pid for pid in self._next_due if pid not in ids]:
+            del self._next_due[payment_id]
@@ -0,0 +1,323 @@
+import logging
+import secrets
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from routers import hotspot
+from routers.mikrotik_api import MikrotikAPIManager
+from .models import PaymentProvisioning
+
+logger = logging.getLogger(__name__)
+
+RECORD_FIELDS = ['status', 'logged_in', 'attempts', 'next_attempt_at', 'error_message', 'provisioned_at', 'updated_at']
+
+
+class HotspotProvisioner:
+    """Grants hotspot access on the router once a payment completes
+
+    A completed payment gets a PaymentProvisioning row; a dispatcher thread
+    waits ``linger`` seconds so completions arriving together are batched,
+    claims every due row and provisions them router by router (``workers``
+    routers at a time). Each router is handled with two execute_batch calls
+    over its pooled client: one round of reads (package profiles and the
+    customers' existing hotspot users), then all writes in order:
+
+    - the package's ``/ip/hotspot/user/profile`` (rate limit from the
+      package's upload/download Mbps) if it is missing or differs,
+    - ``/ip/hotspot/user`` added, or updated and its counters reset for a
+      returning customer, with limit-uptime matching ``duration_hours``,
+    - ``ip/hotspot/active/login`` for the payment's MAC and IP, when known.
+
+    A failed attempt is retried after ``backoff`` seconds, doubling up to
+    ``max_backoff``, for at most ``max_attempts`` attempts. A failed device
+    login does not fail the provisioning: the customer can still log in with
+    the hotspot user.
+
+    Rows are claimed in the database, so several processes (web workers,
+    ``provision_payments``) can run dispatchers side by side; a row left
+    running by a crashed process is picked up again after ``stale_after``
+    seconds.
+    """
+
+    def __init__(self, workers=4, linger=1, max_attempts=6, backoff=15, max_backoff=900,
+                 stale_after=600, batch_size=500):
+        self.workers = workers
+        self.linger = linger
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stale_after = stale_after
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._dispatcher = None
+        self.batches = 0
+        self.provisioned = 0
+        self.retried = 0
+        self.failed = 0
+
+    def enqueue(self, payment):
+        """Record that the completed payment needs access, and wake the dispatcher"""
+        # A returning customer keeps the password of their hotspot user
+        previous = PaymentProvisioning.objects.filter(
+            payment__router_id=payment.router_id, username=payment.phone_number
+        ).order_by('-created_at').values_list('password', flat=True).first()
+        PaymentProvisioning.objects.get_or_create(payment=payment, defaults={
+            'username': payment.phone_number,
+            'password': previous or secrets.token_hex(4),
+        })
+        self.wake()
+
+    def wake(self):
+        """Have this process's dispatcher look for due rows now"""
+        with self._lock:
+            self._wake.set()
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(
+                    target=self._dispatch, name='hotspot-provisioning', daemon=True
+                )
+                self._dispatcher.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'dispatcher_running': self._dispatcher is not None,
+                'batches': self.batches,
+                'provisioned': self.provisioned,
+                'retried': self.retried,
+                'failed': self.failed,
+            }
+
+    def run_due(self, executor=None):
+        """Provision every due row; returns a summary dict"""
+        summary = {'routers': 0, 'provisioned': 0, 'retrying': 0, 'failed': 0}
+        while True:
+            records = self._claim()
+            if not records:
+                return summary
+
+            by_router = defaultdict(list)
+            for record in records:
+                by_router[record.payment.router_id].append(record)
+            summary['routers'] += len(by_router)
+
+            if executor is None:
+                with ThreadPoolExecutor(max_workers=min(self.workers, len(by_router))) as pool:
+                    outcomes = list(pool.map(self._provision_group, by_router.values()))
+            else:
+                outcomes = list(executor.map(self._provision_group, by_router.values()))
+
+            for outcome in outcomes:
+                for key, count in outcome.items():
+                    summary[key] += count
+            if len(records) < self.batch_size:
+                return summary
+
+    def next_due(self):
+        """When the next pending row is due, or None"""
+        return PaymentProvisioning.objects.filter(status='pending').aggregate(
+            due=Min('next_attempt_at')
+        )['due']
+
+    @staticmethod
+    def format_summary(summary):
+        return (
+            f"Provisioned on {summary['routers']} routers: {summary['provisioned']} provisioned, "
+            f"{summary['retrying']} to retry, {summary['failed']} failed"
+        )
+
+    def provision(self, router, records):
+        """Provision ``records`` (all for ``router``); returns {record pk: (ok, logged_in, error)}"""
+        records = sorted(records, key=lambda record: record.payment.completed_at or record.created_at)
+        packages = {record.payment.package_id: record.payment.package for record in records}
+        names = sorted({record.username for record in records})
+
+        reads = [{'command': 'ip/hotspot/user/profile', 'params': {'.proplist': '.id,name,rate-limit'}}]
+        reads += [
+            {'command': 'ip/hotspot/user', 'params': {'name': name, '.proplist': '.id,name'}}
+            for name in names
+        ]
+        result = MikrotikAPIManager.execute_batch(router, reads, parallel_reads=True)
+        if not result['success']:
+            error = result.get('error') or next(
+                line['error'] for line in result['steps'] if not line['success']
+            )
+            return {record.pk: (False, False, f'Reading hotspot users failed: {error}') for record in records}
+
+        current = {profile.get('name'): profile for profile in hotspot.as_rows(result['steps'][0]['result'])}
+        existing = {}
+        for name, line in zip(names, result['steps'][1:]):
+            users = hotspot.as_rows(line['result'])
+            if users:
+                existing[name] = hotspot.item_target(users[0], name)
+
+        steps = hotspot.profile_steps(packages.values(), current)
+        profile_steps = len(steps)
+        owners = []
+        for record in records:
+            payment = record.payment
+            user = hotspot_user(record)
+            if record.username in existing:
+                target = existing[record.username]
+                del user['name']
+                steps.append({
+                    'command': 'ip/hotspot/user/set',
+                    'method': 'POST',
+                    'data': dict(user, **target),
+                })
+                steps.append({
+                    'command': 'ip/hotspot/user/reset-counters',
+                    'method': 'POST',
+                    'data': target,
+                })
+                owners += [(record, 'user'), (record, 'user')]
+            else:
+                steps.append({
+                    'command': 'ip/hotspot/user/add',
+                    'method': 'POST',
+                    'data': user,
+                })
+                owners.append((record, 'user'))
+                # A later payment in this batch for the same customer updates it by name
+                existing[record.username] = {'numbers': record.username}
+
+            if payment.mac_address and payment.ip_address:
+                steps.append({
+                    'command': 'ip/hotspot/active/login',
+                    'method': 'POST',
+                    'data': {
+                        'user': record.username,
+                        'password': record.password,
+                        'mac-address': payment.mac_address,
+                        'ip': payment.ip_address,
+                    },
+                })
+                owners.append((record, 'login'))
+
+        result = MikrotikAPIManager.execute_batch(router, steps)
+        if not result['steps']:
+            return {record.pk: (False, False, result['error']) for record in records}
+
+        for line in result['steps'][:profile_steps]:
+            if not line['success']:
+                error = f"Updating hotspot profile failed: {line['error']}"
+                return {record.pk: (False, False, error) for record in records}
+
+        outcomes = {record.pk: [True, False, ''] for record in records}
+        for (record, kind), line in zip(owners, result['steps'][profile_steps:]):
+            outcome = outcomes[record.pk]
+            if kind == 'login':
+                outcome[1] = line['success']
+                if not line['success']:
+                    outcome[2] = f"Hotspot login failed: {line['error']}"
+            elif not line['success'] and outcome[0]:
+                outcome[0] = False
+                outcome[2] = f"Creating hotspot user failed: {line['error']}"
+        return {pk: tuple(outcome) for pk, outcome in outcomes.items()}
+
+    def _claim(self):
+        """Mark up to ``batch_size`` due rows running and return them"""
+        now = timezone.now()
+        stale = now - timedelta(seconds=self.stale_after)
+        with transaction.atomic():
+            ids = list(
+                PaymentProvisioning.objects.select_for_update(skip_locked=True)
+                .filter(Q(status='pending', next_attempt_at__lte=now) | Q(status='running', updated_at__lt=stale))
+                .order_by('next_attempt_at')
+                .values_list('pk', flat=True)[:self.batch_size]
+            )
+            if ids:
+                PaymentProvisioning.objects.filter(pk__in=ids).update(status='running', updated_at=now)
+        return list(
+            PaymentProvisioning.objects.filter(pk__in=ids)
+            .select_related('payment__router', 'payment__package')
+        )
+
+    def _provision_group(self, records):
+        router = records[0].payment.router
+        try:
+            outcomes = self.provision(router, records)
+        except Exception as e:
+            logger.exception("Provisioning on router %s crashed", router.pk)
+            outcomes = {record.pk: (False, False, str(e)) for record in records}
+        try:
+            return self._record(records, outcomes)
+        finally:
+            connections.close_all()
+
+    def _record(self, records, outcomes):
+        now = timezone.now()
+        summary = {'provisioned': 0, 'retrying': 0, 'failed': 0}
+        for record in records:
+            ok, logged_in, error = outcomes[record.pk]
+            record.attempts += 1
+            record.logged_in = logged_in
+            record.error_message = error
+            record.updated_at = now
+            if ok:
+                record.status = 'provisioned'
+                record.provisioned_at = now
+                summary['provisioned'] += 1
+            elif record.attempts >= self.max_attempts:
+                record.status = 'failed'
+                summary['failed'] += 1
+                logger.warning("Giving up provisioning payment %s: %s", record.payment_id, error)
+            else:
+                record.status = 'pending'
+                delay = min(self.backoff * 2 ** (record.attempts - 1), self.max_backoff)
+                record.next_attempt_at = now + timedelta(seconds=delay)
+                summary['retrying'] += 1
+        PaymentProvisioning.objects.bulk_update(records, RECORD_FIELDS)
+
+        with self._lock:
+            self.batches += 1
+            self.provisioned += summary['provisioned']
+            self.retried += summary['retrying']
+            self.failed += summary['failed']
+        return summary
+
+    def _dispatch(self):
+        """Work off due rows; sleeps until the next retry and exits when none is left"""
+        timeout = None
+        while True:
+            self._wake.wait(timeout)
+            self._wake.clear()
+            time.sleep(self.linger)
+            try:
+                self.run_due()
+                due = self.next_due()
+            except Exception:
+                logger.exception("Hotspot provisioning pass failed")
+                due = timezone.now() + timedelta(seconds=self.backoff)
+            finally:
+                connections.close_all()
+
+            with self._lock:
+                if due is None and not self._wake.is_set():
+                    self._dispatcher = None
+                    return
+            timeout = max((due - timezone.now()).total_seconds(), 0) if due else None
+
+
+def hotspot_user(record):
+    """Desired hotspot user for a PaymentProvisioning row"""
+    payment = record.payment
+    return hotspot.render_user(record.username, record.password, payment.package, f'payment {payment.pk}')
+
+
+hotspot_provisioner = HotspotProvisioner(
+    workers=getattr(settings, 'PAYMENT_PROVISIONING_WORKERS', 4),
+    linger=getattr(settings, 'PAYMENT_PROVISIONING_LINGER', 1),
+    max_attempts=getattr(settings, 'PAYMENT_PROVISIONING_MAX_ATTEMPTS', 6),
+    backoff=getattr(settings, 'PAYMENT_PROVISIONING_BACKOFF', 15),
+    max_backoff=getattr(settings, 'PAYMENT_PROVISIONING_MAX_BACKOFF', 900),
+)
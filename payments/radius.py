@@ -0,0 +1,740 @@
+"""RADIUS authentication and accounting for hotspot logins (RFC 2865/2866)
+
+Routers pointed at this server (``/radius add service=hotspot``) ask it
+whether a login may proceed instead of carrying a hotspot user per payment.
+Answers come from an in-memory index of the unexpired completed payments
+and vouchers, keyed by router and then by user name (phone number or
+voucher code) and by device MAC address, so a login costs a couple of dict
+lookups and no database query. The index is loaded once and then refreshed
+incrementally from the rows completed, created or redeemed since the
+previous refresh.
+"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import logging
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from routers import hotspot
+from routers.models import Package, Router
+from . import vouchers
+from .models import HotspotSession, Payment, PaymentProvisioning, Voucher
+
+logger = logging.getLogger(__name__)
+
+ACCESS_REQUEST = 1
+ACCESS_ACCEPT = 2
+ACCESS_REJECT = 3
+ACCOUNTING_REQUEST = 4
+ACCOUNTING_RESPONSE = 5
+
+USER_NAME = 1
+USER_PASSWORD = 2
+CHAP_PASSWORD = 3
+FRAMED_IP_ADDRESS = 8
+REPLY_MESSAGE = 18
+VENDOR_SPECIFIC = 26
+SESSION_TIMEOUT = 27
+CALLING_STATION_ID = 31
+NAS_IDENTIFIER = 32
+ACCT_STATUS_TYPE = 40
+ACCT_INPUT_OCTETS = 42
+ACCT_OUTPUT_OCTETS = 43
+ACCT_SESSION_ID = 44
+ACCT_SESSION_TIME = 46
+ACCT_TERMINATE_CAUSE = 49
+ACCT_INPUT_GIGAWORDS = 52
+ACCT_OUTPUT_GIGAWORDS = 53
+CHAP_CHALLENGE = 60
+MESSAGE_AUTHENTICATOR = 80
+ACCT_INTERIM_INTERVAL = 85
+
+ACCT_START = 1
+ACCT_STOP = 2
+ACCT_INTERIM_UPDATE = 3
+
+MIKROTIK_VENDOR_ID = 14988
+MIKROTIK_RATE_LIMIT = 8
+
+TERMINATE_CAUSES = {
+    1: 'user-request', 2: 'lost-carrier', 3: 'lost-service', 4: 'idle-timeout',
+    5: 'session-timeout', 6: 'admin-reset', 7: 'admin-reboot', 10: 'nas-request', 11: 'nas-reboot',
+}
+
+# Rows changed this close before the previous refresh are read again, in case they committed late
+OVERLAP = 60
+
+
+# Packets
+
+class Packet:
+    """A decoded RADIUS packet; ``attributes`` maps type to a list of raw values"""
+
+    __slots__ = ('code', 'identifier', 'authenticator', 'attributes', 'raw')
+
+    def __init__(self, code, identifier, authenticator, attributes, raw=b''):
+        self.code = code
+        self.identifier = identifier
+        self.authenticator = authenticator
+        self.attributes = attributes
+        self.raw = raw
+
+    @classmethod
+    def decode(cls, data):
+        """Parse a datagram; raises ValueError if it is malformed"""
+        if len(data) < 20:
+            raise ValueError("Packet shorter than its header")
+        code, identifier, length = struct.unpack('!BBH', data[:4])
+        if length < 20 or length > len(data):
+            raise ValueError("Packet length does not match the datagram")
+        attributes = {}
+        offset = 20
+        while offset < length:
+            if offset + 2 > length:
+                raise ValueError("Truncated attribute")
+            kind, size = data[offset], data[offset + 1]
+            if size < 2 or offset + size > length:
+                raise ValueError("Bad attribute length")
+            attributes.setdefault(kind, []).append(data[offset + 2:offset + size])
+            offset += size
+        return cls(code, identifier, data[4:20], attributes, data[:length])
+
+    def get(self, kind):
+        values = self.attributes.get(kind)
+        return values[0] if values else None
+
+    def text(self, kind):
+        value = self.get(kind)
+        return value.decode('utf-8', 'replace') if value is not None else ''
+
+    def integer(self, kind):
+        value = self.get(kind)
+        return struct.unpack('!I', value)[0] if value is not None and len(value) == 4 else 0
+
+    def encode(self, secret=None):
+        """Serialize, e.g. for a client; with ``secret`` a User-Password value is hidden first"""
+        attributes = []
+        for kind, values in self.attributes.items():
+            for value in values:
+                if kind == USER_PASSWORD and secret is not None:
+                    value = hide_password(value, secret, self.authenticator)
+                attributes.append((kind, value))
+        body = encode_attributes(attributes)
+        return struct.pack('!BBH', self.code, self.identifier, 20 + len(body)) + self.authenticator + body
+
+
+def encode_attributes(attributes):
+    """``(type, value)`` pairs as wire attributes; values may be bytes, str or int"""
+    chunks = []
+    for kind, value in attributes:
+        if isinstance(value, int):
+            value = struct.pack('!I', value)
+        elif isinstance(value, str):
+            value = value.encode()
+        chunks.append(struct.pack('!BB', kind, len(value) + 2) + value)
+    return b''.join(chunks)
+
+
+def vendor_attribute(vendor_id, kind, value):
+    """A Vendor-Specific attribute carrying one vendor attribute"""
+    value = value.encode() if isinstance(value, str) else value
+    return VENDOR_SPECIFIC, struct.pack('!IBB', vendor_id, kind, len(value) + 2) + value
+
+
+def hide_password(password, secret, authenticator):
+    """User-Password as sent on the wire (RFC 2865 section 5.2)"""
+    if not password or len(password) % 16:
+        password += b'\x00' * (16 - len(password) % 16)
+    result, last = b'', authenticator
+    for start in range(0, len(password), 16):
+        key = hashlib.md5(secret + last).digest()
+        last = bytes(a ^ b for a, b in zip(password[start:start + 16], key))
+        result += last
+    return result
+
+
+def reveal_password(value, secret, authenticator):
+    """Plain password from a User-Password attribute"""
+    result, last = b'', authenticator
+    for start in range(0, len(value), 16):
+        block = value[start:start + 16]
+        key = hashlib.md5(secret + last).digest()
+        result += bytes(a ^ b for a, b in zip(block, key))
+        last = block
+    return result.rstrip(b'\x00')
+
+
+def check_chap(value, challenge, password):
+    """Whether a CHAP-Password answers ``challenge`` with ``password``"""
+    if len(value) != 17:
+        return False
+    return hmac.compare_digest(hashlib.md5(value[:1] + password + challenge).digest(), value[1:])
+
+
+def _zero_message_authenticator(raw):
+    """The packet with its Message-Authenticator value zeroed, as it was signed"""
+    data = bytearray(raw)
+    offset = 20
+    while offset + 2 <= len(data):
+        kind, size = data[offset], data[offset + 1]
+        if kind == MESSAGE_AUTHENTICATOR and size == 18:
+            data[offset + 2:offset + 18] = bytes(16)
+        offset += max(size, 2)
+    return bytes(data)
+
+
+def message_authenticator_ok(packet, secret):
+    """False only if the packet carries a Message-Authenticator that does not verify"""
+    value = packet.get(MESSAGE_AUTHENTICATOR)
+    if value is None:
+        return True
+    expected = hmac.new(secret, _zero_message_authenticator(packet.raw), hashlib.md5).digest()
+    return hmac.compare_digest(expected, value)
+
+
+def accounting_authentic(packet, secret):
+    """Whether an Accounting-Request's authenticator was made with ``secret``"""
+    expected = hashlib.md5(packet.raw[:4] + bytes(16) + packet.raw[20:] + secret).digest()
+    return hmac.compare_digest(expected, packet.authenticator)
+
+
+def build_reply(request, code, attributes, secret):
+    """Response to ``request``, signed with ``secret``
+
+    A Message-Authenticator is added when the request carried one.
+    """
+    body = encode_attributes(attributes)
+    if MESSAGE_AUTHENTICATOR in request.attributes:
+        body += struct.pack('!BB', MESSAGE_AUTHENTICATOR, 18) + bytes(16)
+        header = struct.pack('!BBH', code, request.identifier, 20 + len(body))
+        signature = hmac.new(secret, header + request.authenticator + body, hashlib.md5).digest()
+        body = body[:-16] + signature
+    header = struct.pack('!BBH', code, request.identifier, 20 + len(body))
+    authenticator = hashlib.md5(header + request.authenticator + body + secret).digest()
+    return header + authenticator + body
+
+
+def normalize_mac(value):
+    """``AA:BB:CC:DD:EE:FF`` for any common MAC spelling, or '' if it is not one"""
+    digits = ''.join(char for char in (value or '') if char not in ':-.').upper()
+    if len(digits) != 12 or any(char not in '0123456789ABCDEF' for char in digits):
+        return ''
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+# Entitlements
+
+class Entitlement:
+    """Access one payment or voucher grants on one router"""
+
+    __slots__ = ('source', 'router_id', 'username', 'password', 'mac', 'package_id', 'expires_at', 'redeemable')
+
+    def __init__(self, source, router_id, username, password, mac, package_id, expires_at, redeemable=False):
+        self.source = source
+        self.router_id = router_id
+        self.username = username
+        self.password = password
+        self.mac = mac
+        self.package_id = package_id
+        self.expires_at = expires_at
+        self.redeemable = redeemable
+
+
+class EntitlementIndex:
+    """Who may log in where, by (router, user name) and by (router, MAC)
+
+    Only ever touched from the server's event loop thread.
+    """
+
+    def __init__(self):
+        self.by_user = {}
+        self.by_mac = {}
+        self.sources = {}
+        self.packages = {}
+        self.routers = {}
+        self.nas = {}
+
+    def __len__(self):
+        return len(self.sources)
+
+    def put(self, entitlement):
+        current = self.sources.get(entitlement.source)
+        # Redemption is one way: a late read of the unredeemed row must not undo it
+        if current is not None and entitlement.redeemable and not current.redeemable:
+            return
+        self.discard(entitlement.source)
+        self.sources[entitlement.source] = entitlement
+        key = (entitlement.router_id, entitlement.username)
+        self.by_user.setdefault(key, {})[entitlement.source] = entitlement
+        if entitlement.mac:
+            self.by_mac.setdefault((entitlement.router_id, entitlement.mac), {})[entitlement.source] = entitlement
+
+    def discard(self, source):
+        entitlement = self.sources.pop(source, None)
+        if entitlement is None:
+            return
+        for table, key in (
+            (self.by_user, (entitlement.router_id, entitlement.username)),
+            (self.by_mac, (entitlement.router_id, entitlement.mac)),
+        ):
+            entries = table.get(key)
+            if entries is not None:
+                entries.pop(source, None)
+                if not entries:
+                    del table[key]
+
+    def candidates(self, router_id, username, mac_username):
+        found = {}
+        for name in {username, username.strip().upper()}:
+            found.update(self.by_user.get((router_id, name), {}))
+        if mac_username:
+            found.update(self.by_mac.get((router_id, mac_username), {}))
+        return found.values()
+
+    def set_package(self, package_id, rate_limit, duration_hours):
+        self.packages[package_id] = (rate_limit, duration_hours)
+
+    def set_router(self, router_id, name, addresses):
+        """Remember which source addresses the router's packets come from"""
+        previous = self.routers.pop(router_id, None)
+        if previous is not None:
+            for address in previous[1]:
+                routers = [entry for entry in self.nas.get(address, []) if entry[0] != router_id]
+                if routers:
+                    self.nas[address] = routers
+                else:
+                    self.nas.pop(address, None)
+        self.routers[router_id] = (name, addresses)
+        for address in addresses:
+            self.nas.setdefault(address, []).append((router_id, name))
+
+    def router_for(self, address, nas_identifier=''):
+        """The router sending from ``address``; routers sharing an address are told apart by NAS-Identifier"""
+        routers = self.nas.get(address, [])
+        if len(routers) == 1:
+            return routers[0][0]
+        for router_id, name in routers:
+            if name == nas_identifier:
+                return router_id
+        return None
+
+
+def resolve(host):
+    """Addresses a router's packets may come from"""
+    try:
+        return [str(ipaddress.ip_address(host))]
+    except ValueError:
+        pass
+    try:
+        return sorted({info[4][0] for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_UDP)})
+    except OSError:
+        return []
+
+
+def _payment_entitlement(row, now):
+    source = ('payment', row['pk'])
+    if row['status'] != 'completed' or not row['package_expiry_time'] or row['package_expiry_time'] <= now:
+        return source, None
+    return source, Entitlement(
+        source, row['router_id'], row['phone_number'], row['provisioning__password'] or None,
+        normalize_mac(row['mac_address']), row['package_id'], row['package_expiry_time'],
+    )
+
+
+def _voucher_entitlement(row, now):
+    source = ('voucher', row['pk'])
+    if row['status'] == 'redeemed':
+        if not row['expires_at'] or row['expires_at'] <= now:
+            return source, None
+        return source, Entitlement(
+            source, row['router_id'], row['code'], None,
+            normalize_mac(row['mac_address']), row['package_id'], row['expires_at'],
+        )
+    if row['status'] not in ('created', 'uploaded'):
+        return source, None
+    return source, Entitlement(source, row['router_id'], row['code'], None, '', row['package_id'], None, redeemable=True)
+
+
+PAYMENT_FIELDS = [
+    'pk', 'router_id', 'phone_number', 'mac_address', 'package_id', 'package_expiry_time', 'status',
+    'provisioning__password',
+]
+VOUCHER_FIELDS = ['pk', 'router_id', 'code', 'mac_address', 'package_id', 'expires_at', 'status']
+
+
+def load_changes(since):
+    """Rows that changed since ``since`` (everything when None), read in a worker thread
+
+    Returns a dict of routers, packages and (source, entitlement or None)
+    pairs, where None means the source no longer grants access.
+    """
+    now = timezone.now()
+    try:
+        routers = Router.objects.only('pk', 'name', 'host')
+        packages = Package.objects.only('pk', 'upload_speed_mbps', 'download_speed_mbps', 'duration_hours')
+        if since is None:
+            payments = Payment.objects.filter(status='completed', package_expiry_time__gt=now)
+            voucher_rows = Voucher.objects.filter(
+                Q(status='redeemed', expires_at__gt=now) | Q(status__in=['created', 'uploaded'])
+            )
+        else:
+            routers = routers.filter(updated_at__gte=since)
+            packages = packages.filter(updated_at__gte=since)
+            # The provisioning row (and its password) may be written well after completion
+            payments = Payment.objects.filter(
+                Q(completed_at__gte=since) |
+                Q(pk__in=PaymentProvisioning.objects.filter(updated_at__gte=since).values('payment_id'))
+            )
+            voucher_rows = Voucher.objects.filter(Q(created_at__gte=since) | Q(redeemed_at__gte=since))
+
+        return {
+            'now': now,
+            'routers': [(router.pk, router.name, resolve(router.host)) for router in routers],
+            'packages': [
+                (package.pk, hotspot.rate_limit(package), package.duration_hours) for package in packages
+            ],
+            'entitlements': (
+                [_payment_entitlement(row, now) for row in payments.values(*PAYMENT_FIELDS)]
+                + [_voucher_entitlement(row, now) for row in voucher_rows.values(*VOUCHER_FIELDS)]
+            ),
+        }
+    finally:
+        connections.close_all()
+
+
+def save_sessions(updates):
+    """Write accounting updates (keyed by (router id, session id)) in a few bulk queries"""
+    try:
+        existing = {}
+        router_ids = {router_id for router_id, _ in updates}
+        session_ids = {session_id for _, session_id in updates}
+        for session in HotspotSession.objects.filter(router_id__in=router_ids, session_id__in=session_ids):
+            existing[(session.router_id, session.session_id)] = session
+
+        created, changed = [], []
+        for (router_id, session_id), update in updates.items():
+            session = existing.get((router_id, session_id))
+            if session is None:
+                session = HotspotSession(
+                    router_id=router_id, session_id=session_id, started_at=update['started_at']
+                )
+                created.append(session)
+            else:
+                changed.append(session)
+            for field in ('username', 'mac_address', 'ip_address', 'input_octets', 'output_octets',
+                          'session_time', 'updated_at'):
+                if update.get(field) not in (None, ''):
+                    setattr(session, field, update[field])
+            if update.get('stopped'):
+                session.status = 'stopped'
+                session.stopped_at = update['updated_at']
+                session.terminate_cause = update.get('terminate_cause', '')
+
+        HotspotSession.objects.bulk_create(created, batch_size=500, ignore_conflicts=True)
+        HotspotSession.objects.bulk_update(changed, [
+            'username', 'mac_address', 'ip_address', 'status', 'input_octets', 'output_octets',
+            'session_time', 'terminate_cause', 'updated_at', 'stopped_at',
+        ], batch_size=500)
+        return len(created) + len(changed)
+    finally:
+        connections.close_all()
+
+
+def claim_voucher(voucher_id, duration_hours, mac_address, ip_address):
+    try:
+        if vouchers.claim(voucher_id, duration_hours, mac_address, ip_address, statuses=('created', 'uploaded')) is None:
+            logger.warning("Voucher %s accepted over RADIUS was already redeemed", voucher_id)
+    finally:
+        connections.close_all()
+
+
+# Server
+
+class _Endpoint(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server.handle(data, addr, self.transport)
+
+
+class RadiusServer:
+    """asyncio UDP RADIUS server answering hotspot logins from the entitlement index
+
+    Access-Request: the router is recognised by the packet's source address
+    (its ``host``; routers behind one address are told apart by a
+    NAS-Identifier equal to the router name) and the login is checked
+    against the router's entitlements:
+
+    - phone number: the provisioning password if one was issued, otherwise
+      only from the MAC address that paid,
+    - voucher code with an empty password (or the code again); the first
+      login redeems the voucher and binds it to the device,
+    - MAC login (``login-by=mac``) for devices that paid or redeemed.
+
+    Accepts carry Session-Timeout (seconds left) and Mikrotik-Rate-Limit
+    from the package. Accounting Start/Interim-Update/Stop packets are
+    answered at once and written to HotspotSession in one batch per refresh
+    tick. Retransmitted requests get the same reply again.
+
+    All packet handling happens on the event loop; database reads and
+    writes run on a single worker thread, every ``refresh_interval``
+    seconds, with a complete reload every ``full_refresh_interval``.
+    """
+
+    REPLY_CACHE_SECONDS = 30
+
+    def __init__(self, secret, refresh_interval=2, full_refresh_interval=300, interim_interval=300):
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.interim_interval = interim_interval
+        self.index = EntitlementIndex()
+        self.addresses = []
+        self.stats = {
+            'access_requests': 0, 'accepted': 0, 'rejected': 0, 'accounting': 0,
+            'duplicates': 0, 'dropped': 0, 'unknown_nas': 0,
+        }
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='radius-db')
+        self._replies = {}
+        self._sessions = {}
+        self._redeemed = {}
+        self._refreshed_at = None
+        self._last_full = 0
+
+    async def serve(self, host='0.0.0.0', auth_port=1812, acct_port=1813, stdout=None):
+        """Load the index, listen and refresh until cancelled"""
+        loop = asyncio.get_running_loop()
+        await self.refresh(full=True)
+        transports = []
+        try:
+            for port in (auth_port, acct_port):
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda: _Endpoint(self), local_addr=(host, port)
+                )
+                transports.append(transport)
+                self.addresses.append(transport.get_extra_info('sockname'))
+            while True:
+                await asyncio.sleep(self.refresh_interval)
+                full = time.monotonic() - self._last_full >= self.full_refresh_interval
+                try:
+                    await self.refresh(full=full)
+                    await self.flush_sessions()
+                except Exception:
+                    logger.exception("RADIUS refresh failed")
+                if full and stdout:
+                    stdout.write(self.format_stats())
+        finally:
+            for transport in transports:
+                transport.close()
+            await self.flush_sessions()
+            self._executor.shutdown(wait=True)
+
+    async def refresh(self, full=False):
+        """Apply the rows changed since the previous refresh (or reload everything)"""
+        loop = asyncio.get_running_loop()
+        since = None if full or self._refreshed_at is None else self._refreshed_at - timedelta(seconds=OVERLAP)
+        changes = await loop.run_in_executor(self._executor, load_changes, since)
+
+        # A full reload builds a fresh index and swaps it in, which also drops deleted rows
+        index = EntitlementIndex() if since is None else self.index
+        for router_id, name, addresses in changes['routers']:
+            index.set_router(router_id, name, addresses)
+        for package_id, rate_limit, duration_hours in changes['packages']:
+            index.set_package(package_id, rate_limit, duration_hours)
+        for source, entitlement in changes['entitlements']:
+            if entitlement is None:
+                index.discard(source)
+            else:
+                index.put(entitlement)
+
+        # Redemptions that may not have been read back yet
+        horizon = time.monotonic() - 2 * OVERLAP
+        for source, (entitlement, redeemed_at) in list(self._redeemed.items()):
+            if redeemed_at < horizon:
+                del self._redeemed[source]
+            else:
+                index.put(entitlement)
+
+        if since is None:
+            self.index = index
+            self._last_full = time.monotonic()
+        self._refreshed_at = changes['now']
+        now = time.monotonic()
+        self._replies = {key: reply for key, reply in self._replies.items() if reply[0] > now}
+
+    async def flush_sessions(self):
+        if not self._sessions:
+            return
+        updates, self._sessions = self._sessions, {}
+        await asyncio.get_running_loop().run_in_executor(self._executor, save_sessions, updates)
+
+    def format_stats(self):
+        stats = self.stats
+        return (
+            f"{len(self.index)} entitlements on {len(self.index.routers)} routers; "
+            f"{stats['access_requests']} logins ({stats['accepted']} accepted, {stats['rejected']} rejected), "
+            f"{stats['accounting']} accounting, {stats['dropped']} dropped, {stats['unknown_nas']} from unknown routers"
+        )
+
+    def handle(self, data, addr, transport):
+        """Answer one datagram"""
+        try:
+            request = Packet.decode(data)
+        except ValueError:
+            self.stats['dropped'] += 1
+            return
+
+        key = (addr, request.identifier, request.authenticator)
+        cached = self._replies.get(key)
+        if cached is not None:
+            self.stats['duplicates'] += 1
+            transport.sendto(cached[1], addr)
+            return
+
+        try:
+            if request.code == ACCESS_REQUEST:
+                reply = self.authenticate(request, addr[0])
+            elif request.code == ACCOUNTING_REQUEST:
+                reply = self.account(request, addr[0])
+            else:
+                reply = None
+        except Exception:
+            logger.exception("Handling RADIUS packet from %s failed", addr[0])
+            reply = None
+
+        if reply is None:
+            self.stats['dropped'] += 1
+            return
+        self._replies[key] = (time.monotonic() + self.REPLY_CACHE_SECONDS, reply)
+        transport.sendto(reply, addr)
+
+    def _router(self, request, address):
+        router_id = self.index.router_for(address, request.text(NAS_IDENTIFIER))
+        if router_id is None:
+            self.stats['unknown_nas'] += 1
+        return router_id
+
+    def authenticate(self, request, address):
+        """Access-Accept or Access-Reject for an Access-Request; None to drop it"""
+        if not message_authenticator_ok(request, self.secret):
+            return None
+        router_id = self._router(request, address)
+        if router_id is None:
+            return None
+        self.stats['access_requests'] += 1
+
+        username = request.text(USER_NAME)
+        mac = normalize_mac(request.text(CALLING_STATION_ID))
+        mac_username = normalize_mac(username)
+        password_ok = self._password_check(request)
+        now = timezone.now()
+
+        best, best_expiry = None, None
+        for entitlement in self.index.candidates(router_id, username, mac_username):
+            if not self._allowed(entitlement, mac, mac_username, password_ok, now):
+                continue
+            expires_at = entitlement.expires_at or now + timedelta(
+                hours=self.index.packages.get(entitlement.package_id, (None, 0))[1]
+            )
+            if best is None or expires_at > best_expiry:
+                best, best_expiry = entitlement, expires_at
+
+        if best is None or best_expiry <= now:
+            self.stats['rejected'] += 1
+            return build_reply(request, ACCESS_REJECT, [(REPLY_MESSAGE, 'No active package for this login')], self.secret)
+
+        if best.redeemable:
+            self._redeem(best, best_expiry, mac, request)
+
+        attributes = [(SESSION_TIMEOUT, max(int((best_expiry - now).total_seconds()), 1))]
+        rate_limit = self.index.packages.get(best.package_id, (None, 0))[0]
+        if rate_limit:
+            attributes.append(vendor_attribute(MIKROTIK_VENDOR_ID, MIKROTIK_RATE_LIMIT, rate_limit))
+        if self.interim_interval:
+            attributes.append((ACCT_INTERIM_INTERVAL, self.interim_interval))
+        self.stats['accepted'] += 1
+        return build_reply(request, ACCESS_ACCEPT, attributes, self.secret)
+
+    def _password_check(self, request):
+        chap = request.get(CHAP_PASSWORD)
+        if chap is not None:
+            challenge = request.get(CHAP_CHALLENGE) or request.authenticator
+            return lambda password: check_chap(chap, challenge, password.encode())
+        value = request.get(USER_PASSWORD)
+        plain = reveal_password(value, self.secret, request.authenticator) if value is not None else b''
+        return lambda password: hmac.compare_digest(plain, password.encode())
+
+    @staticmethod
+    def _allowed(entitlement, mac, mac_username, password_ok, now):
+        if entitlement.expires_at is not None and entitlement.expires_at <= now:
+            return False
+        if mac_username and mac_username == entitlement.mac:
+            # login-by=mac: the router vouches for the device's address
+            return mac == entitlement.mac
+        if entitlement.source[0] == 'voucher':
+            if entitlement.mac and mac and mac != entitlement.mac:
+                return False
+            return password_ok('') or password_ok(entitlement.username)
+        if entitlement.password:
+            return password_ok(entitlement.password)
+        return bool(entitlement.mac) and mac == entitlement.mac
+
+    def _redeem(self, entitlement, expires_at, mac, request):
+        """First login with a voucher: bind it to the device now, record it in the database behind"""
+        redeemed = Entitlement(
+            entitlement.source, entitlement.router_id, entitlement.username, None,
+            mac, entitlement.package_id, expires_at,
+        )
+        self.index.put(redeemed)
+        self._redeemed[entitlement.source] = (redeemed, time.monotonic())
+        framed_ip = request.get(FRAMED_IP_ADDRESS)
+        ip_address = str(ipaddress.ip_address(framed_ip)) if framed_ip and len(framed_ip) == 4 else ''
+        duration_hours = self.index.packages.get(entitlement.package_id, (None, 0))[1]
+        self._executor.submit(claim_voucher, entitlement.source[1], duration_hours, mac, ip_address)
+
+    def account(self, request, address):
+        """Accounting-Response for an Accounting-Request; None to drop it"""
+        if not accounting_authentic(request, self.secret):
+            return None
+        router_id = self._router(request, address)
+        if router_id is None:
+            return None
+        self.stats['accounting'] += 1
+
+        status_type = request.integer(ACCT_STATUS_TYPE)
+        session_id = request.text(ACCT_SESSION_ID)
+        if status_type in (ACCT_START, ACCT_INTERIM_UPDATE, ACCT_STOP) and session_id:
+            now = timezone.now()
+            session_time = request.integer(ACCT_SESSION_TIME)
+            update = self._sessions.setdefault((router_id, session_id), {
+                'started_at': now - timedelta(seconds=session_time),
+            })
+            framed_ip = request.get(FRAMED_IP_ADDRESS)
+            update.update({
+                'username': request.text(USER_NAME),
+                'mac_address': normalize_mac(request.text(CALLING_STATION_ID)),
+                'ip_address': str(ipaddress.ip_address(framed_ip)) if framed_ip and len(framed_ip) == 4 else '',
+                'input_octets': (request.integer(ACCT_INPUT_GIGAWORDS) << 32) + request.integer(ACCT_INPUT_OCTETS),
+                'output_octets': (request.integer(ACCT_OUTPUT_GIGAWORDS) << 32) + request.integer(ACCT_OUTPUT_OCTETS),
+                'session_time': session_time,
+                'updated_at': now,
+            })
+            if status_type == ACCT_STOP:
+                update['stopped'] = True
+                cause = request.integer(ACCT_TERMINATE_CAUSE)
+                update['terminate_cause'] = TERMINATE_CAUSES.get(cause, str(cause) if cause else '')
+        return build_reply(request, ACCOUNTING_RESPONSE, [], self.secret)
@@ -0,0 +1,252 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from routers import hotspot
+from routers.mikrotik_api import MikrotikAPIManager
+from .models import Payment, PaymentProvisioning, Voucher
+from .provisioning import hotspot_user
+
+logger = logging.getLogger(__name__)
+
+# Provisioning rows that still entitle the customer to access while the package lasts
+ENTITLED_STATUSES = ['pending', 'running', 'provisioned', 'failed']
+
+
+class RouterReconciler:
+    """Brings a router's hotspot users in line with the paid entitlements in the database
+
+    Per router the hotspot users, active sessions and package profiles are
+    read once (one parallel read batch). Router users are indexed by name and
+    sessions by user and MAC address, so the diff is a handful of set
+    operations over the two sides:
+
+    - entitled customers without a hotspot user are added,
+    - users whose password, profile or limit-uptime differ are updated with
+      only the differing attributes,
+    - managed users (created for a payment) without an unexpired payment are
+      removed, with their sessions and any session of a device that only
+      held expired payments.
+
+    Users created by hand on the router and voucher users (see
+    payments.vouchers) are never removed. Writes are applied
+    in batches of ``batch_size`` commands over the router's pooled client.
+    """
+
+    def __init__(self, workers=None, batch_size=None):
+        self.workers = workers or getattr(settings, 'ROUTER_RECONCILE_WORKERS', 8)
+        self.batch_size = batch_size or getattr(settings, 'ROUTER_RECONCILE_BATCH_SIZE', 500)
+
+    def plan(self, router, now=None):
+        """Compute the changes for ``router`` without applying them"""
+        now = now or timezone.now()
+        result = MikrotikAPIManager.execute_batch(router, [
+            {'command': 'ip/hotspot/user', 'params': {'.proplist': '.id,name,password,profile,limit-uptime,comment'}},
+            {'command': 'ip/hotspot/active', 'params': {'.proplist': '.id,user,mac-address'}},
+            {'command': 'ip/hotspot/user/profile', 'params': {'.proplist': '.id,name,rate-limit'}},
+        ], parallel_reads=True)
+        if not result['success']:
+            error = result.get('error') or next(
+                line['error'] for line in result['steps'] if not line['success']
+            )
+            return {'router': router, 'error': f'Reading hotspot state failed: {error}'}
+
+        users, sessions, profiles = (hotspot.as_rows(line['result']) for line in result['steps'])
+        users_by_name = {user.get('name'): user for user in users}
+        sessions_by_user = {}
+        sessions_by_mac = {}
+        for session in sessions:
+            sessions_by_user.setdefault(session.get('user'), []).append(session)
+            if session.get('mac-address'):
+                sessions_by_mac.setdefault(session['mac-address'].upper(), []).append(session)
+
+        # Latest-expiring entitlement per customer
+        entitled = {}
+        for record in (
+            PaymentProvisioning.objects.filter(
+                payment__router_id=router.pk,
+                status__in=ENTITLED_STATUSES,
+                payment__status='completed',
+                payment__package_expiry_time__gt=now,
+            )
+            .select_related('payment__package')
+            .order_by('payment__package_expiry_time')
+        ):
+            entitled[record.username] = record
+
+        add, update = [], []
+        for name, record in entitled.items():
+            desired = hotspot_user(record)
+            current = users_by_name.get(name)
+            if current is None:
+                add.append((record, desired))
+                continue
+            changes = hotspot.user_changes(desired, current)
+            if changes:
+                update.append((record, current, changes))
+
+        stale = [
+            name for name, user in users_by_name.items()
+            if name not in entitled and hotspot.is_managed_user(user)
+        ]
+        drop = {session['.id']: session for name in stale for session in sessions_by_user.get(name, [])}
+
+        # Devices logged in (e.g. by MAC) that only ever paid for now-expired access
+        entitled_macs = {
+            record.payment.mac_address.upper() for record in entitled.values() if record.payment.mac_address
+        }
+        candidates = set(sessions_by_mac) - entitled_macs
+        if candidates:
+            paid_macs = set(
+                mac.upper() for mac in Payment.objects.filter(
+                    router_id=router.pk, status='completed', mac_address__in=_case_variants(candidates)
+                ).values_list('mac_address', flat=True)
+            )
+            swept = [session for mac in paid_macs & candidates for session in sessions_by_mac[mac]]
+            # A device that once paid may now be on a voucher: a local voucher
+            # user, or (with RADIUS) a redeemed code that is not a local user
+            vouchers = set(Voucher.objects.filter(
+                router_id=router.pk, status='redeemed', expires_at__gt=now,
+                code__in={session.get('user') for session in swept},
+            ).values_list('code', flat=True))
+            for session in swept:
+                user = session.get('user')
+                if user in entitled or user in vouchers or hotspot.is_voucher_user(users_by_name.get(user, {})):
+                    continue
+                drop[session['.id']] = session
+
+        packages = {record.payment.package_id: record.payment.package for record, _ in add}
+        packages.update({
+            record.payment.package_id: record.payment.package for record, _, changes in update if 'profile' in changes
+        })
+        current_profiles = {profile.get('name'): profile for profile in profiles}
+
+        return {
+            'router': router,
+            'profiles': hotspot.profile_steps(packages.values(), current_profiles),
+            'add': add,
+            'update': update,
+            'remove_users': [users_by_name[name] for name in sorted(stale)],
+            'remove_sessions': list(drop.values()),
+            'unchanged': len(entitled) - len(add) - len(update),
+            'router_users': len(users),
+            'router_sessions': len(sessions),
+        }
+
+    def apply(self, plan):
+        """Apply a plan from ``plan()``; returns {'applied': n, 'errors': [...]}"""
+        router = plan['router']
+        steps = list(plan['profiles'])
+        added = []
+        for record, desired in plan['add']:
+            steps.append({'command': 'ip/hotspot/user/add', 'method': 'POST', 'data': desired})
+            added.append((len(steps) - 1, record))
+        for record, current, changes in plan['update']:
+            steps.append({
+                'command': 'ip/hotspot/user/set',
+                'method': 'POST',
+                'data': dict(changes, **hotspot.item_target(current, current.get('name'))),
+            })
+        # Removals name many ids per command; see _retry_removals for partial failures
+        removals = {}
+        user_ids = [user['.id'] for user in plan['remove_users']]
+        session_ids = [session['.id'] for session in plan['remove_sessions']]
+        for command, ids in (('ip/hotspot/user/remove', user_ids), ('ip/hotspot/active/remove', session_ids)):
+            for start in range(0, len(ids), self.batch_size):
+                chunk = ids[start:start + self.batch_size]
+                steps.append({'command': command, 'method': 'POST', 'data': {'numbers': ','.join(chunk)}})
+                removals[len(steps) - 1] = chunk
+
+        applied, errors, ok = 0, [], set()
+        for start in range(0, len(steps), self.batch_size):
+            chunk = steps[start:start + self.batch_size]
+            result = MikrotikAPIManager.execute_batch(router, chunk)
+            if not result['steps']:
+                errors.append(result['error'])
+                break
+            for line in result['steps']:
+                index = start + line['index']
+                if line['success']:
+                    applied += len(removals.get(index, [None]))
+                    ok.add(index)
+                elif index in removals and 'no such item' in str(line.get('error', '')):
+                    count, failures = self._retry_removals(router, line['command'], removals[index])
+                    applied += count
+                    errors += failures
+                else:
+                    errors.append(f"{line['command']}: {line['error']}")
+
+        # Customers whose provisioning failed now have their user
+        fixed = [record.pk for index, record in added if index in ok and record.status != 'provisioned']
+        if fixed:
+            now = timezone.now()
+            PaymentProvisioning.objects.filter(pk__in=fixed, status__in=['pending', 'failed']).update(
+                status='provisioned', provisioned_at=now, error_message='', updated_at=now
+            )
+        return {'applied': applied, 'errors': errors}
+
+    def _retry_removals(self, router, command, ids):
+        """Remove ``ids`` one by one after a combined remove hit an id that is already gone"""
+        result = MikrotikAPIManager.execute_batch(router, [
+            {'command': command, 'method': 'POST', 'data': {'numbers': item_id}} for item_id in ids
+        ])
+        if not result['steps']:
+            return 0, [result['error']]
+        applied, errors = 0, []
+        for line in result['steps']:
+            if line['success']:
+                applied += 1
+            elif 'no such item' not in str(line.get('error', '')):
+                errors.append(f"{command}: {line['error']}")
+        return applied, errors
+
+    def reconcile(self, router, dry_run=False):
+        """Plan and (unless ``dry_run``) apply; returns a report dict"""
+        try:
+            plan = self.plan(router)
+            report = self._report(plan)
+            if plan.get('error') or dry_run:
+                return report
+            report.update(self.apply(plan))
+            return report
+        except Exception as e:
+            logger.exception("Reconciling router %s crashed", router.pk)
+            return {'router': router, 'error': str(e)}
+        finally:
+            connections.close_all()
+
+    def reconcile_fleet(self, routers, dry_run=False):
+        """Reconcile many routers concurrently; yields reports in completion order"""
+        routers = list(routers)
+        if not routers:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(routers)), thread_name_prefix='reconcile') as executor:
+            futures = [executor.submit(self.reconcile, router, dry_run) for router in routers]
+            for future in as_completed(futures):
+                yield future.result()
+
+    @staticmethod
+    def _report(plan):
+        if plan.get('error'):
+            return {'router': plan['router'], 'error': plan['error']}
+        return {
+            'router': plan['router'],
+            'profiles': plan['profiles'],
+            'add': [desired['name'] for _, desired in plan['add']],
+            'update': {current.get('name'): sorted(changes) for _, current, changes in plan['update']},
+            'remove_users': [user.get('name') for user in plan['remove_users']],
+            'remove_sessions': [
+                f"{session.get('user')} ({session.get('mac-address') or 'no MAC'})" for session in plan['remove_sessions']
+            ],
+            'unchanged': plan['unchanged'],
+            'router_users': plan['router_users'],
+            'router_sessions': plan['router_sessions'],
+        }
+
+
+def _case_variants(macs):
+    """MACs as stored in either case (payments keep what the captive portal sent)"""
+    return list(macs) + [mac.lower() for mac in macs]
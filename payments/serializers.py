@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import PaymentCredentials, Payment
+from .models import PaymentCredentials, Payment, PaymentProvisioning, VoucherBatch, Voucher
 
 class PaymentCredentialsSerializer(serializers.ModelSerializer):
     """Serializer for PaymentCredentials model"""
@@ -13,13 +13,14 @@ class PaymentCredentialsSerializer(serializers.ModelSerializer):
         model = PaymentCredentials
         fields = [
             'id', 'provider', 'provider_display', 'api_key', 'private_key',
-            'environment', 'is_active', 'created_at', 'updated_at',
+            'webhook_challenge', 'environment', 'is_active', 'created_at', 'updated_at',
             'is_live', 'is_sandbox'
         ]
         read_only_fields = ['id', 'provider_display', 'encrypted_private_key', 'private_key_hash', 'created_at', 'updated_at', 'is_live', 'is_sandbox']
         extra_kwargs = {
             'api_key': {'required': True},
             'provider': {'required': True},
+            'webhook_challenge': {'write_only': True},
         }
     
     def get_fields(self):
@@ -84,10 +85,13 @@ class PaymentCredentialsUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = PaymentCredentials
         fields = [
-            'id', 'provider', 'provider_display', 'api_key', 'environment',
+            'id', 'provider', 'provider_display', 'api_key', 'webhook_challenge', 'environment',
             'is_active', 'created_at', 'updated_at', 'is_live', 'is_sandbox'
         ]
         read_only_fields = ['id', 'provider', 'provider_display', 'created_at', 'updated_at', 'is_live', 'is_sandbox']
+        extra_kwargs = {
+            'webhook_challenge': {'write_only': True},
+        }
     
     def validate(self, data):
         """Validate update data"""
@@ -237,10 +241,62 @@ class PaymentUpdateSerializer(serializers.ModelSerializer):
         """Validate status transitions"""
         if self.instance:
             current_status = self.instance.status
-            # Only allow certain status transitions
-            if current_status == 'completed' and value != 'completed':
-                raise serializers.ValidationError("Cannot change status of completed payment")
-            if current_status == 'cancelled' and value != 'cancelled':
-                raise serializers.ValidationError("Cannot change status of cancelled payment")
+            # Only allow the transitions in Payment.TRANSITIONS
+            if value != current_status and not Payment.can_transition(current_status, value):
+                raise serializers.ValidationError(f"Cannot change status of {current_status} payment to {value}")
         
         return value
+    
+    def update(self, instance, validated_data):
+        """Change the status through Payment.transition(), then save the other fields"""
+        new_status = validated_data.pop('status', instance.status)
+        if new_status != instance.status and not instance.transition(new_status):
+            raise serializers.ValidationError({
+                'status': f"Payment is already {instance.status}"
+            })
+        
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        if validated_data:
+            instance.save(update_fields=list(validated_data) + ['updated_at'])
+        return instance
+
+
+class PaymentProvisioningSerializer(serializers.ModelSerializer):
+    """Serializer for the hotspot access granted for a payment"""
+    
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = PaymentProvisioning
+        fields = [
+            'status', 'status_display', 'username', 'password', 'logged_in',
+            'attempts', 'next_attempt_at', 'error_message', 'provisioned_at', 'revoked_at'
+        ]
+        read_only_fields = fields
+
+
+class VoucherBatchSerializer(serializers.ModelSerializer):
+    """Serializer for a voucher batch and its upload progress"""
+    
+    router_name = serializers.CharField(source='router.name', read_only=True)
+    package_name = serializers.CharField(source='package.name', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    progress = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = VoucherBatch
+        fields = [
+            'id', 'router', 'router_name', 'package', 'package_name', 'count', 'status', 'status_display',
+            'uploaded_count', 'progress', 'chunks', 'error_message', 'created_at', 'updated_at', 'completed_at'
+        ]
+        read_only_fields = fields
+
+
+class VoucherSerializer(serializers.ModelSerializer):
+    """Serializer for a single voucher code"""
+    
+    class Meta:
+        model = Voucher
+        fields = ['code', 'status', 'mac_address', 'ip_address', 'redeemed_at', 'expires_at']
+        read_only_fields = fields
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from mikrotik_cloudpilot.credentials import credential_cache
+from .models import Payment, PaymentCredentials, payment_status_changed
+from .intasend_api import intasend_services, intasend_health
+from .events import SETTLED_STATUSES, payment_events
+from .provisioning import hotspot_provisioner
+
+
+@receiver(post_save, sender=PaymentCredentials)
+@receiver(post_delete, sender=PaymentCredentials)
+def evict_private_key(sender, instance, **kwargs):
+    """Drop the cached decrypted private key whenever the credentials change."""
+    credential_cache.evict(instance)
+
+
+@receiver(post_save, sender=PaymentCredentials)
+@receiver(post_delete, sender=PaymentCredentials)
+def evict_intasend_service(sender, instance, **kwargs):
+    """Rebuild the cached IntaSend service (and re-probe) after credentials change."""
+    intasend_services.evict(instance.pk)
+    intasend_health.forget(instance.pk)
+
+
+@receiver(payment_status_changed, sender=Payment)
+def publish_settled_payment(sender, payment, status, **kwargs):
+    """Wake /payments/<id>/events/ waiters once a settlement is committed."""
+    if status in SETTLED_STATUSES:
+        payment_events.publish(payment.pk)
+
+
+@receiver(payment_status_changed, sender=Payment)
+def provision_completed_payment(sender, payment, status, **kwargs):
+    """Queue hotspot access on the router for a newly completed payment."""
+    if status == 'completed' and getattr(settings, 'PAYMENT_PROVISIONING_ENABLED', True):
+        hotspot_provisioner.enqueue(payment)
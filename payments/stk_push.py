@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .intasend_api import IntaSendAPI
+from .models import Payment
+
+logger = logging.getLogger(__name__)
+
+
+class StkPushQueue:
+    """Sends STK pushes on a local thread pool
+
+    Lets the initiate endpoint answer 202 as soon as the Payment exists
+    instead of holding the worker for the IntaSend call. A push is submitted
+    once the Payment is committed. A push that never reached IntaSend is
+    retried up to ``retries`` times (each retry counted in ``retry_count``);
+    one IntaSend rejected marks the payment failed with the error in
+    ``error_message``. When the outcome is unknown (a read timeout, or an
+    error after IntaSend answered) the phone may already show the prompt,
+    so the push is not sent again: the payment stays pending for the
+    webhook or the payment poller to settle.
+
+    The queue lives in memory: pushes still queued when the process exits
+    are lost, and their payments (pending, without IntaSend ids) are
+    expired by the payment poller.
+    """
+
+    def __init__(self, workers=8, retries=1, retry_delay=2):
+        self.workers = workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._executor = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.unconfirmed = 0
+
+    def enqueue(self, payment_id):
+        """Send the payment's STK push in the background after the current transaction commits"""
+        transaction.on_commit(lambda: self._submit(payment_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': self.queued,
+                'sent': self.sent,
+                'failed': self.failed,
+                'unconfirmed': self.unconfirmed,
+            }
+
+    def _submit(self, payment_id):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='stk-push')
+            self.queued += 1
+        self._executor.submit(self._run, payment_id)
+
+    def _run(self, payment_id):
+        try:
+            payment = Payment.objects.select_related('user', 'router', 'package').filter(pk=payment_id).first()
+            if payment is None or payment.status != 'pending':
+                # Deleted, cancelled or expired while queued
+                return
+
+            sent, error = self._push(payment)
+            with self._lock:
+                if sent:
+                    self.sent += 1
+                elif sent is None:
+                    self.unconfirmed += 1
+                else:
+                    self.failed += 1
+            if sent is None:
+                logger.warning("STK push for payment %s may have been sent, leaving it pending: %s", payment_id, error)
+            elif not sent:
+                logger.warning("STK push for payment %s failed: %s", payment_id, error)
+                payment.mark_failed(f'Failed to initiate STK push: {error}')
+        except Exception:
+            logger.exception("STK push for payment %s crashed", payment_id)
+        finally:
+            with self._lock:
+                self.queued -= 1
+            connections.close_all()
+
+    def _push(self, payment):
+        """Returns (sent, last error); sent is None when the push may have gone out"""
+        try:
+            api = IntaSendAPI.for_user(payment.user)
+        except ValueError as e:
+            # Credentials problems will not fix themselves on retry
+            return False, str(e)
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                payment.increment_retry()
+                time.sleep(self.retry_delay * attempt)
+                payment.refresh_from_db(fields=['status'])
+                if not payment.is_pending:
+                    return False, f'payment was {payment.status} before the retry'
+            result = api.initiate_stk_push(payment)
+            if result['success']:
+                return True, None
+            error = result['error']
+            if result.get('outcome') == 'unknown':
+                return None, error
+            if result.get('outcome') == 'rejected':
+                break
+        return False, error
+
+
+stk_push_queue = StkPushQueue(
+    workers=getattr(settings, 'PAYMENT_STK_PUSH_WORKERS', 8),
+    retries=getattr(settings, 'PAYMENT_STK_PUSH_RETRIES', 1),
+    retry_delay=getattr(settings, 'PAYMENT_STK_PUSH_RETRY_DELAY', 2),
+)
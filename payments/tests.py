@@ -1,3 +1,361 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import os
+import struct
+from datetime import timedelta
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from . import radius
+
+SECRET = b'testing123'
+ROUTER_ADDRESS = ('10.0.0.1', 40000)
+MAC = 'AA:BB:CC:DD:EE:01'
+
+
+def access_request(attributes, password=None, identifier=1, message_authenticator=False, authenticator=None):
+    """An Access-Request as a router would send it, optionally signed with a Message-Authenticator"""
+    authenticator = authenticator or os.urandom(16)
+    attributes = list(attributes)
+    if password is not None:
+        attributes.append((radius.USER_PASSWORD, radius.hide_password(password, SECRET, authenticator)))
+    body = radius.encode_attributes(attributes)
+    if message_authenticator:
+        body += struct.pack('!BB', radius.MESSAGE_AUTHENTICATOR, 18) + bytes(16)
+        header = struct.pack('!BBH', radius.ACCESS_REQUEST, identifier, 20 + len(body))
+        body = body[:-16] + hmac.new(SECRET, header + authenticator + body, hashlib.md5).digest()
+    return struct.pack('!BBH', radius.ACCESS_REQUEST, identifier, 20 + len(body)) + authenticator + body
+
+
+def accounting_request(attributes, identifier=1, secret=SECRET):
+    body = radius.encode_attributes(attributes)
+    header = struct.pack('!BBH', radius.ACCOUNTING_REQUEST, identifier, 20 + len(body))
+    return header + hashlib.md5(header + bytes(16) + body + secret).digest() + body
+
+
+def rate_limit(reply):
+    """The Mikrotik-Rate-Limit carried by a reply, if any"""
+    for value in reply.attributes.get(radius.VENDOR_SPECIFIC, []):
+        vendor_id, kind, _ = struct.unpack('!IBB', value[:6])
+        if vendor_id == radius.MIKROTIK_VENDOR_ID and kind == radius.MIKROTIK_RATE_LIMIT:
+            return value[6:].decode()
+    return None
+
+
+class FakeTransport:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+
+class PacketTests(SimpleTestCase):
+    def test_decode(self):
+        packet = radius.Packet.decode(access_request([(radius.USER_NAME, '0700')], identifier=9) + b'pad')
+        self.assertEqual(packet.code, radius.ACCESS_REQUEST)
+        self.assertEqual(packet.identifier, 9)
+        self.assertEqual(packet.text(radius.USER_NAME), '0700')
+        # Bytes past the header's length are not part of the packet
+        self.assertFalse(packet.raw.endswith(b'pad'))
+
+    def test_decode_malformed(self):
+        valid = access_request([(radius.USER_NAME, '0700')])
+        for name, data in [
+            ('shorter than a header', valid[:19]),
+            ('length beyond the datagram', struct.pack('!BBH', 1, 1, len(valid) + 1) + valid[4:]),
+            ('length below a header', struct.pack('!BBH', 1, 1, 19) + valid[4:]),
+            ('truncated attribute', struct.pack('!BBH', 1, 1, 21) + bytes(16) + b'\x01'),
+            ('attribute length below 2', struct.pack('!BBH', 1, 1, 22) + bytes(16) + b'\x01\x01'),
+            ('attribute past the packet', struct.pack('!BBH', 1, 1, 22) + bytes(16) + b'\x01\x09'),
+        ]:
+            with self.subTest(name):
+                with self.assertRaises(ValueError):
+                    radius.Packet.decode(data)
+
+    def test_integer_and_missing_attributes(self):
+        packet = radius.Packet.decode(access_request([(radius.SESSION_TIMEOUT, 3600)]))
+        self.assertEqual(packet.integer(radius.SESSION_TIMEOUT), 3600)
+        self.assertEqual(packet.integer(radius.ACCT_SESSION_TIME), 0)
+        self.assertEqual(packet.text(radius.USER_NAME), '')
+
+    def test_pap_round_trip(self):
+        authenticator = os.urandom(16)
+        for password in [b'', b'pw', b'x' * 16, b'y' * 17, b'z' * 40]:
+            with self.subTest(length=len(password)):
+                hidden = radius.hide_password(password, SECRET, authenticator)
+                self.assertEqual(len(hidden), max(16, -(-len(password) // 16) * 16))
+                self.assertEqual(radius.reveal_password(hidden, SECRET, authenticator), password)
+        hidden = radius.hide_password(b'pw', SECRET, authenticator)
+        self.assertNotEqual(radius.reveal_password(hidden, b'other', authenticator), b'pw')
+
+    def test_chap(self):
+        challenge = os.urandom(16)
+        value = b'\x07' + hashlib.md5(b'\x07' + b'pw' + challenge).digest()
+        self.assertTrue(radius.check_chap(value, challenge, b'pw'))
+        self.assertFalse(radius.check_chap(value, challenge, b'other'))
+        self.assertFalse(radius.check_chap(value[:-1], challenge, b'pw'))
+
+    def test_message_authenticator(self):
+        signed = radius.Packet.decode(access_request([(radius.USER_NAME, '0700')], message_authenticator=True))
+        self.assertTrue(radius.message_authenticator_ok(signed, SECRET))
+        self.assertFalse(radius.message_authenticator_ok(signed, b'other'))
+
+        tampered = bytearray(signed.raw)
+        tampered[-20] ^= 1
+        self.assertFalse(radius.message_authenticator_ok(radius.Packet.decode(bytes(tampered)), SECRET))
+
+        unsigned = radius.Packet.decode(access_request([(radius.USER_NAME, '0700')]))
+        self.assertTrue(radius.message_authenticator_ok(unsigned, SECRET))
+
+    def test_build_reply_signs_the_response(self):
+        request = radius.Packet.decode(access_request([(radius.USER_NAME, '0700')], identifier=4))
+        data = radius.build_reply(request, radius.ACCESS_ACCEPT, [(radius.SESSION_TIMEOUT, 60)], SECRET)
+        reply = radius.Packet.decode(data)
+        self.assertEqual((reply.code, reply.identifier), (radius.ACCESS_ACCEPT, 4))
+        self.assertIsNone(reply.get(radius.MESSAGE_AUTHENTICATOR))
+        expected = hashlib.md5(data[:4] + request.authenticator + data[20:] + SECRET).digest()
+        self.assertEqual(reply.authenticator, expected)
+
+    def test_build_reply_adds_message_authenticator(self):
+        request = radius.Packet.decode(access_request([(radius.USER_NAME, '0700')], message_authenticator=True))
+        data = radius.build_reply(request, radius.ACCESS_REJECT, [(radius.REPLY_MESSAGE, 'no')], SECRET)
+        reply = radius.Packet.decode(data)
+        self.assertEqual(reply.text(radius.REPLY_MESSAGE), 'no')
+
+        # Signed over the reply with the request's authenticator and its own value zeroed (RFC 3579)
+        zeroed = radius._zero_message_authenticator(data)
+        signed = zeroed[:4] + request.authenticator + zeroed[20:]
+        self.assertEqual(reply.get(radius.MESSAGE_AUTHENTICATOR), hmac.new(SECRET, signed, hashlib.md5).digest())
+        expected = hashlib.md5(data[:4] + request.authenticator + data[20:] + SECRET).digest()
+        self.assertEqual(reply.authenticator, expected)
+
+    def test_accounting_authentic(self):
+        data = accounting_request([(radius.ACCT_STATUS_TYPE, radius.ACCT_START), (radius.ACCT_SESSION_ID, 's1')])
+        self.assertTrue(radius.accounting_authentic(radius.Packet.decode(data), SECRET))
+        self.assertFalse(radius.accounting_authentic(radius.Packet.decode(data), b'other'))
+        forged = accounting_request([(radius.ACCT_STATUS_TYPE, radius.ACCT_START)], secret=b'other')
+        self.assertFalse(radius.accounting_authentic(radius.Packet.decode(forged), SECRET))
+
+    def test_normalize_mac(self):
+        self.assertEqual(radius.normalize_mac('aa-bb-cc-dd-ee-01'), MAC)
+        self.assertEqual(radius.normalize_mac('aabb.ccdd.ee01'), MAC)
+        self.assertEqual(radius.normalize_mac('0700123456'), '')
+        self.assertEqual(radius.normalize_mac(None), '')
+
+
+class EntitlementIndexTests(SimpleTestCase):
+    def voucher(self, redeemed):
+        if redeemed:
+            return radius.Entitlement(('voucher', 1), 1, 'CODE', None, MAC, 5, timezone.now() + timedelta(hours=1))
+        return radius.Entitlement(('voucher', 1), 1, 'CODE', None, '', 5, None, redeemable=True)
+
+    def test_late_unredeemed_read_keeps_the_redemption(self):
+        index = radius.EntitlementIndex()
+        index.put(self.voucher(redeemed=False))
+        index.put(self.voucher(redeemed=True))
+        index.put(self.voucher(redeemed=False))
+
+        entitlement = index.sources[('voucher', 1)]
+        self.assertFalse(entitlement.redeemable)
+        self.assertEqual(entitlement.mac, MAC)
+        self.assertEqual(list(index.candidates(1, 'code', MAC)), [entitlement])
+
+    def test_discard_clears_every_table(self):
+        index = radius.EntitlementIndex()
+        index.put(self.voucher(redeemed=True))
+        index.discard(('voucher', 1))
+        index.discard(('voucher', 1))
+        self.assertEqual((len(index), index.by_user, index.by_mac), (0, {}, {}))
+
+    def test_router_for(self):
+        index = radius.EntitlementIndex()
+        index.set_router(1, 'branch-a', ['10.0.0.1'])
+        index.set_router(2, 'branch-b', ['10.0.0.1'])
+        index.set_router(3, 'solo', ['10.0.0.3'])
+        self.assertEqual(index.router_for('10.0.0.3'), 3)
+        self.assertEqual(index.router_for('10.0.0.1', 'branch-b'), 2)
+        self.assertIsNone(index.router_for('10.0.0.1'))
+        self.assertIsNone(index.router_for('10.0.0.9'))
+
+        index.set_router(3, 'solo', ['10.0.0.4'])
+        self.assertIsNone(index.router_for('10.0.0.3'))
+        self.assertEqual(index.router_for('10.0.0.4'), 3)
+
+
+class RadiusServerTests(SimpleTestCase):
+    def setUp(self):
+        self.server = radius.RadiusServer(SECRET, interim_interval=120)
+        self.addCleanup(self.server._executor.shutdown)
+        self.transport = FakeTransport()
+        index = self.server.index
+        index.set_router(1, 'branch', [ROUTER_ADDRESS[0]])
+        index.set_package(5, '2M/5M', 1)
+        self.expires_at = timezone.now() + timedelta(hours=1)
+        index.put(radius.Entitlement(('payment', 1), 1, '0700', 'pw', MAC, 5, self.expires_at))
+        index.put(radius.Entitlement(('payment', 2), 1, '0711', None, 'AA:BB:CC:DD:EE:02', 5, self.expires_at))
+
+    def send(self, data, addr=ROUTER_ADDRESS):
+        self.server.handle(data, addr, self.transport)
+        if not self.transport.sent:
+            return None
+        reply, to = self.transport.sent.pop()
+        self.assertEqual(to, addr)
+        return radius.Packet.decode(reply)
+
+    def test_accept_with_password(self):
+        reply = self.send(access_request([(radius.USER_NAME, '0700')], password=b'pw'))
+        self.assertEqual(reply.code, radius.ACCESS_ACCEPT)
+        self.assertAlmostEqual(reply.integer(radius.SESSION_TIMEOUT), 3600, delta=5)
+        self.assertEqual(rate_limit(reply), '2M/5M')
+        self.assertEqual(reply.integer(radius.ACCT_INTERIM_INTERVAL), 120)
+        self.assertEqual(self.server.stats['accepted'], 1)
+
+    def test_accept_with_chap(self):
+        challenge = os.urandom(16)
+        chap = b'\x01' + hashlib.md5(b'\x01' + b'pw' + challenge).digest()
+        reply = self.send(access_request([
+            (radius.USER_NAME, '0700'), (radius.CHAP_PASSWORD, chap), (radius.CHAP_CHALLENGE, challenge),
+        ]))
+        self.assertEqual(reply.code, radius.ACCESS_ACCEPT)
+
+    def test_reject_wrong_password(self):
+        reply = self.send(access_request([(radius.USER_NAME, '0700')], password=b'nope', message_authenticator=True))
+        self.assertEqual(reply.code, radius.ACCESS_REJECT)
+        self.assertEqual(reply.text(radius.REPLY_MESSAGE), 'No active package for this login')
+        self.assertIsNone(reply.get(radius.SESSION_TIMEOUT))
+        self.assertIsNotNone(reply.get(radius.MESSAGE_AUTHENTICATOR))
+        self.assertEqual(self.server.stats['rejected'], 1)
+
+    def test_passwordless_payment_only_from_its_device(self):
+        attributes = [(radius.USER_NAME, '0711')]
+        reply = self.send(access_request(attributes + [(radius.CALLING_STATION_ID, 'AA-BB-CC-DD-EE-02')], password=b''))
+        self.assertEqual(reply.code, radius.ACCESS_ACCEPT)
+        reply = self.send(access_request(attributes + [(radius.CALLING_STATION_ID, MAC)], password=b''))
+        self.assertEqual(reply.code, radius.ACCESS_REJECT)
+
+    def test_mac_login(self):
+        reply = self.send(access_request(
+            [(radius.USER_NAME, MAC), (radius.CALLING_STATION_ID, MAC)], password=b''
+        ))
+        self.assertEqual(reply.code, radius.ACCESS_ACCEPT)
+
+    def test_expired_entitlement_is_rejected(self):
+        self.server.index.put(radius.Entitlement(
+            ('payment', 3), 1, '0722', 'pw', '', 5, timezone.now() - timedelta(seconds=1)
+        ))
+        reply = self.send(access_request([(radius.USER_NAME, '0722')], password=b'pw'))
+        self.assertEqual(reply.code, radius.ACCESS_REJECT)
+
+    def test_bad_message_authenticator_is_dropped(self):
+        data = bytearray(access_request([(radius.USER_NAME, '0700')], password=b'pw', message_authenticator=True))
+        data[-1] ^= 1
+        self.assertIsNone(self.send(bytes(data)))
+        self.assertEqual(self.server.stats['dropped'], 1)
+
+    def test_unknown_router_and_garbage_are_dropped(self):
+        self.assertIsNone(self.send(access_request([(radius.USER_NAME, '0700')], password=b'pw'), ('10.9.9.9', 1)))
+        self.assertEqual(self.server.stats['unknown_nas'], 1)
+        self.assertIsNone(self.send(b'\x01\x02'))
+        self.assertEqual(self.server.stats['dropped'], 2)
+
+    def test_retransmit_gets_the_same_reply(self):
+        data = access_request([(radius.USER_NAME, '0700')], password=b'pw')
+        self.server.handle(data, ROUTER_ADDRESS, self.transport)
+        self.server.handle(data, ROUTER_ADDRESS, self.transport)
+        self.assertEqual(self.transport.sent[0], self.transport.sent[1])
+        self.assertEqual(self.server.stats['duplicates'], 1)
+        self.assertEqual(self.server.stats['access_requests'], 1)
+
+    def test_accounting(self):
+        reply = self.send(accounting_request([
+            (radius.ACCT_STATUS_TYPE, radius.ACCT_STOP),
+            (radius.ACCT_SESSION_ID, 's1'),
+            (radius.USER_NAME, '0700'),
+            (radius.CALLING_STATION_ID, MAC),
+            (radius.FRAMED_IP_ADDRESS, bytes([10, 5, 50, 9])),
+            (radius.ACCT_INPUT_OCTETS, 1000),
+            (radius.ACCT_INPUT_GIGAWORDS, 1),
+            (radius.ACCT_SESSION_TIME, 60),
+            (radius.ACCT_TERMINATE_CAUSE, 1),
+        ]))
+        self.assertEqual(reply.code, radius.ACCOUNTING_RESPONSE)
+        update = self.server._sessions[(1, 's1')]
+        self.assertEqual(update['input_octets'], (1 << 32) + 1000)
+        self.assertEqual(update['ip_address'], '10.5.50.9')
+        self.assertEqual(update['terminate_cause'], 'user-request')
+        self.assertTrue(update['stopped'])
+
+    def test_forged_accounting_is_dropped(self):
+        self.assertIsNone(self.send(accounting_request(
+            [(radius.ACCT_STATUS_TYPE, radius.ACCT_START), (radius.ACCT_SESSION_ID, 's1')], secret=b'other'
+        )))
+        self.assertEqual(self.server._sessions, {})
+
+
+class RadiusVoucherTests(SimpleTestCase):
+    """Vouchers loaded from rows as load_changes reads them, without the database"""
+
+    def setUp(self):
+        self.server = radius.RadiusServer(SECRET)
+        self.addCleanup(self.server._executor.shutdown)
+        self.transport = FakeTransport()
+        self.claims = []
+        self.server._executor.submit = lambda fn, *args: self.claims.append((fn, args))
+        self.now = timezone.now()
+
+        index = self.server.index
+        index.set_router(1, 'branch', [ROUTER_ADDRESS[0]])
+        index.set_package(5, '2M/5M', 1)
+        index.put(self.voucher_row(status='uploaded'))
+
+    def voucher_row(self, **row):
+        row = {
+            'pk': 7, 'router_id': 1, 'code': 'ABCD2345', 'mac_address': '', 'package_id': 5,
+            'expires_at': None, 'status': 'created', **row,
+        }
+        return radius._voucher_entitlement(row, self.now)[1]
+
+    def login(self, mac, password=b''):
+        self.server.handle(
+            access_request([(radius.USER_NAME, 'abcd2345'), (radius.CALLING_STATION_ID, mac)], password=password),
+            ROUTER_ADDRESS, self.transport,
+        )
+        return radius.Packet.decode(self.transport.sent.pop()[0])
+
+    def test_first_login_redeems_and_binds_the_device(self):
+        reply = self.login(MAC)
+        self.assertEqual(reply.code, radius.ACCESS_ACCEPT)
+        self.assertAlmostEqual(reply.integer(radius.SESSION_TIMEOUT), 3600, delta=5)
+        self.assertEqual(rate_limit(reply), '2M/5M')
+
+        self.assertEqual(self.login(MAC).code, radius.ACCESS_ACCEPT)
+        self.assertEqual(self.login('AA:BB:CC:DD:EE:99').code, radius.ACCESS_REJECT)
+
+        # The redemption is written behind, once
+        self.assertEqual(self.claims, [(radius.claim_voucher, (7, 1, MAC, ''))])
+
+    def test_voucher_code_as_password(self):
+        self.assertEqual(self.login(MAC, password=b'ABCD2345').code, radius.ACCESS_ACCEPT)
+
+    def test_wrong_voucher_password_is_rejected(self):
+        self.assertEqual(self.login(MAC, password=b'guess').code, radius.ACCESS_REJECT)
+        self.assertEqual(self.claims, [])
+
+    def test_redeemed_rows(self):
+        row = self.voucher_row(status='redeemed', mac_address=MAC.lower(), expires_at=self.now + timedelta(hours=1))
+        self.assertFalse(row.redeemable)
+        self.assertEqual(row.mac, MAC)
+        self.assertIsNone(self.voucher_row(status='redeemed', expires_at=self.now - timedelta(seconds=1)))
+        self.assertIsNone(self.voucher_row(status='expired'))
+
+    def test_provisioning_password(self):
+        row = {
+            'pk': 3, 'router_id': 1, 'phone_number': '0700', 'mac_address': '', 'package_id': 5,
+            'package_expiry_time': self.now + timedelta(hours=1), 'status': 'completed',
+            'provisioning__password': 'pw',
+        }
+        self.assertEqual(radius._payment_entitlement(row, self.now)[1].password, 'pw')
+        row['provisioning__password'] = None
+        self.assertIsNone(radius._payment_entitlement(row, self.now)[1].password)
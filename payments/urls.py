@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     # Payment Credentials URLs
@@ -17,6 +17,7 @@ urlpatterns = [
     path('<uuid:pk>/mark-completed/', views.mark_payment_completed, name='mark_payment_completed'),
     path('<uuid:pk>/mark-failed/', views.mark_payment_failed, name='mark_payment_failed'),
     path('<uuid:pk>/increment-retry/', views.increment_payment_retry, name='increment_payment_retry'),
+    path('<uuid:pk>/events/', async_views.payment_status_events, name='payment_status_events'),
     path('status/<str:status>/', views.payment_by_status, name='payment_by_status'),
     path('method/<str:method>/', views.payment_by_method, name='payment_by_method'),
     
@@ -24,6 +25,14 @@ urlpatterns = [
     path('intasend/initiate/', views.initiate_intasend_payment, name='initiate_intasend_payment'),
     path('intasend/<uuid:payment_id>/check-status/', views.check_intasend_payment_status, name='check_intasend_payment_status'),
     path('intasend/create-link/', views.create_intasend_payment_link, name='create_intasend_payment_link'),
+    path('webhook/', views.intasend_webhook, name='intasend_webhook'),
+    
+    # Voucher URLs
+    path('vouchers/batches/', views.voucher_batch_list, name='voucher_batch_list'),
+    path('vouchers/batches/<int:pk>/', views.voucher_batch_detail, name='voucher_batch_detail'),
+    path('vouchers/batches/<int:pk>/codes/', views.voucher_batch_codes, name='voucher_batch_codes'),
+    path('vouchers/batches/<int:pk>/upload/', views.voucher_batch_upload, name='voucher_batch_upload'),
+    path('vouchers/redeem/', views.redeem_voucher, name='redeem_voucher'),
     
     # Mikrotik Login Page URLs
     path('mikrotik-login/', views.mikrotik_login_page, name='mikrotik_login_page'),
@@ -1,21 +1,28 @@
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.conf import settings
 from django.shortcuts import render
 from django.http import HttpResponse
-from .models import PaymentCredentials, Payment
+from .models import PaymentCredentials, Payment, VoucherBatch
 from .serializers import (
     PaymentCredentialsSerializer, 
     PaymentCredentialsUpdateSerializer,
     PaymentCredentialsListSerializer,
     PaymentSerializer,
     PaymentListSerializer,
-    PaymentUpdateSerializer
+    PaymentUpdateSerializer,
+    VoucherBatchSerializer,
+    VoucherSerializer
 )
-from .intasend_api import IntaSendAPI
+from .intasend_api import IntaSendAPI, intasend_services, intasend_health, intasend_status
 from .authentication import PublicKeyAuthentication
+from .webhooks import apply_intasend_state, process_intasend_webhook
+from .idempotency import idempotent
+from .stk_push import stk_push_queue
+from .vouchers import create_batch, redeem, voucher_uploads
 
 # Create your views here.
 
@@ -129,13 +136,24 @@ def verify_credentials(request, pk):
     
     is_valid = credentials.verify_private_key(private_key)
     
-    return Response({
+    response_data = {
         'credentials_id': pk,
         'provider': credentials.provider,
         'provider_display': credentials.get_provider_display_name(),
         'is_valid': is_valid,
         'message': 'Credentials verified successfully' if is_valid else 'Invalid private key'
-    })
+    }
+    
+    # Live IntaSend check, at most once per INTASEND_HEALTH_PROBE_INTERVAL per credentials
+    if is_valid and credentials.provider == 'instasend':
+        try:
+            response_data['connectivity'] = intasend_health.check(
+                intasend_services.for_credentials(credentials, user=request.user)
+            )
+        except ValueError as e:
+            response_data['connectivity'] = {'ok': False, 'error': str(e), 'checked_at': None, 'cached': False}
+    
+    return Response(response_data)
 
 @api_view(['GET'])
 @authentication_classes([JWTAuthentication])
@@ -263,7 +281,11 @@ def mark_payment_completed(request, pk):
             'error': 'Payment not found or access denied'
         }, status=status.HTTP_404_NOT_FOUND)
     
-    payment.mark_completed()
+    if not payment.mark_completed():
+        return Response({
+            'error': f'Payment is already {payment.status}'
+        }, status=status.HTTP_409_CONFLICT)
+    
     response_serializer = PaymentSerializer(payment)
     return Response({
         'message': 'Payment marked as completed',
@@ -283,7 +305,11 @@ def mark_payment_failed(request, pk):
         }, status=status.HTTP_404_NOT_FOUND)
     
     error_message = request.data.get('error_message', '')
-    payment.mark_failed(error_message)
+    if not payment.mark_failed(error_message):
+        return Response({
+            'error': f'Payment is already {payment.status}'
+        }, status=status.HTTP_409_CONFLICT)
+    
     response_serializer = PaymentSerializer(payment)
     return Response({
         'message': 'Payment marked as failed',
@@ -341,9 +367,17 @@ def payment_by_method(request, method):
 
 # IntaSend Payment Views
 
+def _wants_async(request):
+    """Async STK push if the client sends "Prefer: respond-async" or it is the default"""
+    prefer = request.headers.get('Prefer', '').lower()
+    if 'respond-async' in prefer:
+        return True
+    return getattr(settings, 'PAYMENT_STK_PUSH_ASYNC', False)
+
 @api_view(['POST'])
 @authentication_classes([PublicKeyAuthentication])
 @permission_classes([IsAuthenticated])
+@idempotent('initiate')
 def initiate_intasend_payment(request):
     """Initiate IntaSend payment via STK push"""
     try:
@@ -406,7 +440,18 @@ def initiate_intasend_payment(request):
         )
         
         # Initialize IntaSend API with automatically fetched credentials
-        intasend_api = IntaSendAPI(request.user)
+        intasend_api = IntaSendAPI.for_user(request.user)
+        
+        # Async mode: send the STK push from the background queue and answer now;
+        # the client then waits on /payments/<id>/events/
+        if _wants_async(request):
+            stk_push_queue.enqueue(payment.pk)
+            response_serializer = PaymentSerializer(payment)
+            return Response({
+                'message': 'STK push queued',
+                'payment': response_serializer.data,
+                'events_url': f'/payments/{payment.pk}/events/'
+            }, status=status.HTTP_202_ACCEPTED, headers={'Preference-Applied': 'respond-async'})
         
         # Initiate STK push
         result = intasend_api.initiate_stk_push(payment)
@@ -426,9 +471,7 @@ def initiate_intasend_payment(request):
             }, status=status.HTTP_201_CREATED)
         else:
             # Mark payment as failed
-            payment.status = 'failed'
-            payment.error_message = result['error']
-            payment.save()
+            payment.mark_failed(result['error'])
             
             return Response({
                 'error': f'Failed to initiate STK push: {result["error"]}',
@@ -476,42 +519,38 @@ def check_intasend_payment_status(request, payment_id):
                 'error': 'This payment was not initiated through IntaSend'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Initialize IntaSend API with automatically fetched credentials
-        intasend_api = IntaSendAPI(request.user)
+        # Settled payments (usually by the webhook) are answered from the database
+        if not payment.is_pending:
+            response_serializer = PaymentSerializer(payment)
+            return Response({
+                'message': 'Payment completed successfully!' if payment.is_successful else f'Payment already {payment.status}',
+                'payment': response_serializer.data,
+                'status': payment.status,
+                'state': payment.intasend_state or 'UNKNOWN'
+            })
         
-        # Check payment status
-        result = intasend_api.check_payment_status(payment)
+        # Check payment status; concurrent checks of the same payment share one
+        # IntaSend call and its result is reused for INTASEND_STATUS_CACHE_TTL
+        result, state_age = intasend_status.check(
+            payment.pk,
+            lambda: IntaSendAPI.for_user(request.user).check_payment_status(payment)
+        )
         
         if result['success']:
-            # Update payment status based on IntaSend response
+            # Update payment status based on IntaSend response (no-op if the
+            # webhook already moved it)
             intasend_state = result['state']
-            
-            # Update the IntaSend state first
-            payment.intasend_state = intasend_state
-            
-            # Check for completed states (IntaSend uses "COMPLETE", not "COMPLETED")
-            completed_states = ['COMPLETE', 'COMPLETED', 'SUCCESS', 'SUCCESSFUL']
-            failed_states = ['FAILED', 'CANCELLED', 'DECLINED', 'ERROR']
-            
-            if intasend_state in completed_states:
-                payment.status = 'completed'
-                payment.mark_completed()
-            elif intasend_state in failed_states:
-                payment.status = 'failed'
-                payment.error_message = f'Payment {intasend_state.lower()} on IntaSend'
-                payment.save()
-            else:
-                # Keep current status but update IntaSend state
-                payment.save()
+            _, payment = apply_intasend_state(payment, intasend_state)
             
             # Return simplified response for completed payments
-            if intasend_state in completed_states:
+            if payment.status == 'completed':
                 response_serializer = PaymentSerializer(payment)
                 return Response({
                     'message': 'Payment completed successfully!',
                     'payment': response_serializer.data,
                     'status': 'completed',
-                    'state': intasend_state
+                    'state': intasend_state,
+                    'state_age': round(state_age, 1)
                 })
             else:
                 # Return detailed response for other states
@@ -521,6 +560,7 @@ def check_intasend_payment_status(request, payment_id):
                     'payment': response_serializer.data,
                     'status': payment.status,
                     'state': intasend_state,
+                    'state_age': round(state_age, 1),
                     'details': {
                         'amount': result.get('amount'),
                         'currency': result.get('currency'),
@@ -547,6 +587,7 @@ def check_intasend_payment_status(request, payment_id):
 @api_view(['POST'])
 @authentication_classes([PublicKeyAuthentication])
 @permission_classes([IsAuthenticated])
+@idempotent('create-link')
 def create_intasend_payment_link(request):
     """Create IntaSend payment link for the given payment"""
     try:
@@ -609,7 +650,7 @@ def create_intasend_payment_link(request):
         )
         
         # Initialize IntaSend API with automatically fetched credentials
-        intasend_api = IntaSendAPI(request.user)
+        intasend_api = IntaSendAPI.for_user(request.user)
         
         # Create payment link
         result = intasend_api.create_payment_link(payment)
@@ -628,9 +669,7 @@ def create_intasend_payment_link(request):
             }, status=status.HTTP_201_CREATED)
         else:
             # Mark payment as failed
-            payment.status = 'failed'
-            payment.error_message = result['error']
-            payment.save()
+            payment.mark_failed(result['error'])
             
             return Response({
                 'error': f'Failed to create payment link: {result["error"]}',
@@ -648,6 +687,188 @@ def create_intasend_payment_link(request):
             'error': f'Payment link creation failed: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def intasend_webhook(request):
+    """Receive IntaSend payment callbacks and settle the matching payment"""
+    if not isinstance(request.data, dict):
+        return Response({
+            'error': 'Webhook body must be a JSON object'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Dashboard test deliveries carry only the challenge
+    if not any(request.data.get(key) for key in ('invoice_id', 'id', 'api_ref')):
+        return Response({'message': 'Webhook received'})
+    
+    event = process_intasend_webhook(dict(request.data))
+    
+    if event.outcome == 'rejected':
+        return Response({
+            'error': event.error_message
+        }, status=status.HTTP_403_FORBIDDEN)
+    if event.outcome == 'unmatched':
+        # Not found yet (the callback may beat our own save); IntaSend retries
+        return Response({
+            'error': 'No payment matches this callback'
+        }, status=status.HTTP_404_NOT_FOUND)
+    if event.error_message:
+        return Response({
+            'error': f'Failed to apply webhook: {event.error_message}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    return Response({
+        'message': 'Webhook processed',
+        'payment_id': str(event.payment_id),
+        'outcome': event.outcome
+    })
+
+
+# Voucher Views
+
+@api_view(['GET', 'POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def voucher_batch_list(request):
+    """List voucher batches or generate a new one and upload it to the router"""
+    if request.method == 'GET':
+        batches = VoucherBatch.objects.filter(user=request.user).select_related('router', 'package')
+        serializer = VoucherBatchSerializer(batches, many=True)
+        return Response(serializer.data)
+    
+    router_id = request.data.get('router_id')
+    package_id = request.data.get('package_id')
+    count = request.data.get('count')
+    if not all([router_id, package_id, count]):
+        return Response({
+            'error': 'router_id, package_id and count are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    limit = getattr(settings, 'VOUCHER_BATCH_MAX', 10000)
+    try:
+        count = int(count)
+    except (TypeError, ValueError):
+        count = 0
+    if not 1 <= count <= limit:
+        return Response({
+            'error': f'count must be between 1 and {limit}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    from routers.models import Router, Package
+    try:
+        router = Router.objects.get(pk=router_id, user=request.user)
+    except Router.DoesNotExist:
+        return Response({
+            'error': 'Router not found or access denied'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        package = Package.objects.get(pk=package_id, router=router, is_active=True)
+    except Package.DoesNotExist:
+        return Response({
+            'error': 'Package not found or not active for this router'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    batch = create_batch(request.user, router, package, count)
+    voucher_uploads.enqueue(batch.pk)
+    serializer = VoucherBatchSerializer(batch)
+    return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def voucher_batch_detail(request, pk):
+    """Retrieve a voucher batch and its upload progress"""
+    try:
+        batch = VoucherBatch.objects.select_related('router', 'package').get(pk=pk, user=request.user)
+    except VoucherBatch.DoesNotExist:
+        return Response({
+            'error': 'Voucher batch not found or access denied'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    serializer = VoucherBatchSerializer(batch)
+    return Response(serializer.data)
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def voucher_batch_codes(request, pk):
+    """List the codes of a voucher batch, e.g. for printing"""
+    try:
+        batch = VoucherBatch.objects.get(pk=pk, user=request.user)
+    except VoucherBatch.DoesNotExist:
+        return Response({
+            'error': 'Voucher batch not found or access denied'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    vouchers = batch.vouchers.all()
+    voucher_status = request.query_params.get('status')
+    if voucher_status:
+        vouchers = vouchers.filter(status=voucher_status)
+    serializer = VoucherSerializer(vouchers, many=True)
+    return Response(serializer.data)
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def voucher_batch_upload(request, pk):
+    """Upload the vouchers of a batch the router does not have yet"""
+    try:
+        batch = VoucherBatch.objects.select_related('router', 'package').get(pk=pk, user=request.user)
+    except VoucherBatch.DoesNotExist:
+        return Response({
+            'error': 'Voucher batch not found or access denied'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    if batch.status in ['uploading', 'uploaded']:
+        return Response({
+            'error': f'Voucher batch is already {batch.status}'
+        }, status=status.HTTP_409_CONFLICT)
+    
+    voucher_uploads.enqueue(batch.pk)
+    serializer = VoucherBatchSerializer(batch)
+    return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+@api_view(['POST'])
+@authentication_classes([PublicKeyAuthentication])
+@permission_classes([IsAuthenticated])
+def redeem_voucher(request):
+    """Redeem a voucher from the captive portal and log the device in"""
+    router_id = request.data.get('router_id')
+    code = request.data.get('code')
+    if not all([router_id, code]):
+        return Response({
+            'error': 'router_id and code are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    from routers.models import Router
+    try:
+        router = Router.objects.get(pk=router_id, user=request.user)
+    except Router.DoesNotExist:
+        return Response({
+            'error': 'Router not found or access denied'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    voucher, logged_in, error = redeem(
+        request.user, router, code,
+        mac_address=request.data.get('mac_address', ''),
+        ip_address=request.data.get('ip_address', '')
+    )
+    if voucher is None:
+        return Response({'error': error}, status=status.HTTP_404_NOT_FOUND)
+    if error and voucher.status == 'uploaded':
+        # Claimed, then given back because the router could not enable it
+        return Response({'error': error}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if error:
+        return Response({'error': error}, status=status.HTTP_409_CONFLICT)
+    
+    return Response({
+        'message': 'Voucher redeemed',
+        'voucher': VoucherSerializer(voucher).data,
+        'username': voucher.code,
+        'logged_in': logged_in
+    })
+
 
 # Mikrotik Login Page Views
 
@@ -0,0 +1,258 @@
+import logging
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from routers import hotspot, scripts
+from routers.mikrotik_api import MikrotikAPIManager
+from routers.profile_sync import sync_profiles
+from .models import Voucher, VoucherBatch
+
+logger = logging.getLogger(__name__)
+
+# No 0/O, 1/I/L: codes are read off paper
+CODE_ALPHABET = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
+
+
+def generate_codes(router, count, length):
+    """``count`` random codes not yet used on ``router``"""
+    codes = set()
+    while len(codes) < count:
+        wanted = count - len(codes)
+        fresh = {''.join(secrets.choice(CODE_ALPHABET) for _ in range(length)) for _ in range(wanted)}
+        taken = set(Voucher.objects.filter(router=router, code__in=fresh).values_list('code', flat=True))
+        codes |= fresh - taken
+    return list(codes)[:count]
+
+
+def create_batch(user, router, package, count):
+    """Create a batch and its vouchers (one bulk insert); upload with voucher_uploads.enqueue()"""
+    length = getattr(settings, 'VOUCHER_CODE_LENGTH', 8)
+    for attempt in range(3):
+        try:
+            with transaction.atomic():
+                batch = VoucherBatch.objects.create(user=user, router=router, package=package, count=count)
+                Voucher.objects.bulk_create([
+                    Voucher(batch=batch, router=router, package=package, code=code)
+                    for code in generate_codes(router, count, length)
+                ], batch_size=1000)
+            return batch
+        except IntegrityError:
+            # Another batch took one of the codes meanwhile
+            if attempt == 2:
+                raise
+
+
+def voucher_comment(batch, chunk):
+    return f'{hotspot.VOUCHER_COMMENT_PREFIX}{batch.pk}/{chunk}'
+
+
+def render_script(batch, vouchers, chunk):
+    """One import script adding ``vouchers`` as hotspot users on the package's profile
+
+    The users are added disabled: a code only logs in once ``redeem`` has
+    claimed it and enabled its user.
+    """
+    lines = [f'# {batch.count} x {batch.package.name}, batch {batch.pk} part {chunk}']
+    for voucher in vouchers:
+        lines.append(scripts.render_line('ip/hotspot/user', 'add', {
+            'name': voucher.code,
+            'password': '',
+            'profile': hotspot.profile_name(batch.package),
+            'limit-uptime': hotspot.limit_uptime(batch.package),
+            'comment': voucher_comment(batch, chunk),
+            'disabled': True,
+        }, ignore_errors=True))
+    return '\n'.join(lines) + '\n'
+
+
+class VoucherUploader:
+    """Uploads voucher batches to their routers on a small thread pool
+
+    Vouchers are sent ``chunk_size`` at a time; each chunk is one generated
+    import script (see routers.scripts.run_script), so 5,000 codes cost a
+    handful of commands instead of 5,000. After each chunk the router is
+    asked which of its users carry the chunk's comment, and only those
+    vouchers are marked uploaded. Progress and per-chunk results are saved on
+    the batch as they happen. Uploading a batch again only sends the
+    vouchers not yet confirmed.
+    """
+
+    def __init__(self, workers=2, chunk_size=5000):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._executor = None
+        self._lock = threading.Lock()
+        self.running = 0
+
+    def enqueue(self, batch_id):
+        """Upload the batch in the background after the current transaction commits"""
+        transaction.on_commit(lambda: self._submit(batch_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'chunk_size': self.chunk_size,
+                'running': self.running,
+            }
+
+    def upload(self, batch):
+        """Send the batch's unconfirmed vouchers; returns the batch with its final status"""
+        claimed = VoucherBatch.objects.filter(
+            pk=batch.pk, status__in=['created', 'partial', 'failed']
+        ).update(status='uploading', error_message='', updated_at=timezone.now())
+        if not claimed:
+            batch.refresh_from_db()
+            return batch
+
+        batch.refresh_from_db()
+        router, package = batch.router, batch.package
+        report = sync_profiles(router)
+        if report['error'] or report['errors']:
+            return self._finish(batch, 'failed', report['error'] or '; '.join(report['errors']))
+
+        pending = list(batch.vouchers.filter(status='created').only('id', 'code'))
+        failures = 0
+        for start in range(0, len(pending), self.chunk_size):
+            vouchers = pending[start:start + self.chunk_size]
+            chunk = len(batch.chunks)
+            result = scripts.run_script(router, render_script(batch, vouchers, chunk))
+
+            confirmed = 0
+            error = result['error']
+            if error is None:
+                confirmed, error = self._confirm(batch, vouchers, chunk)
+            batch.chunks = batch.chunks + [{
+                'index': chunk,
+                'vouchers': len(vouchers),
+                'uploaded': confirmed,
+                'success': error is None and confirmed == len(vouchers),
+                'error': error or ('' if confirmed == len(vouchers) else f'{len(vouchers) - confirmed} codes were not created'),
+                'elapsed_ms': result['elapsed_ms'],
+            }]
+            batch.uploaded_count += confirmed
+            failures += not batch.chunks[-1]['success']
+            batch.save(update_fields=['chunks', 'uploaded_count', 'updated_at'])
+
+        if batch.uploaded_count >= batch.count:
+            return self._finish(batch, 'uploaded')
+        status = 'failed' if not batch.uploaded_count else 'partial'
+        return self._finish(batch, status, f'{failures} of the upload chunks failed')
+
+    def _confirm(self, batch, vouchers, chunk):
+        """Mark the chunk's vouchers the router now has; returns (count, error)"""
+        result = MikrotikAPIManager.execute_command(
+            batch.router, 'ip/hotspot/user', 'GET',
+            params={'comment': voucher_comment(batch, chunk), '.proplist': 'name'}, use_cache=False
+        )
+        if not result['success']:
+            return 0, f"Checking uploaded codes failed: {result['error']}"
+        present = {user.get('name') for user in hotspot.as_rows(result['data'])}
+        ids = [voucher.pk for voucher in vouchers if voucher.code in present]
+        Voucher.objects.filter(pk__in=ids, status='created').update(status='uploaded')
+        return len(ids), None
+
+    @staticmethod
+    def _finish(batch, status, error=''):
+        batch.status = status
+        batch.error_message = error
+        batch.completed_at = timezone.now()
+        batch.save(update_fields=['status', 'error_message', 'completed_at', 'updated_at'])
+        return batch
+
+    def _submit(self, batch_id):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='voucher-upload')
+        self._executor.submit(self._run, batch_id)
+
+    def _run(self, batch_id):
+        with self._lock:
+            self.running += 1
+        try:
+            batch = VoucherBatch.objects.select_related('router', 'package').filter(pk=batch_id).first()
+            if batch is not None:
+                self.upload(batch)
+        except Exception as e:
+            logger.exception("Uploading voucher batch %s crashed", batch_id)
+            VoucherBatch.objects.filter(pk=batch_id, status='uploading').update(
+                status='failed', error_message=str(e), updated_at=timezone.now()
+            )
+        finally:
+            with self._lock:
+                self.running -= 1
+            connections.close_all()
+
+
+def claim(voucher_id, duration_hours, mac_address='', ip_address='', statuses=('uploaded',)):
+    """Mark a voucher redeemed unless someone else got there first; returns its expiry or None"""
+    now = timezone.now()
+    expires_at = now + timedelta(hours=duration_hours)
+    won = Voucher.objects.filter(pk=voucher_id, status__in=statuses).update(
+        status='redeemed',
+        redeemed_at=now,
+        expires_at=expires_at,
+        mac_address=mac_address,
+        ip_address=ip_address,
+    )
+    return expires_at if won else None
+
+
+def redeem(user, router, code, mac_address='', ip_address=''):
+    """Redeem an uploaded voucher once; returns (voucher or None, logged_in, error)
+
+    The package's duration starts now and the voucher's hotspot user is
+    enabled. With the device's MAC and IP the device is logged in to the
+    hotspot right away. If the router cannot enable the user the voucher is
+    given back, so it can be redeemed again.
+    """
+    voucher = Voucher.objects.select_related('package').filter(
+        router=router, router__user=user, code=code.strip().upper()
+    ).first()
+    if voucher is None:
+        return None, False, 'Voucher not found'
+
+    won = claim(voucher.pk, voucher.package.duration_hours, mac_address, ip_address)
+    voucher.refresh_from_db()
+    if not won:
+        if voucher.status in ('redeemed', 'expired'):
+            return voucher, False, 'Voucher has already been redeemed'
+        return voucher, False, 'Voucher is not active on the router yet'
+
+    steps = [{
+        'command': 'ip/hotspot/user/set',
+        'method': 'POST',
+        'data': {'numbers': voucher.code, 'disabled': 'no'},
+    }]
+    if mac_address and ip_address:
+        steps.append({'command': 'ip/hotspot/active/login', 'method': 'POST', 'data': {
+            'user': voucher.code,
+            'password': '',
+            'mac-address': mac_address,
+            'ip': ip_address,
+        }})
+    result = MikrotikAPIManager.execute_batch(router, steps, stop_on_error=True)
+    if not result['steps'] or not result['steps'][0]['success']:
+        error = result.get('error') or result['steps'][0]['error']
+        Voucher.objects.filter(pk=voucher.pk, status='redeemed').update(
+            status='uploaded', redeemed_at=None, expires_at=None, mac_address='', ip_address=''
+        )
+        voucher.refresh_from_db()
+        return voucher, False, f'Activating the voucher on the router failed: {error}'
+
+    logged_in = len(result['steps']) > 1 and result['steps'][1]['success']
+    if len(result['steps']) > 1 and not logged_in:
+        logger.warning("Hotspot login for voucher %s failed: %s", voucher.code, result['steps'][1]['error'])
+    return voucher, logged_in, None
+
+
+voucher_uploads = VoucherUploader(
+    workers=getattr(settings, 'VOUCHER_UPLOAD_WORKERS', 2),
+    chunk_size=getattr(settings, 'VOUCHER_SCRIPT_MAX_LINES', 5000),
+)
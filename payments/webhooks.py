@@ -0,0 +1,113 @@
+import hmac
+import logging
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+
+from .intasend_api import get_latest_intasend_credentials
+from .models import Payment, PaymentWebhookEvent
+
+logger = logging.getLogger(__name__)
+
+# IntaSend uses "COMPLETE", not "COMPLETED"
+INTASEND_COMPLETED_STATES = ['COMPLETE', 'COMPLETED', 'SUCCESS', 'SUCCESSFUL']
+INTASEND_FAILED_STATES = ['FAILED', 'CANCELLED', 'DECLINED', 'ERROR']
+
+
+def apply_intasend_state(payment, state, failed_reason=None):
+    """Move a payment to the status matching an IntaSend state
+    
+    Uses the conditional Payment transitions, so the webhook, status checks
+    and the poller can race without completing a payment twice. Payments
+    that are already completed, failed or cancelled are left alone. Returns
+    (outcome, payment) where outcome is 'applied' (this call changed the
+    status), 'recorded' (only intasend_state changed) or 'duplicate'
+    (nothing to do), and payment is the up-to-date instance.
+    """
+    state = (state or '').upper()
+    
+    if state in INTASEND_COMPLETED_STATES:
+        won = payment.mark_completed(intasend_state=state)
+    elif state in INTASEND_FAILED_STATES:
+        won = payment.mark_failed(failed_reason or f'Payment {state.lower()} on IntaSend', intasend_state=state)
+    else:
+        recorded = bool(state) and Payment.objects.filter(
+            pk=payment.pk, status__in=Payment.PENDING_STATUSES
+        ).exclude(intasend_state=state).update(intasend_state=state, updated_at=timezone.now())
+        payment.refresh_from_db()
+        return ('recorded' if recorded else 'duplicate'), payment
+    
+    return ('applied' if won else 'duplicate'), payment
+
+
+def find_intasend_payment(payload):
+    """Match a callback to a Payment by invoice id, payment request id or api_ref"""
+    invoice_id = payload.get('invoice_id')
+    if invoice_id:
+        payment = Payment.objects.filter(intasend_invoice_id=invoice_id).first()
+        if payment:
+            return payment
+
+    request_id = payload.get('id')
+    if request_id:
+        payment = Payment.objects.filter(intasend_payment_id=request_id).first()
+        if payment:
+            return payment
+
+    # Payment links are created with reference=<payment id>
+    try:
+        return Payment.objects.filter(pk=uuid.UUID(str(payload.get('api_ref')))).first()
+    except ValueError:
+        return None
+
+
+def expected_challenge(payment):
+    """Challenge configured by the payment owner, falling back to the global setting"""
+    credentials = get_latest_intasend_credentials(payment.user_id) if payment.user_id else None
+
+    if credentials and credentials.webhook_challenge:
+        return credentials.webhook_challenge
+    return getattr(settings, 'INTASEND_WEBHOOK_CHALLENGE', '')
+
+
+def process_intasend_webhook(payload):
+    """Verify, record and apply one IntaSend callback
+
+    Returns the saved PaymentWebhookEvent; its ``outcome`` tells the caller
+    how to answer. The endpoint is public, so the body is only kept for
+    callbacks that matched a payment and passed the challenge; unmatched and
+    rejected ones are recorded by invoice id and state alone.
+    """
+    challenge = payload.get('challenge') or ''
+    state = str(payload.get('state') or '').upper()
+    event = PaymentWebhookEvent(
+        provider='instasend',
+        invoice_id=str(payload.get('invoice_id') or '')[:100],
+        state=state[:50],
+    )
+
+    payment = find_intasend_payment(payload)
+    if payment is None:
+        event.outcome = 'unmatched'
+        event.save()
+        return event
+    event.payment = payment
+
+    expected = expected_challenge(payment)
+    if not expected or not hmac.compare_digest(str(challenge).encode(), expected.encode()):
+        logger.warning("Rejected IntaSend webhook for payment %s: challenge mismatch", payment.pk)
+        event.outcome = 'rejected'
+        event.error_message = 'Webhook challenge missing or invalid'
+        event.save()
+        return event
+
+    event.payload = {key: value for key, value in payload.items() if key != 'challenge'}
+    try:
+        event.outcome, _ = apply_intasend_state(payment, state, payload.get('failed_reason'))
+    except Exception as e:
+        logger.exception("Failed to apply IntaSend webhook for payment %s", payment.pk)
+        event.outcome = 'recorded'
+        event.error_message = str(e)
+    event.save()
+    return event
@@ -69,11 +69,11 @@ class RouterAdmin(admin.ModelAdmin):
     """Admin interface for Router model"""
     
     list_display = [
-        'name', 'user', 'host', 'port', 'username', 'use_https', 'is_online', 'last_checked'
+        'name', 'user', 'host', 'port', 'username', 'use_https', 'api_transport', 'is_online', 'last_checked'
     ]
     
     list_filter = [
-        'use_https', 'is_online', 'created_at', 'updated_at'
+        'use_https', 'api_transport', 'is_online', 'created_at', 'updated_at'
     ]
     
     search_fields = [
@@ -91,6 +91,9 @@ class RouterAdmin(admin.ModelAdmin):
         ('Authentication', {
             'fields': ('username', 'encrypted_password', 'use_https')
         }),
+        ('Transport', {
+            'fields': ('api_transport', 'api_port')
+        }),
         ('Status', {
             'fields': ('is_online', 'last_checked')
         }),
@@ -0,0 +1,710 @@
+import asyncio
+import itertools
+import logging
+import ssl
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import httpx
+from django.conf import settings
+
+from .mikrotik_api import (
+    MikrotikAPIClient,
+    MikrotikAPIManager,
+    circuit_breakers,
+    is_transport_failure,
+    response_cache,
+)
+from .routeros_api import (
+    RouterOSAPIError,
+    RouterOSCommandMixin,
+    RouterOSConnectionError,
+    RouterOSLoginError,
+    RouterOSTrapError,
+    enable_keepalive,
+    encode_sentence,
+    parse_sentence,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def read_length_async(reader):
+    """Read and decode one word length from an asyncio stream"""
+    first = (await reader.readexactly(1))[0]
+    if first < 0x80:
+        return first
+    if first < 0xC0:
+        return ((first & 0x3F) << 8) | (await reader.readexactly(1))[0]
+    if first < 0xE0:
+        return ((first & 0x1F) << 16) | int.from_bytes(await reader.readexactly(2), 'big')
+    if first < 0xF0:
+        return ((first & 0x0F) << 24) | int.from_bytes(await reader.readexactly(3), 'big')
+    if first == 0xF0:
+        return int.from_bytes(await reader.readexactly(4), 'big')
+    raise RouterOSConnectionError(f"Invalid control byte in length: {first:#x}")
+
+
+async def read_sentence_async(reader):
+    """Read one sentence (list of words) from an asyncio stream"""
+    words = []
+    while True:
+        length = await read_length_async(reader)
+        if length == 0:
+            return words
+        words.append((await reader.readexactly(length)).decode('utf-8', errors='replace'))
+
+
+class _AsyncPendingCommand:
+    """Replies collected for one tagged command"""
+
+    def __init__(self, future):
+        self.items = []
+        self.done = {}
+        self.error = None
+        self.future = future
+
+
+class AsyncRouterOSAPIConnection:
+    """asyncio version of RouterOSAPIConnection
+
+    One socket per router, with tagged commands multiplexed over it. A reader
+    task routes replies back to the awaiting coroutines. A command whose
+    caller is cancelled (e.g. the HTTP client went away) is cancelled on the
+    router as well.
+    """
+
+    def __init__(self, host, port, username, password, use_ssl=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._tags = itertools.count(1)
+        self._closed = True
+
+    @property
+    def is_connected(self):
+        return not self._closed
+
+    async def connect(self):
+        """Open the socket, log in and start the reply reader"""
+        context = None
+        if self.use_ssl:
+            context = ssl.create_default_context()
+            if not getattr(settings, 'ROUTEROS_API_VERIFY_SSL', False):
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host, self.port, ssl=context,
+                server_hostname=self.host if context else None
+            ),
+            timeout=self.timeout
+        )
+        try:
+            enable_keepalive(writer.get_extra_info('socket'))
+            writer.write(encode_sentence([
+                '/login', f'=name={self.username}', f'=password={self.password}'
+            ]))
+            await writer.drain()
+            while True:
+                words = await asyncio.wait_for(read_sentence_async(reader), timeout=self.timeout)
+                reply_type, _, attributes = parse_sentence(words)
+                if reply_type == '!done':
+                    break
+                if reply_type in ('!trap', '!fatal'):
+                    raise RouterOSLoginError(attributes.get('message', 'Login failed'))
+        except BaseException:
+            writer.close()
+            raise
+
+        self._reader = reader
+        self._writer = writer
+        self._closed = False
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    async def talk(self, words, timeout=None):
+        """Send a command and wait for its replies; see RouterOSAPIConnection.talk"""
+        return (await self.talk_many([words], timeout=timeout))[0]
+
+    async def talk_many(self, sentences, timeout=None):
+        """Send several commands at once and wait for all of their replies
+
+        A timeout closes the connection, as in RouterOSAPIConnection.talk_many.
+        """
+        if self._closed:
+            raise RouterOSConnectionError("Connection is closed")
+
+        loop = asyncio.get_running_loop()
+        tags = []
+        for _ in sentences:
+            tag = str(next(self._tags))
+            self._pending[tag] = _AsyncPendingCommand(loop.create_future())
+            tags.append(tag)
+        pendings = [self._pending[tag] for tag in tags]
+
+        try:
+            self._writer.write(b''.join(
+                encode_sentence(list(words) + [f'.tag={tag}'])
+                for words, tag in zip(sentences, tags)
+            ))
+            await self._writer.drain()
+        except OSError as e:
+            error = RouterOSConnectionError(f"Failed to send command: {e}")
+            self._fail(error)
+            raise error
+
+        try:
+            _, not_done = await asyncio.wait(
+                [pending.future for pending in pendings],
+                timeout=timeout if timeout is not None else self.timeout
+            )
+        except asyncio.CancelledError:
+            self._abandon(tags)
+            raise
+        if not_done:
+            # The socket may be dead without the reader knowing; drop it so the next call reconnects
+            error = RouterOSConnectionError("Timed out waiting for router reply")
+            self._fail(error)
+            raise error
+
+        results = []
+        for pending in pendings:
+            if pending.error is not None:
+                raise pending.error
+            results.append((pending.items, pending.done))
+        return results
+
+    async def close(self):
+        """Close the socket and fail any in-flight commands"""
+        self._fail(RouterOSConnectionError("Connection closed"))
+        if self._reader_task is not None and self._reader_task is not asyncio.current_task():
+            self._reader_task.cancel()
+
+    def _abandon(self, tags):
+        """Stop waiting for commands and cancel the unfinished ones on the router"""
+        for tag in tags:
+            # Commands still pending have not seen their !done yet
+            if self._pending.pop(tag, None) is not None and not self._closed:
+                try:
+                    self._writer.write(encode_sentence(['/cancel', f'=tag={tag}']))
+                except OSError:
+                    pass
+
+    async def _read_loop(self):
+        try:
+            while not self._closed:
+                reply_type, tag, attributes = parse_sentence(await read_sentence_async(self._reader))
+                if reply_type == '!fatal':
+                    raise RouterOSConnectionError(
+                        f"Router closed the session: {attributes.get('message', 'fatal error')}"
+                    )
+
+                pending = self._pending.get(tag)
+                if pending is None:
+                    continue
+
+                if reply_type == '!re':
+                    pending.items.append(attributes)
+                elif reply_type == '!trap':
+                    if pending.error is None:
+                        pending.error = RouterOSTrapError(
+                            attributes.get('message', 'Command failed'),
+                            attributes.get('category')
+                        )
+                elif reply_type == '!done':
+                    pending.done = attributes
+                    self._pending.pop(tag, None)
+                    if not pending.future.done():
+                        pending.future.set_result(None)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            if not self._closed:
+                logger.warning("RouterOS API connection to %s lost: %s", self.host, e)
+            if isinstance(e, asyncio.IncompleteReadError):
+                e = RouterOSConnectionError("Connection closed by router")
+            self._fail(e if isinstance(e, RouterOSAPIError) else RouterOSConnectionError(str(e)))
+
+    def _fail(self, error):
+        if self._closed and not self._pending:
+            return
+        self._closed = True
+        pending = list(self._pending.values())
+        self._pending.clear()
+
+        for item in pending:
+            item.error = error
+            if not item.future.done():
+                item.future.set_result(None)
+
+        if self._writer is not None:
+            self._writer.close()
+
+
+class AsyncRouterOSAPIClient(RouterOSCommandMixin):
+    """asyncio client for the native RouterOS API, same results as RouterOSAPIClient"""
+
+    def __init__(self, router):
+        self.router = router
+        self.username = router.username
+        self.password = router.get_password()
+        self.timeout = 10
+        self.connection = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _get_connection(self):
+        """Return the live connection, reconnecting if it dropped"""
+        async with self._connect_lock:
+            if self.connection is None or not self.connection.is_connected:
+                connection = AsyncRouterOSAPIConnection(
+                    self.router.host,
+                    self.router.routeros_api_port,
+                    self.username,
+                    self.password,
+                    use_ssl=self.router.use_https,
+                    timeout=self.timeout
+                )
+                await connection.connect()
+                self.connection = connection
+            return self.connection
+
+    async def test_connection(self):
+        """Test if we can connect to the router"""
+        try:
+            await (await self._get_connection()).talk(['/system/resource/print'])
+            return True
+        except Exception:
+            return False
+
+    async def execute_command(self, command, method='GET', params=None, data=None, timeout=None):
+        """Execute a command on the router; see RouterOSAPIClient.execute_command"""
+        try:
+            words, single = self._build_sentence(command, method.upper(), params, data)
+        except ValueError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "status_code": 400
+            }
+
+        try:
+            items, done = await (await self._get_connection()).talk(words, timeout=timeout)
+        except RouterOSLoginError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "status_code": 401
+            }
+        except RouterOSTrapError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "status_code": 400
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Command execution failed: {str(e)}",
+                "status_code": 500
+            }
+
+        return {"success": True, "data": self._shape_result(method.upper(), items, done, single)}
+
+    async def get_device_info(self):
+        """Get basic device information"""
+        try:
+            (resource_items, _), (identity_items, _) = await (await self._get_connection()).talk_many([
+                ['/system/resource/print'],
+                ['/system/identity/print'],
+            ])
+            return MikrotikAPIClient.device_info_from(
+                resource_items[0] if resource_items else {},
+                identity_items[0] if identity_items else {}
+            )
+        except Exception as e:
+            return {"error": f"Failed to get device info: {str(e)}"}
+
+    async def aclose(self):
+        """Close the API socket"""
+        if self.connection is not None:
+            await self.connection.close()
+
+
+class AsyncMikrotikAPIClient:
+    """asyncio client for the RouterOS REST API with the same results as MikrotikAPIClient"""
+
+    def __init__(self, router):
+        self.router = router
+        self.base_url = router.base_url
+        self.username = router.username
+        self.password = router.get_password()
+        self.timeout = 10
+
+        connections_per_router = getattr(settings, 'MIKROTIK_POOL_CONNECTIONS_PER_ROUTER', 4)
+        self.client = httpx.AsyncClient(
+            auth=(self.username, self.password),
+            verify=bool(router.use_https),
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=connections_per_router,
+                max_keepalive_connections=connections_per_router
+            )
+        )
+
+    async def test_connection(self):
+        """Test if we can connect to the router"""
+        try:
+            response = await self.client.get(f"{self.base_url}/system/resource")
+            return response.status_code == 200
+        except Exception:
+            return False
+
+    async def execute_command(self, command, method='GET', params=None, data=None, timeout=None):
+        """Execute a command on the router; see MikrotikAPIClient.execute_command"""
+        timeout = timeout or self.timeout
+        method = method.upper()
+        if method not in ('GET', 'POST', 'PUT', 'DELETE'):
+            return {
+                "success": False,
+                "error": f"Unsupported HTTP method: {method}",
+                "status_code": 400
+            }
+
+        try:
+            response = await self.client.request(
+                method,
+                f"{self.base_url}/{command}",
+                params=params if method == 'GET' else None,
+                json=data if method in ('POST', 'PUT') else None,
+                timeout=timeout
+            )
+            return MikrotikAPIClient.parse_response(response)
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Command execution failed: {str(e)}",
+                "status_code": 500
+            }
+
+    async def get_device_info(self):
+        """Get basic device information"""
+        try:
+            resource_response, identity_response = await asyncio.gather(
+                self.client.get(f"{self.base_url}/system/resource"),
+                self.client.get(f"{self.base_url}/system/identity"),
+            )
+
+            if resource_response.status_code != 200:
+                return {"error": "Failed to get system resource info"}
+
+            if identity_response.status_code != 200:
+                return {"error": "Failed to get system identity"}
+
+            return MikrotikAPIClient.device_info_from(resource_response.json(), identity_response.json())
+        except Exception as e:
+            return {"error": f"Failed to get device info: {str(e)}"}
+
+    async def aclose(self):
+        """Close the HTTP client and its connections"""
+        await self.client.aclose()
+
+
+def create_async_client(router):
+    """Build the async client matching the router's configured transport"""
+    if router.api_transport == 'api':
+        return AsyncRouterOSAPIClient(router)
+    return AsyncMikrotikAPIClient(router)
+
+
+class _AsyncPooledClient:
+    """Pool entry wrapping an async client with its bookkeeping"""
+
+    def __init__(self, client, version, loop):
+        self.client = client
+        self.version = version
+        self.loop = loop
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.retired = False
+
+
+class AsyncMikrotikClientPool:
+    """Pool of async router clients, shared by every request on an event loop
+
+    Async clients are bound to the event loop that created them, so entries
+    are kept per loop (one loop per ASGI worker process in practice). Entry
+    replacement, LRU and idle eviction follow MikrotikClientPool. Clients are
+    closed by a task scheduled on their own loop.
+    """
+
+    def __init__(self, max_size=64, idle_timeout=300):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._loops = weakref.WeakKeyDictionary()
+        self._closing = set()
+        self._lock = threading.Lock()
+
+    def acquire(self, router):
+        """Return a pool entry for the router on the running loop, creating it if needed"""
+        loop = asyncio.get_running_loop()
+        version = router.updated_at
+        stale = []
+        with self._lock:
+            entries = self._loops.setdefault(loop, OrderedDict())
+            entry = entries.get(router.pk)
+            if entry is not None and entry.version != version:
+                stale.append(entries.pop(router.pk))
+                entry = None
+
+            if entry is None:
+                entry = _AsyncPooledClient(create_async_client(router), version, loop)
+                entries[router.pk] = entry
+
+            entries.move_to_end(router.pk)
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+            stale.extend(self._evict_locked(entries))
+            stale = [e for e in stale if self._retire_locked(e)]
+
+        for old in stale:
+            self._close(old)
+        return entry
+
+    def release(self, entry):
+        """Return a client to the pool"""
+        with self._lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            close_now = entry.retired and entry.in_use == 0
+
+        if close_now:
+            self._close(entry)
+
+    def client(self, router):
+        """Async context manager yielding a pooled client for the router"""
+        return _AsyncPoolLease(self, router)
+
+    def invalidate(self, router_id):
+        """Drop the router's pooled clients on every loop (e.g. after delete)"""
+        with self._lock:
+            removed = [
+                entries.pop(router_id) for entries in self._loops.values()
+                if router_id in entries
+            ]
+            removed = [e for e in removed if self._retire_locked(e)]
+
+        for entry in removed:
+            self._close(entry)
+
+    def stats(self):
+        """Return a snapshot of the pool state"""
+        with self._lock:
+            entries = [e for loop_entries in self._loops.values() for e in loop_entries.values()]
+            return {
+                'loops': len(self._loops),
+                'size': len(entries),
+                'max_size': self.max_size,
+                'in_use': sum(1 for e in entries if e.in_use),
+            }
+
+    def _evict_locked(self, entries):
+        """Remove idle and over-capacity entries; caller holds the lock"""
+        evicted = []
+        now = time.monotonic()
+        for router_id, entry in list(entries.items()):
+            if not entry.in_use and now - entry.last_used > self.idle_timeout:
+                evicted.append(entries.pop(router_id))
+
+        for router_id, entry in list(entries.items()):
+            if len(entries) <= self.max_size:
+                break
+            if entry.in_use:
+                continue
+            evicted.append(entries.pop(router_id))
+        return evicted
+
+    @staticmethod
+    def _retire_locked(entry):
+        entry.retired = True
+        return entry.in_use == 0
+
+    def _close(self, entry):
+        """Close an entry's client on the loop it belongs to"""
+        if entry.loop.is_closed():
+            return
+
+        def schedule():
+            task = entry.loop.create_task(entry.client.aclose())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is entry.loop:
+            schedule()
+        else:
+            entry.loop.call_soon_threadsafe(schedule)
+
+
+class _AsyncPoolLease:
+    """Async context manager returned by AsyncMikrotikClientPool.client()"""
+
+    def __init__(self, pool, router):
+        self.pool = pool
+        self.router = router
+        self.entry = None
+
+    async def __aenter__(self):
+        self.entry = self.pool.acquire(self.router)
+        return self.entry.client
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.pool.release(self.entry)
+        return False
+
+
+async_client_pool = AsyncMikrotikClientPool(
+    max_size=getattr(settings, 'MIKROTIK_POOL_MAX_SIZE', 64),
+    idle_timeout=getattr(settings, 'MIKROTIK_POOL_IDLE_TIMEOUT', 300),
+)
+
+
+class AsyncMikrotikAPIManager:
+    """Async counterpart of MikrotikAPIManager for ASGI views
+
+    Shares the response cache and circuit breakers with the sync manager. If
+    the awaiting request is cancelled, the in-flight router call is cancelled
+    with it and nothing is recorded against the router.
+    """
+
+    @staticmethod
+    async def test_connection(router):
+        """Test connection to a specific router and record the outcome"""
+        async with async_client_pool.client(router) as client:
+            is_online = await client.test_connection()
+        await circuit_breakers.arecord(router, is_online)
+        return is_online
+
+    @staticmethod
+    async def execute_command(router, command, method='GET', params=None, data=None, timeout=None,
+                              use_cache=True):
+        """Execute a command on a specific router; see MikrotikAPIManager.execute_command"""
+        is_read = method.upper() == 'GET'
+        ttl = response_cache.ttl_for(command) if is_read else 0
+        key = response_cache.make_key(router, command, params) if ttl > 0 else None
+        if key is not None:
+            if use_cache:
+                cached = response_cache.get(key)
+                if cached is not None:
+                    return dict(cached, cached=True)
+            else:
+                response_cache.record_bypass()
+
+        rejected = MikrotikAPIManager.circuit_open_result(router)
+        if rejected:
+            return rejected
+
+        try:
+            async with async_client_pool.client(router) as client:
+                result = await client.execute_command(command, method, params, data, timeout=timeout)
+        except asyncio.CancelledError:
+            circuit_breakers.get(router.pk).abandon()
+            if not is_read:
+                # The write may or may not have reached the router
+                response_cache.invalidate_path(router.pk, command, method)
+            raise
+        await circuit_breakers.arecord(router, not is_transport_failure(result))
+
+        if not is_read:
+            response_cache.invalidate_path(router.pk, command, method)
+        elif key is not None and result.get('success'):
+            response_cache.set(key, result, ttl)
+        return result
+
+    @staticmethod
+    async def get_device_info(router, use_cache=True):
+        """Get device information for a specific router; see MikrotikAPIManager.get_device_info"""
+        ttl = response_cache.ttl_for('system/resource')
+        key = response_cache.device_info_key(router)
+        if ttl > 0:
+            if use_cache:
+                cached = response_cache.get(key)
+                if cached is not None:
+                    return cached
+            else:
+                response_cache.record_bypass()
+
+        rejected = MikrotikAPIManager.circuit_open_result(router)
+        if rejected:
+            return {"error": rejected["error"], "circuit_state": rejected["circuit_state"]}
+
+        try:
+            async with async_client_pool.client(router) as client:
+                device_info = await client.get_device_info()
+        except asyncio.CancelledError:
+            circuit_breakers.get(router.pk).abandon()
+            raise
+        unreachable = str(device_info.get('error', '')).startswith('Failed to get device info')
+        await circuit_breakers.arecord(router, not unreachable)
+        if 'error' not in device_info:
+            response_cache.set(key, device_info, ttl)
+        return device_info
+
+    @staticmethod
+    async def get_fleet_device_info(routers, deadline=None):
+        """Collect device info for many routers concurrently within a total deadline
+
+        Same result shape as MikrotikAPIManager.get_fleet_device_info, but all
+        routers are queried from the event loop instead of a thread pool.
+        """
+        routers = list(routers)
+        if not routers:
+            return [], True
+
+        deadline = deadline or getattr(settings, 'MIKROTIK_DEVICE_INFO_DEADLINE', 8)
+        tasks = [
+            asyncio.ensure_future(AsyncMikrotikAPIManager.get_device_info(router))
+            for router in routers
+        ]
+        try:
+            await asyncio.wait(tasks, timeout=deadline)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        results = []
+        complete = True
+        for router, task in zip(routers, tasks):
+            line = {
+                "router_id": router.pk,
+                "router_name": router.name,
+                "is_online": router.is_online,
+            }
+            if task.cancelled() or not task.done():
+                complete = False
+                line["timed_out"] = True
+                line["error"] = f"No response within the {deadline} second deadline"
+            else:
+                try:
+                    device_info = task.result()
+                except Exception as e:
+                    device_info = {"error": f"Failed to get device info: {str(e)}"}
+                if "error" in device_info:
+                    line["error"] = device_info["error"]
+                else:
+                    line["device_info"] = device_info
+            results.append(line)
+        return results, complete
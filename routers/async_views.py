@@ -0,0 +1,230 @@
+"""Async versions of the router I/O endpoints
+
+Served under /routers/async/. Under an ASGI server (uvicorn) a single
+worker can hold many in-flight router calls at once, because awaiting a
+router does not tie up a thread. If the client disconnects, the request is
+cancelled and so is the router call (see mikrotik_cloudpilot.asgi).
+
+These are plain Django async views: DRF's function views are sync-only, so
+JWT authentication is done here with the same JWTAuthentication class.
+"""
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .async_mikrotik_api import AsyncMikrotikAPIManager
+from .models import Router
+
+
+def _authenticate(request):
+    """Return the JWT-authenticated user, or None"""
+    try:
+        result = JWTAuthentication().authenticate(Request(request))
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def async_jwt_view(methods):
+    """Require a valid JWT and one of ``methods`` for an async view"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return JsonResponse({
+                    'error': f'Method "{request.method}" not allowed.'
+                }, status=405)
+
+            user = await sync_to_async(_authenticate)(request)
+            if user is None or not user.is_active:
+                return JsonResponse({
+                    'detail': 'Authentication credentials were not provided or are invalid.'
+                }, status=401)
+
+            request.user = user
+            return await view(request, *args, **kwargs)
+
+        # Token-authenticated like the DRF views; django's csrf_exempt is not
+        # async-aware before 5.0, so set the flag directly
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+async def _get_router(request, pk):
+    return await Router.objects.filter(pk=pk, user=request.user).afirst()
+
+
+def _json_body(request):
+    if not request.body:
+        return {}
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+@async_jwt_view(['POST'])
+async def test_connection(request, pk):
+    """Test connection to a specific router."""
+    router = await _get_router(request, pk)
+    if router is None:
+        return JsonResponse({
+            'error': 'Router not found or access denied'
+        }, status=404)
+
+    try:
+        is_online = await AsyncMikrotikAPIManager.test_connection(router)
+
+        router.is_online = is_online
+        router.last_checked = timezone.now()
+        await router.asave(update_fields=['is_online', 'last_checked'])
+
+        return JsonResponse({
+            'router_id': pk,
+            'is_online': is_online,
+            'message': 'Connection test completed'
+        })
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Connection test failed: {str(e)}'
+        }, status=500)
+
+
+@async_jwt_view(['POST'])
+async def execute_command(request, pk):
+    """Execute a custom command on a specific router."""
+    router = await _get_router(request, pk)
+    if router is None:
+        return JsonResponse({
+            'error': 'Router not found or access denied'
+        }, status=404)
+
+    body = _json_body(request)
+    if body is None:
+        return JsonResponse({
+            'error': 'Request body must be a JSON object'
+        }, status=400)
+
+    command = body.get('command')
+    if not command:
+        return JsonResponse({
+            'error': 'Command is required'
+        }, status=400)
+
+    method = str(body.get('method', 'GET')).upper()
+    params = body.get('params', None)
+    data = body.get('data', None)
+    use_cache = body.get('use_cache', True) not in [False, 'false', 'False', 0, '0']
+
+    if method not in ['GET', 'POST', 'PUT', 'DELETE']:
+        return JsonResponse({
+            'error': 'Invalid HTTP method. Must be GET, POST, PUT, or DELETE'
+        }, status=400)
+
+    try:
+        result = await AsyncMikrotikAPIManager.execute_command(
+            router, command, method, params, data, use_cache=use_cache
+        )
+
+        if result.get('success'):
+            return JsonResponse({
+                'router_id': pk,
+                'command': command,
+                'method': method,
+                'result': result['data'],
+                'cached': result.get('cached', False),
+                'message': 'Command executed successfully'
+            }, safe=False)
+        elif result.get('circuit_state'):
+            response = JsonResponse({
+                'router_id': pk,
+                'command': command,
+                'method': method,
+                'error': result['error'],
+                'circuit_state': result['circuit_state'],
+                'retry_after': result['retry_after'],
+                'status_code': result['status_code']
+            }, status=503)
+            response['Retry-After'] = str(int(result['retry_after']) + 1)
+            return response
+        else:
+            return JsonResponse({
+                'router_id': pk,
+                'command': command,
+                'method': method,
+                'error': result['error'],
+                'status_code': result.get('status_code', 400)
+            }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Command execution failed: {str(e)}'
+        }, status=500)
+
+
+@async_jwt_view(['GET'])
+async def get_device_info(request, pk):
+    """Get device information from a specific router."""
+    router = await _get_router(request, pk)
+    if router is None:
+        return JsonResponse({
+            'error': 'Router not found or access denied'
+        }, status=404)
+
+    try:
+        use_cache = request.GET.get('refresh', '').lower() not in ['1', 'true', 'yes']
+        device_info = await AsyncMikrotikAPIManager.get_device_info(router, use_cache=use_cache)
+
+        return JsonResponse({
+            'router_id': pk,
+            'device_info': device_info,
+            'message': 'Device information retrieved successfully'
+        })
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Failed to get device info: {str(e)}'
+        }, status=500)
+
+
+@async_jwt_view(['GET'])
+async def get_fleet_device_info(request):
+    """Get device information from all of the user's routers concurrently."""
+    try:
+        deadline = request.GET.get('deadline')
+        deadline = float(deadline) if deadline else None
+    except ValueError:
+        return JsonResponse({
+            'error': 'deadline must be a number of seconds'
+        }, status=400)
+
+    if deadline is not None and deadline <= 0:
+        return JsonResponse({
+            'error': 'deadline must be positive'
+        }, status=400)
+
+    routers = [router async for router in Router.objects.filter(user=request.user)]
+    started = timezone.now()
+
+    try:
+        results, complete = await AsyncMikrotikAPIManager.get_fleet_device_info(routers, deadline=deadline)
+
+        return JsonResponse({
+            'routers': results,
+            'complete': complete,
+            'elapsed_ms': round((timezone.now() - started).total_seconds() * 1000, 1),
+            'message': (
+                f'Device information retrieved for {len(results)} routers' if complete
+                else 'Some routers did not respond before the deadline'
+            )
+        })
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Failed to get device info: {str(e)}'
+        }, status=500)
@@ -0,0 +1,136 @@
+"""How packages and customers are represented in a router's hotspot
+
+Every package gets its own ``/ip/hotspot/user/profile`` carrying the
+package's rate limit, and customers are ``/ip/hotspot/user`` entries on that
+profile. Keep the naming here so provisioning and profile syncing agree.
+"""
+import re
+
+
+PROFILE_PREFIX = 'cloudpilot-'
+# A bare trailing number counts as seconds
+DURATION_UNITS = {'w': 604800, 'd': 86400, 'h': 3600, 'm': 60, 's': 1, 'ms': 0, '': 1}
+DURATION_PART = re.compile(r'(\d+)(ms|[wdhms]|$)')
+# Comment on hotspot users uploaded for a voucher batch (payments.vouchers)
+VOUCHER_COMMENT_PREFIX = 'voucher '
+
+
+def as_rows(result):
+    """RouterOS print results as a list (a single match may come back as one object)"""
+    if not result:
+        return []
+    if isinstance(result, dict):
+        return [result]
+    return result
+
+
+def profile_name(package):
+    """Name of the hotspot user profile for a package"""
+    return f"{PROFILE_PREFIX}{package.pk}"
+
+
+def rate_limit(package):
+    """RouterOS rate-limit (rx/tx from the router's side, i.e. upload/download)"""
+    return f"{package.upload_speed_mbps}M/{package.download_speed_mbps}M"
+
+
+def limit_uptime(package):
+    """RouterOS limit-uptime for one purchase of the package"""
+    return f"{package.duration_hours}h"
+
+
+def item_target(item, name):
+    """Arguments selecting ``item`` for a set/remove command: its id, else its name"""
+    if item.get('.id'):
+        return {'.id': item['.id']}
+    return {'numbers': name}
+
+
+def render_profile(package):
+    """Desired attributes of the package's hotspot user profile"""
+    return {
+        'name': profile_name(package),
+        'rate-limit': rate_limit(package),
+    }
+
+
+def render_user(name, password, package, comment=''):
+    """Desired attributes of a customer's hotspot user"""
+    return {
+        'name': name,
+        'password': password,
+        'profile': profile_name(package),
+        'limit-uptime': limit_uptime(package),
+        'comment': comment,
+    }
+
+
+def is_voucher_user(user):
+    """Whether a hotspot user read from the router was uploaded for a voucher"""
+    return (user.get('comment') or '').startswith(VOUCHER_COMMENT_PREFIX)
+
+
+def is_managed_user(user):
+    """Whether a hotspot user read from the router was created for a payment"""
+    if is_voucher_user(user):
+        return False
+    return (user.get('comment') or '').startswith('payment ') or \
+        (user.get('profile') or '').startswith(PROFILE_PREFIX)
+
+
+def duration_seconds(value):
+    """Seconds in a RouterOS duration ("1d", "1w2d3h", "01:30:00", "1d02:00:00"); None if unset
+
+    Sub-second parts ("500ms", "00:00:01.5") are dropped.
+    """
+    if not value:
+        return None
+    value = str(value)
+    seconds = 0
+    if ':' in value:
+        # Below a day, older RouterOS writes a clock after the units
+        cut = max(value.rfind(unit) for unit in 'wdhms') + 1
+        value, clock = value[:cut], value[cut:]
+        clock_seconds = 0
+        for part in clock.split(':'):
+            clock_seconds = clock_seconds * 60 + int(float(part))
+        seconds += clock_seconds
+    for number, unit in DURATION_PART.findall(value):
+        seconds += int(number) * DURATION_UNITS[unit]
+    return seconds
+
+
+def user_changes(desired, current):
+    """Attributes of ``desired`` that differ from the user as read from the router"""
+    changes = {}
+    for key in ('password', 'profile'):
+        if current.get(key) != desired[key]:
+            changes[key] = desired[key]
+    if duration_seconds(current.get('limit-uptime')) != duration_seconds(desired['limit-uptime']):
+        changes['limit-uptime'] = desired['limit-uptime']
+    return changes
+
+
+def profile_steps(packages, current):
+    """execute_batch steps that create or correct the profiles of ``packages``
+
+    ``current`` maps profile name to the profile as read from the router.
+    Profiles that already match are left alone.
+    """
+    steps = []
+    for package in packages:
+        desired = render_profile(package)
+        existing = current.get(desired['name'])
+        if existing is None:
+            steps.append({
+                'command': 'ip/hotspot/user/profile/add',
+                'method': 'POST',
+                'data': desired,
+            })
+        elif any(existing.get(key) != value for key, value in desired.items()):
+            steps.append({
+                'command': 'ip/hotspot/user/profile/set',
+                'method': 'POST',
+                'data': dict(desired, **item_target(existing, desired['name'])),
+            })
+    return steps
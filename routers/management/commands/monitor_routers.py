@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from routers.monitor import RouterHealthMonitor
+
+
+class Command(BaseCommand):
+    help = 'Continuously probe all routers and keep is_online / last_checked up to date'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Probe every router once and exit',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Maximum number of routers probed at the same time',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            help='Base probe interval in seconds',
+        )
+        parser.add_argument(
+            '--min-interval',
+            type=int,
+            help='Probe interval for flapping routers in seconds',
+        )
+        parser.add_argument(
+            '--max-interval',
+            type=int,
+            help='Longest probe interval for stable routers in seconds',
+        )
+
+    def handle(self, *args, **options):
+        monitor = RouterHealthMonitor(
+            workers=options['workers'],
+            base_interval=options['interval'],
+            min_interval=options['min_interval'],
+            max_interval=options['max_interval'],
+        )
+
+        if options['once']:
+            summary = monitor.run_once(force=True)
+            self.stdout.write(self.style.SUCCESS(monitor.format_summary(summary)))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Monitoring routers with {monitor.workers} workers '
+            f'(interval {monitor.min_interval}-{monitor.max_interval}s)'
+        ))
+        try:
+            monitor.run_forever(stdout=self.stdout)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Router monitor stopped'))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from routers.models import Router
+from routers.profile_sync import sync_fleet_profiles
+
+
+class Command(BaseCommand):
+    help = 'Push package rate limits to the hotspot user profiles of every router'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--router',
+            type=int,
+            action='append',
+            dest='routers',
+            help='Router id to sync (repeatable; default all routers)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the changes without applying them',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Maximum number of routers synced at the same time',
+        )
+
+    def handle(self, *args, **options):
+        routers = Router.objects.all()
+        if options['routers']:
+            routers = routers.filter(pk__in=options['routers'])
+
+        changed = failed = 0
+        for report in sync_fleet_profiles(routers, dry_run=options['dry_run'], max_workers=options['workers']):
+            router = report['router']
+            if report['error']:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'{router.name} ({router.pk}): {report["error"]}'))
+                continue
+
+            changed += bool(report['steps'])
+            self.stdout.write(f'{router.name} ({router.pk}): {len(report["steps"])} profile changes')
+            for step in report['steps']:
+                action = step['command'].rsplit('/', 1)[-1]
+                self.stdout.write(f'  {action} {step["data"].get("name") or step["data"].get(".id")}')
+            for error in report['errors']:
+                self.stdout.write(self.style.WARNING(f'  {error}'))
+            failed += bool(report['errors'])
+
+        summary = f'{changed} routers {"to change" if options["dry_run"] else "changed"}, {failed} with errors'
+        self.stdout.write(self.style.SUCCESS(summary) if not failed else self.style.WARNING(summary))
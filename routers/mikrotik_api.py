@@ -4,15 +4,22 @@ import logging
 from typing import Dict, List, Optional, Any, Tuple
 from django.conf import settings
 from .models import Router
+from .routeros_api import RouterOSAPIClient
 from django.utils import timezone
 from datetime import datetime
 import xml.etree.ElementTree as ET
 from .models import Router
 from django.contrib.auth.models import User
+from django.db import connections
 import requests
 import json
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
 import ssl
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
 
@@ -22,6 +29,17 @@ class MikrotikAPIError(Exception):
     """Custom exception for Mikrotik API errors"""
     pass
 
+# Shared threads for running a client's independent sub-requests concurrently.
+# A fleet device-info run has up to MIKROTIK_FLEET_MAX_WORKERS clients issuing
+# one each, so there are at least that many, or they would queue behind each other.
+_subrequest_executor = ThreadPoolExecutor(
+    max_workers=max(
+        getattr(settings, 'MIKROTIK_SUBREQUEST_WORKERS', 16),
+        getattr(settings, 'MIKROTIK_FLEET_MAX_WORKERS', 32)
+    ),
+    thread_name_prefix='mikrotik-subrequest'
+)
+
 class MikrotikAPIClient:
     """Client for interacting with Mikrotik RouterOS API"""
     
@@ -30,8 +48,17 @@ class MikrotikAPIClient:
         self.base_url = router.base_url
         self.username = router.username
         self.password = router.get_password()
+        self.timeout = 10
         self.session = requests.Session()
         
+        # Keep-alive connection pool so repeated commands reuse the same socket
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=getattr(settings, 'MIKROTIK_POOL_CONNECTIONS_PER_ROUTER', 4)
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
         # Disable SSL verification if not using HTTPS
         if not router.use_https:
             self.session.verify = False
@@ -47,7 +74,7 @@ class MikrotikAPIClient:
         except Exception:
             return False
     
-    def execute_command(self, command, method='GET', params=None, data=None):
+    def execute_command(self, command, method='GET', params=None, data=None, timeout=None):
         """Execute a command on the router
         
         Args:
@@ -55,19 +82,21 @@ class MikrotikAPIClient:
             method (str): HTTP method ('GET', 'POST', 'PUT', 'DELETE')
             params (dict): Query parameters for GET requests
             data (dict): JSON data for POST/PUT requests
+            timeout (float): Request timeout in seconds (defaults to 10)
         """
+        timeout = timeout or self.timeout
         try:
             url = f"{self.base_url}/{command}"
             
             # Handle different HTTP methods
             if method.upper() == 'GET':
-                response = self.session.get(url, params=params, timeout=10)
+                response = self.session.get(url, params=params, timeout=timeout)
             elif method.upper() == 'POST':
-                response = self.session.post(url, json=data, timeout=10)
+                response = self.session.post(url, json=data, timeout=timeout)
             elif method.upper() == 'PUT':
-                response = self.session.put(url, json=data, timeout=10)
+                response = self.session.put(url, json=data, timeout=timeout)
             elif method.upper() == 'DELETE':
-                response = self.session.delete(url, timeout=10)
+                response = self.session.delete(url, timeout=timeout)
             else:
                 return {
                     "success": False,
@@ -75,33 +104,7 @@ class MikrotikAPIClient:
                     "status_code": 400
                 }
             
-            if response.status_code == 200:
-                # Handle empty responses (some DELETE operations)
-                if response.content:
-                    try:
-                        response_data = response.json()
-                    except:
-                        response_data = response.text
-                else:
-                    response_data = {"message": "Operation completed successfully"}
-                
-                return {"success": True, "data": response_data}
-            else:
-                # Parse error response from Mikrotik
-                try:
-                    error_data = response.json()
-                    error_message = error_data.get('message', 'Unknown error')
-                    error_detail = error_data.get('detail', '')
-                    if error_detail:
-                        error_message = f"{error_message}: {error_detail}"
-                except:
-                    error_message = response.text or f"HTTP {response.status_code}"
-                
-                return {
-                    "success": False, 
-                    "error": error_message,
-                    "status_code": response.status_code
-                }
+            return self.parse_response(response)
         except Exception as e:
             return {
                 "success": False,
@@ -109,76 +112,855 @@ class MikrotikAPIClient:
                 "status_code": 500
             }
     
+    @staticmethod
+    def parse_response(response):
+        """Turn a REST response (requests or httpx) into a command result"""
+        if response.status_code == 200:
+            # Handle empty responses (some DELETE operations)
+            if response.content:
+                try:
+                    response_data = response.json()
+                except:
+                    response_data = response.text
+            else:
+                response_data = {"message": "Operation completed successfully"}
+                
+            return {"success": True, "data": response_data}
+        else:
+            # Parse error response from Mikrotik
+            try:
+                error_data = response.json()
+                error_message = error_data.get('message', 'Unknown error')
+                error_detail = error_data.get('detail', '')
+                if error_detail:
+                    error_message = f"{error_message}: {error_detail}"
+            except:
+                error_message = response.text or f"HTTP {response.status_code}"
+                
+            return {
+                "success": False, 
+                "error": error_message,
+                "status_code": response.status_code
+            }
+    
     def get_device_info(self):
         """Get basic device information"""
         try:
-            # Get system resource info
-            resource_response = self.session.get(f"{self.base_url}/system/resource", timeout=10)
+            # Fetch system identity in the background while we fetch system resource
+            identity_future = _subrequest_executor.submit(
+                self.session.get, f"{self.base_url}/system/identity", timeout=self.timeout
+            )
+            try:
+                resource_response = self.session.get(f"{self.base_url}/system/resource", timeout=self.timeout)
+            finally:
+                identity_response = identity_future.result()
+            
             if resource_response.status_code != 200:
                 return {"error": "Failed to get system resource info"}
             
-            # Get system identity
-            identity_response = self.session.get(f"{self.base_url}/system/identity", timeout=10)
             if identity_response.status_code != 200:
                 return {"error": "Failed to get system identity"}
             
-            resource_data = resource_response.json()
-            identity_data = identity_response.json()
-            
-            return {
-                "identity": identity_data.get('name', 'Unknown'),
-                "cpu_load": resource_data.get('cpu-load', 'Unknown'),
-                "free_memory": resource_data.get('free-memory', 'Unknown'),
-                "total_memory": resource_data.get('total-memory', 'Unknown'),
-                "free_hdd_space": resource_data.get('free-hdd-space', 'Unknown'),
-                "total_hdd_space": resource_data.get('total-hdd-space', 'Unknown'),
-                "version": resource_data.get('version', 'Unknown'),
-                "uptime": resource_data.get('uptime', 'Unknown')
-            }
+            return self.device_info_from(resource_response.json(), identity_response.json())
         except Exception as e:
             return {"error": f"Failed to get device info: {str(e)}"}
     
+    @staticmethod
+    def device_info_from(resource_data, identity_data):
+        """Build the device info summary from system/resource and system/identity"""
+        return {
+            "identity": identity_data.get('name', 'Unknown'),
+            "cpu_load": resource_data.get('cpu-load', 'Unknown'),
+            "free_memory": resource_data.get('free-memory', 'Unknown'),
+            "total_memory": resource_data.get('total-memory', 'Unknown'),
+            "free_hdd_space": resource_data.get('free-hdd-space', 'Unknown'),
+            "total_hdd_space": resource_data.get('total-hdd-space', 'Unknown'),
+            "version": resource_data.get('version', 'Unknown'),
+            "uptime": resource_data.get('uptime', 'Unknown')
+        }
+    
     def close(self):
         """Close the session"""
         self.session.close()
 
+def create_client(router):
+    """Build the client matching the router's configured transport"""
+    if router.api_transport == 'api':
+        return RouterOSAPIClient(router)
+    return MikrotikAPIClient(router)
+
+
+class _PooledClient:
+    """Pool entry wrapping a client with its bookkeeping"""
+    
+    def __init__(self, client, version):
+        self.client = client
+        self.version = version
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.retired = False
+
+
+class MikrotikClientPool:
+    """Process-wide pool of router clients keyed by router id
+    
+    Clients keep their HTTP session (and its keep-alive connections) open
+    between calls. An entry is replaced when the router's ``updated_at``
+    changes, the least recently used entry is evicted when the pool is full,
+    and entries idle for longer than ``idle_timeout`` seconds are closed.
+    """
+    
+    def __init__(self, max_size=64, idle_timeout=300):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def acquire(self, router):
+        """Return a ready-to-use client for the router, creating it if needed"""
+        version = router.updated_at
+        stale = []
+        with self._lock:
+            entry = self._entries.get(router.pk)
+            if entry is not None and entry.version != version:
+                stale.append(self._entries.pop(router.pk))
+                entry = None
+            
+            if entry is None:
+                entry = _PooledClient(create_client(router), version)
+                self._entries[router.pk] = entry
+            
+            self._entries.move_to_end(router.pk)
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+            stale.extend(self._evict_locked())
+            stale = [e for e in stale if self._retire_locked(e)]
+        
+        for old in stale:
+            old.client.close()
+        return entry
+    
+    def release(self, entry):
+        """Return a client to the pool"""
+        with self._lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            close_now = entry.retired and entry.in_use == 0
+        
+        if close_now:
+            entry.client.close()
+    
+    def client(self, router):
+        """Context manager yielding a pooled client for the router"""
+        return _PoolLease(self, router)
+    
+    def invalidate(self, router_id):
+        """Drop the pooled client for a router (e.g. after delete)"""
+        with self._lock:
+            entry = self._entries.pop(router_id, None)
+            close_now = entry is not None and self._retire_locked(entry)
+        
+        if close_now:
+            entry.client.close()
+    
+    def clear(self):
+        """Close every pooled client"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            entries = [e for e in entries if self._retire_locked(e)]
+        
+        for entry in entries:
+            entry.client.close()
+    
+    def stats(self):
+        """Return a snapshot of the pool state"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'in_use': sum(1 for e in self._entries.values() if e.in_use),
+            }
+    
+    def _evict_locked(self):
+        """Remove idle and over-capacity entries; caller holds the lock"""
+        evicted = []
+        now = time.monotonic()
+        for router_id, entry in list(self._entries.items()):
+            if not entry.in_use and now - entry.last_used > self.idle_timeout:
+                evicted.append(self._entries.pop(router_id))
+        
+        # OrderedDict is kept in LRU order, oldest first
+        for router_id, entry in list(self._entries.items()):
+            if len(self._entries) <= self.max_size:
+                break
+            if entry.in_use:
+                continue
+            evicted.append(self._entries.pop(router_id))
+        return evicted
+    
+    @staticmethod
+    def _retire_locked(entry):
+        """Mark an entry as removed; returns True if it can be closed now"""
+        entry.retired = True
+        return entry.in_use == 0
+
+
+class _PoolLease:
+    """Context manager returned by MikrotikClientPool.client()"""
+    
+    def __init__(self, pool, router):
+        self.pool = pool
+        self.router = router
+        self.entry = None
+    
+    def __enter__(self):
+        self.entry = self.pool.acquire(self.router)
+        return self.entry.client
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.pool.release(self.entry)
+        return False
+
+
+client_pool = MikrotikClientPool(
+    max_size=getattr(settings, 'MIKROTIK_POOL_MAX_SIZE', 64),
+    idle_timeout=getattr(settings, 'MIKROTIK_POOL_IDLE_TIMEOUT', 300),
+)
+
+
+def _split_path(command):
+    return [segment for segment in command.strip('/').split('/') if segment]
+
+
+class MikrotikResponseCache:
+    """In-process TTL cache for successful read-only (GET) router responses
+    
+    Entries are keyed by (router id, router version, command path, params).
+    The TTL is taken from the longest matching path prefix in ``ttls``;
+    paths without a TTL are not cached. A write (POST/PUT/DELETE) drops the
+    router's cached reads whose path overlaps the written path.
+    """
+    
+    def __init__(self, ttls=None, default_ttl=0, max_entries=2048):
+        self.ttls = {tuple(_split_path(path)): ttl for path, ttl in (ttls or {}).items()}
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.invalidations = 0
+    
+    def ttl_for(self, command):
+        """Return the TTL in seconds for a command path (0 means not cached)"""
+        segments = tuple(_split_path(command))
+        for length in range(len(segments), 0, -1):
+            ttl = self.ttls.get(segments[:length])
+            if ttl is not None:
+                return ttl
+        return self.default_ttl
+    
+    def make_key(self, router, command, params=None):
+        params_key = json.dumps(params, sort_keys=True, default=str) if params else ''
+        return (router.pk, router.updated_at, tuple(_split_path(command)), params_key)
+    
+    def device_info_key(self, router):
+        """Key for a router's device info summary
+        
+        The summary combines system/resource and system/identity, so it is
+        filed under ``system`` and a write to any system/* menu drops it.
+        """
+        return self.make_key(router, 'system', {'view': 'device-info'})
+    
+    def get(self, key):
+        """Return the cached value for a key, or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def record_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+    
+    def invalidate_path(self, router_id, command, method):
+        """Drop cached reads for a router that a write to ``command`` may change"""
+        segments = _split_path(command)
+        # Strip the item id (DELETE ip/hotspot/user/*1) or the command verb
+        # (POST ip/hotspot/user/add) to get the menu being written to
+        if segments and (segments[-1].startswith('*') or method.upper() == 'POST'):
+            segments = segments[:-1]
+        base = tuple(segments)
+        
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] != router_id:
+                    continue
+                path = key[2]
+                shared = min(len(path), len(base))
+                if path[:shared] == base[:shared]:
+                    del self._entries[key]
+                    self.invalidations += 1
+    
+    def invalidate_router(self, router_id):
+        """Drop every cached response for a router"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == router_id]:
+                del self._entries[key]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Return hit/miss counters and the current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+response_cache = MikrotikResponseCache(
+    ttls=getattr(settings, 'MIKROTIK_CACHE_TTLS', {}),
+    default_ttl=getattr(settings, 'MIKROTIK_CACHE_DEFAULT_TTL', 0),
+    max_entries=getattr(settings, 'MIKROTIK_CACHE_MAX_ENTRIES', 2048),
+)
+
+
+class CircuitBreaker:
+    """Per-router circuit breaker
+    
+    closed:    requests flow; consecutive transport failures are counted and
+               the circuit opens once ``failure_threshold`` is reached.
+    open:      requests fail immediately until ``reset_timeout`` seconds pass.
+    half_open: up to ``half_open_max_calls`` trial requests are let through;
+               a success closes the circuit, a failure re-opens it.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold=3, reset_timeout=30, half_open_max_calls=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_calls = 0
+        self._lock = threading.Lock()
+    
+    def allow_request(self):
+        """Return True if a request may be sent to the router now"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self.half_open_calls = 0
+            
+            if self.state == self.HALF_OPEN:
+                if self.half_open_calls >= self.half_open_max_calls:
+                    return False
+                self.half_open_calls += 1
+            return True
+    
+    def record_success(self):
+        """Record a reachable router; returns the previous state"""
+        with self._lock:
+            previous = self.state
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self.half_open_calls = 0
+            return previous
+    
+    def record_failure(self):
+        """Record a transport failure; returns the previous state"""
+        with self._lock:
+            previous = self.state
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.half_open_calls = 0
+            return previous
+    
+    def abandon(self):
+        """Give back a half-open trial slot for a call that was cancelled"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self.half_open_calls > 0:
+                self.half_open_calls -= 1
+    
+    def retry_after(self):
+        """Seconds until an open circuit lets a trial request through"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0
+            return max(0, round(self.reset_timeout - (time.monotonic() - self.opened_at), 1))
+
+
+class CircuitBreakerRegistry:
+    """Process-wide circuit breakers keyed by router id
+    
+    State changes are written to Router.is_online / last_checked with a
+    queryset update, so a router's online flag follows its circuit.
+    """
+    
+    def __init__(self, failure_threshold=3, reset_timeout=30, half_open_max_calls=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._breakers = {}
+        self._lock = threading.Lock()
+    
+    def get(self, router_id):
+        with self._lock:
+            breaker = self._breakers.get(router_id)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout, self.half_open_max_calls
+                )
+                self._breakers[router_id] = breaker
+            return breaker
+    
+    def record(self, router, success):
+        """Record the outcome of a call and sync Router.is_online on transitions"""
+        is_online = self._transition(router, success)
+        if is_online is not None:
+            self._set_online(router, is_online)
+    
+    async def arecord(self, router, success):
+        """Async variant of record() for use from async views"""
+        is_online = self._transition(router, success)
+        if is_online is not None:
+            now = timezone.now()
+            router.is_online = is_online
+            router.last_checked = now
+            try:
+                await Router.objects.filter(pk=router.pk).aupdate(is_online=is_online, last_checked=now)
+            except Exception as e:
+                logger.warning("Failed to update online status for router %s: %s", router.pk, e)
+    
+    def _transition(self, router, success):
+        """Update the breaker; returns the new online flag to store, or None"""
+        breaker = self.get(router.pk)
+        if success:
+            previous = breaker.record_success()
+            if previous != CircuitBreaker.CLOSED or not router.is_online:
+                return True
+        else:
+            previous = breaker.record_failure()
+            if breaker.state == CircuitBreaker.OPEN and previous != CircuitBreaker.OPEN:
+                logger.warning("Circuit opened for router %s (%s)", router.pk, router.host)
+                return False
+        return None
+    
+    def remove(self, router_id):
+        with self._lock:
+            self._breakers.pop(router_id, None)
+    
+    def stats(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        states = [b.state for b in breakers]
+        return {
+            'tracked': len(states),
+            'open': states.count(CircuitBreaker.OPEN),
+            'half_open': states.count(CircuitBreaker.HALF_OPEN),
+        }
+    
+    @staticmethod
+    def _set_online(router, is_online):
+        now = timezone.now()
+        router.is_online = is_online
+        router.last_checked = now
+        try:
+            Router.objects.filter(pk=router.pk).update(is_online=is_online, last_checked=now)
+        except Exception as e:
+            logger.warning("Failed to update online status for router %s: %s", router.pk, e)
+
+
+circuit_breakers = CircuitBreakerRegistry(
+    failure_threshold=getattr(settings, 'MIKROTIK_CIRCUIT_FAILURE_THRESHOLD', 3),
+    reset_timeout=getattr(settings, 'MIKROTIK_CIRCUIT_RESET_TIMEOUT', 30),
+    half_open_max_calls=getattr(settings, 'MIKROTIK_CIRCUIT_HALF_OPEN_MAX_CALLS', 1),
+)
+
+
+def is_transport_failure(result):
+    """True if a command result means the router could not be reached"""
+    return not result.get('success') and result.get('status_code', 500) >= 500
+
+
 class MikrotikAPIManager:
     """Manager class for Mikrotik API operations"""
     
     @staticmethod
     def test_connection(router):
-        """Test connection to a specific router"""
-        client = MikrotikAPIClient(router)
-        try:
-            return client.test_connection()
-        finally:
-            client.close()
+        """Test connection to a specific router
+        
+        Always probes the router, even with an open circuit, and feeds the
+        outcome back into the circuit breaker.
+        """
+        with client_pool.client(router) as client:
+            is_online = client.test_connection()
+        circuit_breakers.record(router, is_online)
+        return is_online
+    
+    @staticmethod
+    def circuit_open_result(router):
+        """Return a fail-fast result if the router's circuit is open, else None"""
+        breaker = circuit_breakers.get(router.pk)
+        if breaker.allow_request():
+            return None
+        return {
+            "success": False,
+            "error": (
+                f"Router {router.name} is unreachable (circuit open after repeated failures); "
+                f"retry in {breaker.retry_after()} seconds"
+            ),
+            "status_code": 503,
+            "circuit_state": breaker.state,
+            "retry_after": breaker.retry_after(),
+        }
     
     @staticmethod
-    def execute_command(router, command, method='GET', params=None, data=None):
+    def execute_command(router, command, method='GET', params=None, data=None, timeout=None,
+                        use_cache=True):
         """Execute a command on a specific router
         
+        Successful GETs on paths with a configured TTL are served from the
+        response cache; writes invalidate overlapping cached reads. Routers
+        with an open circuit fail fast with status_code 503.
+        
+        Args:
+            router: Router instance
+            command (str): Mikrotik command path
+            method (str): HTTP method ('GET', 'POST', 'PUT', 'DELETE')
+            params (dict): Query parameters for GET requests
+            data (dict): JSON data for POST/PUT requests
+            timeout (float): Per-request timeout in seconds
+            use_cache (bool): Set to False to bypass the response cache
+        """
+        is_read = method.upper() == 'GET'
+        ttl = response_cache.ttl_for(command) if is_read else 0
+        key = response_cache.make_key(router, command, params) if ttl > 0 else None
+        if key is not None:
+            if use_cache:
+                cached = response_cache.get(key)
+                if cached is not None:
+                    return dict(cached, cached=True)
+            else:
+                response_cache.record_bypass()
+        
+        rejected = MikrotikAPIManager.circuit_open_result(router)
+        if rejected:
+            return rejected
+        
+        with client_pool.client(router) as client:
+            result = client.execute_command(command, method, params, data, timeout=timeout)
+        circuit_breakers.record(router, not is_transport_failure(result))
+        
+        if not is_read:
+            response_cache.invalidate_path(router.pk, command, method)
+        elif key is not None and result.get('success'):
+            response_cache.set(key, result, ttl)
+        return result
+    
+    @staticmethod
+    def execute_batch(router, steps, stop_on_error=False, parallel_reads=False):
+        """Execute an ordered list of commands on one router over one client
+        
         Args:
             router: Router instance
+            steps (list): Dicts with ``command`` and optional ``method``,
+                ``params`` and ``data`` keys
+            stop_on_error (bool): Skip the remaining steps after a failure
+            parallel_reads (bool): Run consecutive GET steps concurrently;
+                writes still run one at a time, in order
+        
+        Returns a dict with per-step results (in request order) and timings.
+        """
+        results = [None] * len(steps)
+        started = time.monotonic()
+        
+        # Consecutive reads form one group; every write is a group of its own
+        groups = []
+        for index, step in enumerate(steps):
+            is_read = step.get('method', 'GET').upper() == 'GET'
+            if parallel_reads and is_read and groups and groups[-1][0]:
+                groups[-1][1].append(index)
+            else:
+                groups.append((is_read, [index]))
+        
+        def run(client, index):
+            step = steps[index]
+            method = step.get('method', 'GET').upper()
+            step_started = time.monotonic()
+            result = client.execute_command(
+                step['command'], method, step.get('params'), step.get('data')
+            )
+            if method != 'GET':
+                response_cache.invalidate_path(router.pk, step['command'], method)
+            line = {
+                "index": index,
+                "command": step['command'],
+                "method": method,
+                "success": result.get("success", False),
+                "elapsed_ms": round((time.monotonic() - step_started) * 1000, 1),
+            }
+            if line["success"]:
+                line["result"] = result.get("data")
+            else:
+                line["error"] = result.get("error")
+                line["status_code"] = result.get("status_code", 500)
+            return line
+        
+        rejected = MikrotikAPIManager.circuit_open_result(router)
+        if rejected:
+            return {
+                "success": False,
+                "steps": [],
+                "error": rejected["error"],
+                "status_code": rejected["status_code"],
+                "elapsed_ms": 0.0,
+            }
+        
+        max_workers = getattr(settings, 'MIKROTIK_POOL_CONNECTIONS_PER_ROUTER', 4)
+        failed = False
+        with client_pool.client(router) as client:
+            for is_read, indexes in groups:
+                if failed and stop_on_error:
+                    for index in indexes:
+                        results[index] = {
+                            "index": index,
+                            "command": steps[index]['command'],
+                            "method": steps[index].get('method', 'GET').upper(),
+                            "success": False,
+                            "skipped": True,
+                        }
+                    continue
+                
+                if len(indexes) == 1:
+                    results[indexes[0]] = run(client, indexes[0])
+                else:
+                    with ThreadPoolExecutor(max_workers=min(max_workers, len(indexes))) as executor:
+                        for line in executor.map(lambda i: run(client, i), indexes):
+                            results[line["index"]] = line
+                
+                if any(not results[index]["success"] for index in indexes):
+                    failed = True
+        
+        ran = [line for line in results if not line.get("skipped")]
+        circuit_breakers.record(router, not all(is_transport_failure(line) for line in ran))
+        
+        return {
+            "success": not failed,
+            "steps": results,
+            "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+    
+    @staticmethod
+    def execute_fleet_command(routers, command, method='GET', params=None, data=None,
+                              max_workers=None, timeout=None):
+        """Run one command on many routers concurrently
+        
+        Yields one result dict per router in completion order, so fast routers
+        are reported without waiting for slow or offline ones. A router that
+        has not answered ``timeout`` seconds after its command started is
+        reported as timed out.
+        
+        Args:
+            routers: Iterable of Router instances
             command (str): Mikrotik command path
             method (str): HTTP method ('GET', 'POST', 'PUT', 'DELETE')
             params (dict): Query parameters for GET requests
             data (dict): JSON data for POST/PUT requests
+            max_workers (int): Maximum number of routers contacted at once
+            timeout (float): Per-router timeout in seconds
         """
-        client = MikrotikAPIClient(router)
+        routers = list(routers)
+        if not routers:
+            return
+        
+        timeout = timeout or getattr(settings, 'MIKROTIK_FLEET_TIMEOUT', 10)
+        max_workers = min(
+            max_workers or getattr(settings, 'MIKROTIK_FLEET_MAX_WORKERS', 32),
+            len(routers)
+        )
+        started = {}
+        
+        def run(router):
+            started[router.pk] = time.monotonic()
+            try:
+                result = MikrotikAPIManager.execute_command(
+                    router, command, method, params, data, timeout=timeout
+                )
+            finally:
+                # Worker threads may have opened a DB connection for status updates
+                connections.close_all()
+            return result, time.monotonic() - started[router.pk]
+        
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mikrotik-fleet')
         try:
-            return client.execute_command(command, method, params, data)
+            futures = {executor.submit(run, router): router for router in routers}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+                for future in done:
+                    router = futures[future]
+                    try:
+                        result, elapsed = future.result()
+                    except Exception as e:
+                        result = {
+                            "success": False,
+                            "error": f"Command execution failed: {str(e)}",
+                            "status_code": 500
+                        }
+                        elapsed = time.monotonic() - started.get(router.pk, time.monotonic())
+                    yield MikrotikAPIManager._fleet_result(router, result, elapsed)
+                
+                # Give up on routers that are running past their deadline
+                now = time.monotonic()
+                for future in list(pending):
+                    router = futures[future]
+                    start = started.get(router.pk)
+                    if start is not None and now - start > timeout:
+                        pending.discard(future)
+                        yield MikrotikAPIManager._fleet_result(router, {
+                            "success": False,
+                            "error": f"Router did not respond within {timeout} seconds",
+                            "status_code": 504
+                        }, now - start)
         finally:
-            client.close()
+            # Don't block the response on abandoned workers
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    @staticmethod
+    def _fleet_result(router, result, elapsed):
+        """Shape one per-router line of a fleet run"""
+        line = {
+            "router_id": router.pk,
+            "router_name": router.name,
+            "success": result.get("success", False),
+            "elapsed_ms": round(elapsed * 1000, 1),
+        }
+        if line["success"]:
+            line["result"] = result.get("data")
+        else:
+            line["error"] = result.get("error")
+            line["status_code"] = result.get("status_code", 500)
+        return line
+    
+    @staticmethod
+    def get_device_info(router, use_cache=True):
+        """Get device information for a specific router
+        
+        Cached for the ``system/resource`` TTL; pass use_cache=False to bypass.
+        """
+        ttl = response_cache.ttl_for('system/resource')
+        key = response_cache.device_info_key(router)
+        if ttl > 0:
+            if use_cache:
+                cached = response_cache.get(key)
+                if cached is not None:
+                    return cached
+            else:
+                response_cache.record_bypass()
+        
+        rejected = MikrotikAPIManager.circuit_open_result(router)
+        if rejected:
+            return {"error": rejected["error"], "circuit_state": rejected["circuit_state"]}
+        
+        with client_pool.client(router) as client:
+            device_info = client.get_device_info()
+        # Only exceptions (not HTTP errors) mean the router was unreachable
+        unreachable = str(device_info.get('error', '')).startswith('Failed to get device info')
+        circuit_breakers.record(router, not unreachable)
+        if 'error' not in device_info:
+            response_cache.set(key, device_info, ttl)
+        return device_info
     
     @staticmethod
-    def get_device_info(router):
-        """Get device information for a specific router"""
-        client = MikrotikAPIClient(router)
+    def get_fleet_device_info(routers, deadline=None, max_workers=None):
+        """Collect device info for many routers in parallel within a total deadline
+        
+        Returns a tuple of (results, complete). Routers that have not answered
+        when the deadline passes are reported with ``timed_out`` set and
+        ``complete`` is False; the others are returned as they are.
+        """
+        routers = list(routers)
+        if not routers:
+            return [], True
+        
+        deadline = deadline or getattr(settings, 'MIKROTIK_DEVICE_INFO_DEADLINE', 8)
+        max_workers = min(
+            max_workers or getattr(settings, 'MIKROTIK_FLEET_MAX_WORKERS', 32),
+            len(routers)
+        )
+        
+        def run(router):
+            try:
+                return MikrotikAPIManager.get_device_info(router)
+            finally:
+                connections.close_all()
+        
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mikrotik-device-info')
         try:
-            return client.get_device_info()
+            futures = [executor.submit(run, router) for router in routers]
+            wait(futures, timeout=deadline)
         finally:
-            client.close()
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        results = []
+        complete = True
+        for router, future in zip(routers, futures):
+            line = {
+                "router_id": router.pk,
+                "router_name": router.name,
+                "is_online": router.is_online,
+            }
+            if not future.done() or future.cancelled():
+                complete = False
+                line["timed_out"] = True
+                line["error"] = f"No response within the {deadline} second deadline"
+            else:
+                try:
+                    device_info = future.result()
+                except Exception as e:
+                    device_info = {"error": f"Failed to get device info: {str(e)}"}
+                if "error" in device_info:
+                    line["error"] = device_info["error"]
+                else:
+                    line["device_info"] = device_info
+            results.append(line)
+        return results, complete
     
     @staticmethod
     def get_router_by_id(router_id, user):
@@ -1,12 +1,17 @@
 from django.db import models
 from django.core.validators import RegexValidator, MinValueValidator
-from cryptography.fernet import Fernet
 from django.conf import settings
+from mikrotik_cloudpilot.credentials import get_fernet, credential_cache
 from django.contrib.auth.models import User
 from decimal import Decimal
 import base64
 
 class Router(models.Model):
+    API_TRANSPORTS = [
+        ('rest', 'REST API (HTTP/HTTPS)'),
+        ('api', 'RouterOS API (8728/8729)'),
+    ]
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='routers')
     name = models.CharField(max_length=100)
     host = models.CharField(
@@ -23,6 +28,17 @@ class Router(models.Model):
     username = models.CharField(max_length=50)
     encrypted_password = models.BinaryField()
     use_https = models.BooleanField(default=False)
+    api_transport = models.CharField(
+        max_length=10,
+        choices=API_TRANSPORTS,
+        default='rest',
+        help_text="Protocol used to talk to the router"
+    )
+    api_port = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="RouterOS API port (defaults to 8728, or 8729 when using HTTPS)"
+    )
     last_checked = models.DateTimeField(null=True, blank=True)
     is_online = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -36,19 +52,12 @@ class Router(models.Model):
 
     def set_password(self, password):
         """Encrypt and store the password"""
-        if not hasattr(settings, 'ENCRYPTION_KEY'):
-            raise ValueError("ENCRYPTION_KEY not configured in settings")
-        
-        fernet = Fernet(settings.ENCRYPTION_KEY)
+        fernet = get_fernet()
         self.encrypted_password = fernet.encrypt(password.encode())
 
     def get_password(self):
         """Decrypt and return the password for use in connections"""
-        if not hasattr(settings, 'ENCRYPTION_KEY'):
-            raise ValueError("ENCRYPTION_KEY not configured in settings")
-        
-        fernet = Fernet(settings.ENCRYPTION_KEY)
-        return fernet.decrypt(self.encrypted_password).decode()
+        return credential_cache.decrypt(self, self.encrypted_password)
 
     @property
     def base_url(self):
@@ -56,6 +65,13 @@ class Router(models.Model):
         protocol = "https" if self.use_https else "http"
         return f"{protocol}://{self.host}:{self.port}/rest"
 
+    @property
+    def routeros_api_port(self):
+        """Get the port for the native RouterOS API (api / api-ssl service)"""
+        if self.api_port:
+            return self.api_port
+        return 8729 if self.use_https else 8728
+
     def save(self, *args, **kwargs):
         # If encrypted_password is not set but we have a plain password in kwargs
         if not self.encrypted_password and 'password' in kwargs:
@@ -0,0 +1,178 @@
+import logging
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .models import Router
+from .mikrotik_api import MikrotikAPIManager
+
+logger = logging.getLogger(__name__)
+
+
+def tcp_probe(host, port, timeout=3):
+    """Return True if a TCP connection to host:port can be opened"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class _ProbeSchedule:
+    """Adaptive probe interval for one router"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_due = 0.0
+        self.transitions = deque(maxlen=10)
+
+
+class RouterHealthMonitor:
+    """Probes every router on an adaptive schedule and records online state
+
+    Each probe is a plain TCP connect to the router's service port. A failed
+    connect on a router that was online is confirmed with a full HTTP/API
+    test before the router is marked offline. Routers whose state keeps
+    changing are probed at ``min_interval``; routers that stay stable back off
+    towards ``max_interval``. Only rows whose state changed (or whose
+    ``last_checked`` is older than ``heartbeat``) are written, in one
+    ``bulk_update``.
+    """
+
+    def __init__(self, workers=None, base_interval=None, min_interval=None,
+                 max_interval=None, heartbeat=None, probe_timeout=None,
+                 flap_window=None, flap_threshold=3):
+        self.workers = workers or getattr(settings, 'ROUTER_MONITOR_WORKERS', 32)
+        self.base_interval = base_interval or getattr(settings, 'ROUTER_MONITOR_INTERVAL', 60)
+        self.min_interval = min_interval or getattr(settings, 'ROUTER_MONITOR_MIN_INTERVAL', 15)
+        self.max_interval = max_interval or getattr(settings, 'ROUTER_MONITOR_MAX_INTERVAL', 600)
+        self.heartbeat = heartbeat or getattr(settings, 'ROUTER_MONITOR_HEARTBEAT', 600)
+        self.probe_timeout = probe_timeout or getattr(settings, 'ROUTER_MONITOR_PROBE_TIMEOUT', 3)
+        self.flap_window = flap_window or self.base_interval * 10
+        self.flap_threshold = flap_threshold
+        self._schedules = {}
+
+    def run_forever(self, stdout=None):
+        """Probe due routers until interrupted"""
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='router-monitor') as executor:
+            while True:
+                summary = self.run_once(executor)
+                if stdout and summary['probed']:
+                    stdout.write(self.format_summary(summary))
+                time.sleep(max(0.5, min(self.seconds_until_next_due(), 5)))
+
+    def run_once(self, executor=None, force=False):
+        """Probe every router that is due (or all of them when ``force``)"""
+        now = time.monotonic()
+        routers = list(Router.objects.only(
+            'id', 'name', 'host', 'port', 'use_https', 'api_transport', 'api_port',
+            'username', 'encrypted_password', 'is_online', 'last_checked', 'updated_at'
+        ))
+        self._forget_deleted(routers)
+
+        due = []
+        for router in routers:
+            schedule = self._schedules.setdefault(router.pk, _ProbeSchedule(self.base_interval))
+            if force or schedule.next_due <= now:
+                due.append(router)
+
+        if not due:
+            return {'probed': 0, 'changed': 0, 'online': 0, 'offline': 0}
+
+        if executor is None:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(due))) as pool:
+                results = list(pool.map(self._probe, due))
+        else:
+            results = list(executor.map(self._probe, due))
+
+        return self._apply(due, results)
+
+    def seconds_until_next_due(self):
+        if not self._schedules:
+            return self.base_interval
+        return max(0.0, min(s.next_due for s in self._schedules.values()) - time.monotonic())
+
+    @staticmethod
+    def format_summary(summary):
+        return (
+            f"Probed {summary['probed']} routers: {summary['online']} online, "
+            f"{summary['offline']} offline, {summary['changed']} changed"
+        )
+
+    def _probe(self, router):
+        """Return True if the router is reachable"""
+        try:
+            port = router.routeros_api_port if router.api_transport == 'api' else router.port
+            if tcp_probe(router.host, port, self.probe_timeout):
+                return True
+            if not router.is_online:
+                return False
+            # Was online: confirm with a real request before flipping it offline
+            return MikrotikAPIManager.test_connection(router)
+        except Exception as e:
+            logger.warning("Health probe for router %s failed: %s", router.pk, e)
+            return False
+        finally:
+            connections.close_all()
+
+    def _apply(self, routers, results):
+        now = time.monotonic()
+        checked_at = timezone.now()
+        changed = []
+        state_changes = 0
+
+        for router, is_online in zip(routers, results):
+            schedule = self._schedules[router.pk]
+            state_changed = router.is_online != is_online
+            if state_changed:
+                state_changes += 1
+                schedule.transitions.append(now)
+                logger.info(
+                    "Router %s (%s) is now %s", router.pk, router.host,
+                    'online' if is_online else 'offline'
+                )
+
+            stale = (
+                router.last_checked is None
+                or (checked_at - router.last_checked).total_seconds() >= self.heartbeat
+            )
+            if state_changed or stale:
+                router.is_online = is_online
+                router.last_checked = checked_at
+                changed.append(router)
+
+            schedule.interval = self._next_interval(schedule, state_changed, now)
+            schedule.next_due = now + schedule.interval
+
+        if changed:
+            Router.objects.bulk_update(changed, ['is_online', 'last_checked'])
+
+        online = sum(1 for is_online in results if is_online)
+        return {
+            'probed': len(routers),
+            'changed': state_changes,
+            'online': online,
+            'offline': len(routers) - online,
+        }
+
+    def _next_interval(self, schedule, state_changed, now):
+        while schedule.transitions and now - schedule.transitions[0] > self.flap_window:
+            schedule.transitions.popleft()
+
+        if len(schedule.transitions) >= self.flap_threshold:
+            # Flapping: watch it closely
+            return self.min_interval
+        if state_changed:
+            return max(self.min_interval, self.base_interval // 2)
+        # Stable: back off gradually
+        return min(self.max_interval, schedule.interval * 1.5)
+
+    def _forget_deleted(self, routers):
+        ids = {router.pk for router in routers}
+        for router_id in [rid for rid in self._schedules if rid not in ids]:
+            del self._schedules[router_id]
@@ -0,0 +1,158 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from . import hotspot
+from .mikrotik_api import MikrotikAPIManager
+from .models import Package, Router
+
+logger = logging.getLogger(__name__)
+
+
+def plan_profiles(router):
+    """Diff a router's hotspot user profiles against its packages
+
+    Reads the profiles once and returns (steps, error). Active packages are
+    rendered with hotspot.render_profile; profiles that are missing or differ
+    are added or set. Managed profiles whose package no longer exists on the
+    router are removed. Profiles of inactive packages are kept, since
+    customers who bought them may still be using them, and profiles not
+    created for a package are never touched.
+    """
+    result = MikrotikAPIManager.execute_batch(router, [
+        {'command': 'ip/hotspot/user/profile', 'params': {'.proplist': '.id,name,rate-limit'}},
+    ])
+    if not result['success']:
+        return [], f"Reading hotspot profiles failed: {result.get('error') or result['steps'][0]['error']}"
+
+    current = {profile.get('name'): profile for profile in hotspot.as_rows(result['steps'][0]['result'])}
+    packages = list(Package.objects.filter(router=router))
+    steps = hotspot.profile_steps([package for package in packages if package.is_active], current)
+
+    wanted = {hotspot.profile_name(package) for package in packages}
+    for name in sorted(current):
+        if name and name.startswith(hotspot.PROFILE_PREFIX) and name not in wanted:
+            steps.append({
+                'command': 'ip/hotspot/user/profile/remove',
+                'method': 'POST',
+                'data': hotspot.item_target(current[name], name),
+            })
+    return steps, None
+
+
+def sync_profiles(router, dry_run=False):
+    """Push only the changed profiles to ``router``; returns a report dict"""
+    try:
+        steps, error = plan_profiles(router)
+        report = {'router': router, 'steps': steps, 'error': error, 'errors': []}
+        if error or dry_run or not steps:
+            return report
+
+        result = MikrotikAPIManager.execute_batch(router, steps)
+        if not result['steps']:
+            report['error'] = result['error']
+        else:
+            report['errors'] = [
+                f"{line['command']}: {line['error']}" for line in result['steps'] if not line['success']
+            ]
+        return report
+    except Exception as e:
+        logger.exception("Syncing hotspot profiles on router %s crashed", router.pk)
+        return {'router': router, 'steps': [], 'error': str(e), 'errors': []}
+    finally:
+        connections.close_all()
+
+
+def sync_fleet_profiles(routers, dry_run=False, max_workers=None):
+    """Sync many routers, ``max_workers`` at a time; yields reports in completion order"""
+    routers = list(routers)
+    if not routers:
+        return
+    max_workers = max_workers or getattr(settings, 'ROUTER_PROFILE_SYNC_WORKERS', 8)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(routers)), thread_name_prefix='profile-sync') as executor:
+        futures = [executor.submit(sync_profiles, router, dry_run) for router in routers]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+class ProfileSyncQueue:
+    """Syncs a router's profiles in the background after its packages change
+
+    Requests are coalesced per router: saving many packages queues at most
+    one sync that has not started yet, and a change made while a sync is
+    running queues exactly one more, started when the running one ends. A
+    router is never synced by two threads at once.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._running = set()
+        self.synced = 0
+        self.failed = 0
+        self.coalesced = 0
+
+    def request(self, router_id):
+        """Sync the router once the current transaction commits"""
+        transaction.on_commit(lambda: self._submit(router_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': len(self._queued),
+                'running': len(self._running),
+                'synced': self.synced,
+                'failed': self.failed,
+                'coalesced': self.coalesced,
+            }
+
+    def _submit(self, router_id):
+        with self._lock:
+            if router_id in self._queued:
+                self.coalesced += 1
+                return
+            self._queued.add(router_id)
+            if router_id in self._running:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='profile-sync')
+        self._executor.submit(self._run, router_id)
+
+    def _run(self, router_id):
+        with self._lock:
+            self._queued.discard(router_id)
+            self._running.add(router_id)
+        try:
+            router = Router.objects.filter(pk=router_id).first()
+            if router is None:
+                return
+            report = sync_profiles(router)
+            failed = bool(report['error'] or report['errors'])
+            if failed:
+                logger.warning(
+                    "Syncing hotspot profiles on router %s failed: %s",
+                    router_id, report['error'] or '; '.join(report['errors'])
+                )
+            with self._lock:
+                if failed:
+                    self.failed += 1
+                else:
+                    self.synced += 1
+        finally:
+            connections.close_all()
+            with self._lock:
+                self._running.discard(router_id)
+                again = router_id in self._queued
+            if again:
+                self._executor.submit(self._run, router_id)
+
+
+profile_sync = ProfileSyncQueue(
+    workers=getattr(settings, 'ROUTER_PROFILE_SYNC_WORKERS', 8),
+)
@@ -0,0 +1,494 @@
+import itertools
+import logging
+import socket
+import ssl
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Menus that REST returns as a single object instead of a list of items
+SINGLETON_MENUS = {
+    'system/resource',
+    'system/identity',
+    'system/clock',
+    'system/routerboard',
+    'system/license',
+    'system/note',
+    'ip/dns',
+    'ip/settings',
+    'ip/cloud',
+    'ip/proxy',
+    'ip/socks',
+    'ip/upnp',
+    'ip/hotspot/service-port',
+    'snmp',
+}
+
+
+class RouterOSAPIError(Exception):
+    """Base exception for RouterOS API transport errors"""
+    pass
+
+
+class RouterOSConnectionError(RouterOSAPIError):
+    """Raised when the socket to the router fails or is closed"""
+    pass
+
+
+class RouterOSLoginError(RouterOSAPIError):
+    """Raised when the router rejects the API login"""
+    pass
+
+
+class RouterOSTrapError(RouterOSAPIError):
+    """Raised when the router answers a command with !trap"""
+
+    def __init__(self, message, category=None):
+        super().__init__(message)
+        self.category = category
+
+
+def encode_length(length):
+    """Encode a word length using the RouterOS variable-length scheme"""
+    if length < 0x80:
+        return bytes([length])
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, 'big')
+    if length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, 'big')
+    if length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, 'big')
+    return b'\xf0' + length.to_bytes(4, 'big')
+
+
+def encode_sentence(words):
+    """Encode a list of words into a length-prefixed sentence"""
+    payload = bytearray()
+    for word in words:
+        data = word.encode('utf-8')
+        payload += encode_length(len(data))
+        payload += data
+    payload += b'\x00'
+    return bytes(payload)
+
+
+def _recv_exact(sock, count):
+    """Read exactly ``count`` bytes from the socket"""
+    buf = bytearray()
+    while len(buf) < count:
+        chunk = sock.recv(count - len(buf))
+        if not chunk:
+            raise RouterOSConnectionError("Connection closed by router")
+        buf += chunk
+    return bytes(buf)
+
+
+def read_length(sock):
+    """Read and decode one word length from the socket"""
+    first = _recv_exact(sock, 1)[0]
+    if first < 0x80:
+        return first
+    if first < 0xC0:
+        return ((first & 0x3F) << 8) | _recv_exact(sock, 1)[0]
+    if first < 0xE0:
+        return ((first & 0x1F) << 16) | int.from_bytes(_recv_exact(sock, 2), 'big')
+    if first < 0xF0:
+        return ((first & 0x0F) << 24) | int.from_bytes(_recv_exact(sock, 3), 'big')
+    if first == 0xF0:
+        return int.from_bytes(_recv_exact(sock, 4), 'big')
+    raise RouterOSConnectionError(f"Invalid control byte in length: {first:#x}")
+
+
+def read_sentence(sock):
+    """Read one sentence (list of words) from the socket"""
+    words = []
+    while True:
+        length = read_length(sock)
+        if length == 0:
+            return words
+        words.append(_recv_exact(sock, length).decode('utf-8', errors='replace'))
+
+
+def parse_sentence(words):
+    """Split a reply sentence into (reply_type, tag, attributes)"""
+    reply_type = words[0] if words else ''
+    tag = None
+    attributes = {}
+    for word in words[1:]:
+        if word.startswith('.tag='):
+            tag = word[5:]
+        elif word.startswith('='):
+            key, _, value = word[1:].partition('=')
+            attributes[key] = value
+    return reply_type, tag, attributes
+
+
+def enable_keepalive(sock, idle=60, interval=10, count=3):
+    """Turn on TCP keepalive so a router that vanished is noticed
+
+    The reader waits on the socket without a timeout, so without probes a
+    router that dropped off the network would hold the connection forever.
+    The idle/interval/count knobs are set where the platform has them.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+class _PendingCommand:
+    """Replies collected for one tagged command"""
+
+    def __init__(self):
+        self.items = []
+        self.done = {}
+        self.error = None
+        self.event = threading.Event()
+
+
+class RouterOSAPIConnection:
+    """A single long-lived API socket with tagged command multiplexing
+
+    Commands may be issued from several threads at once; each one gets a
+    unique ``.tag`` and a reader thread routes replies back to the caller
+    that is waiting for them.
+    """
+
+    def __init__(self, host, port, username, password, use_ssl=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._pending = {}
+        self._tags = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._closed = True
+
+    @property
+    def is_connected(self):
+        return not self._closed
+
+    def connect(self):
+        """Open the socket, log in and start the reply reader"""
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        try:
+            enable_keepalive(sock)
+            if self.use_ssl:
+                context = ssl.create_default_context()
+                if not getattr(settings, 'ROUTEROS_API_VERIFY_SSL', False):
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+                sock = context.wrap_socket(sock, server_hostname=self.host)
+
+            # Login happens before the reader starts, so read the reply inline
+            sock.sendall(encode_sentence([
+                '/login', f'=name={self.username}', f'=password={self.password}'
+            ]))
+            while True:
+                reply_type, _, attributes = parse_sentence(read_sentence(sock))
+                if reply_type == '!done':
+                    break
+                if reply_type in ('!trap', '!fatal'):
+                    raise RouterOSLoginError(attributes.get('message', 'Login failed'))
+
+            # Replies may arrive long after a command was sent
+            sock.settimeout(None)
+        except Exception:
+            sock.close()
+            raise
+
+        self._sock = sock
+        self._closed = False
+        self._reader = threading.Thread(
+            target=self._read_loop,
+            name=f'routeros-api-{self.host}',
+            daemon=True
+        )
+        self._reader.start()
+
+    def talk(self, words, timeout=None):
+        """Send a command and wait for its replies
+
+        Returns a tuple of (items, done_attributes) where ``items`` holds the
+        attributes of every ``!re`` reply. Raises RouterOSTrapError if the
+        router traps the command.
+        """
+        return self.talk_many([words], timeout=timeout)[0]
+
+    def talk_many(self, sentences, timeout=None):
+        """Send several commands at once and wait for all of their replies
+
+        The router works on the tagged commands concurrently, so the total
+        wait is roughly that of the slowest command rather than the sum.
+        Returns a list of (items, done_attributes) in the order given. If
+        the replies do not all arrive within ``timeout`` the connection is
+        closed, failing every command in flight on it.
+        """
+        tags = []
+        with self._lock:
+            if self._closed:
+                raise RouterOSConnectionError("Connection is closed")
+            for _ in sentences:
+                tag = str(next(self._tags))
+                self._pending[tag] = _PendingCommand()
+                tags.append(tag)
+            pendings = [self._pending[tag] for tag in tags]
+
+        payload = b''.join(
+            encode_sentence(list(words) + [f'.tag={tag}'])
+            for words, tag in zip(sentences, tags)
+        )
+        try:
+            with self._send_lock:
+                self._sock.sendall(payload)
+        except OSError as e:
+            error = RouterOSConnectionError(f"Failed to send command: {e}")
+            self._fail(error)
+            raise error
+
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        results = []
+        for tag, pending in zip(tags, pendings):
+            if not pending.event.wait(max(0, deadline - time.monotonic())):
+                # The socket may be dead without the reader knowing; drop it so the next call reconnects
+                error = RouterOSConnectionError("Timed out waiting for router reply")
+                self._fail(error)
+                raise error
+
+            if pending.error is not None:
+                raise pending.error
+            results.append((pending.items, pending.done))
+        return results
+
+    def close(self):
+        """Close the socket and fail any in-flight commands"""
+        self._fail(RouterOSConnectionError("Connection closed"))
+
+    def _read_loop(self):
+        try:
+            while not self._closed:
+                reply_type, tag, attributes = parse_sentence(read_sentence(self._sock))
+                if reply_type == '!fatal':
+                    raise RouterOSConnectionError(
+                        f"Router closed the session: {attributes.get('message', 'fatal error')}"
+                    )
+
+                with self._lock:
+                    pending = self._pending.get(tag)
+                if pending is None:
+                    continue
+
+                if reply_type == '!re':
+                    pending.items.append(attributes)
+                elif reply_type == '!trap':
+                    # A !done always follows a !trap; keep the first error
+                    if pending.error is None:
+                        pending.error = RouterOSTrapError(
+                            attributes.get('message', 'Command failed'),
+                            attributes.get('category')
+                        )
+                elif reply_type == '!done':
+                    pending.done = attributes
+                    with self._lock:
+                        self._pending.pop(tag, None)
+                    pending.event.set()
+        except Exception as e:
+            if not self._closed:
+                logger.warning("RouterOS API connection to %s lost: %s", self.host, e)
+            self._fail(e if isinstance(e, RouterOSAPIError) else RouterOSConnectionError(str(e)))
+
+    def _fail(self, error):
+        with self._lock:
+            if self._closed and not self._pending:
+                return
+            self._closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+
+        for item in pending:
+            item.error = error
+            item.event.set()
+
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+
+
+class RouterOSCommandMixin:
+    """Translation between REST-style commands and API sentences
+
+    Shared by the threaded and asyncio RouterOS API clients.
+    """
+
+    def _build_sentence(self, command, method, params, data):
+        """Translate a REST-style command into API words
+
+        Returns (words, single) where ``single`` says whether REST would have
+        returned one object rather than a list.
+        """
+        path = command.strip('/')
+        segments = path.split('/')
+        item_id = segments[-1] if segments and segments[-1].startswith('*') else None
+        menu = '/'.join(segments[:-1]) if item_id else path
+
+        if method == 'GET':
+            words = [f'/{menu}/print']
+            if item_id:
+                words.append(f'?.id={item_id}')
+            for key, value in (params or {}).items():
+                if key == '.proplist':
+                    words.append(f'=.proplist={self._format_value(value)}')
+                else:
+                    words.append(f'?{key}={self._format_value(value)}')
+            return words, bool(item_id) or menu in SINGLETON_MENUS
+
+        if method == 'PUT':
+            if item_id:
+                raise ValueError("PUT creates a new item; do not include an item id")
+            return [f'/{menu}/add'] + self._attribute_words(data), True
+
+        if method == 'POST':
+            return [f'/{path}'] + self._attribute_words(data), True
+
+        if method == 'DELETE':
+            if not item_id:
+                raise ValueError("DELETE requires an item id, e.g. 'ip/hotspot/user/*1'")
+            return [f'/{menu}/remove', f'=.id={item_id}'], True
+
+        raise ValueError(f"Unsupported HTTP method: {method}")
+
+    def _attribute_words(self, data):
+        return [f'={key}={self._format_value(value)}' for key, value in (data or {}).items()]
+
+    @staticmethod
+    def _format_value(value):
+        if isinstance(value, bool):
+            return 'yes' if value else 'no'
+        if isinstance(value, (list, tuple)):
+            return ','.join(str(v) for v in value)
+        return str(value)
+
+    @staticmethod
+    def _shape_result(method, items, done, single):
+        """Match the REST interface's response bodies"""
+        if method == 'GET':
+            if single:
+                return items[0] if items else {}
+            return items
+        if method == 'PUT' and 'ret' in done:
+            return {".id": done['ret']}
+        if items:
+            return items if len(items) > 1 else items[0]
+        if done:
+            return done
+        return {"message": "Operation completed successfully"}
+
+
+class RouterOSAPIClient(RouterOSCommandMixin):
+    """Client speaking the native RouterOS API with the same result shape as MikrotikAPIClient"""
+
+    def __init__(self, router):
+        self.router = router
+        self.username = router.username
+        self.password = router.get_password()
+        self.connection = None
+        self._connect_lock = threading.Lock()
+
+    def _get_connection(self):
+        """Return the live connection, reconnecting if it dropped"""
+        with self._connect_lock:
+            if self.connection is None or not self.connection.is_connected:
+                connection = RouterOSAPIConnection(
+                    self.router.host,
+                    self.router.routeros_api_port,
+                    self.username,
+                    self.password,
+                    use_ssl=self.router.use_https,
+                    timeout=10
+                )
+                connection.connect()
+                self.connection = connection
+            return self.connection
+
+    def _talk(self, words, timeout=None):
+        return self._get_connection().talk(words, timeout=timeout)
+
+    def test_connection(self):
+        """Test if we can connect to the router"""
+        try:
+            self._talk(['/system/resource/print'])
+            return True
+        except Exception:
+            return False
+
+    def execute_command(self, command, method='GET', params=None, data=None, timeout=None):
+        """Execute a command on the router
+
+        Takes the same arguments as MikrotikAPIClient.execute_command and
+        maps the REST verbs onto API sentences:
+        GET -> print, PUT -> add, POST -> run the command path as given,
+        DELETE -> remove (the item id is the last path segment).
+        """
+        try:
+            words, single = self._build_sentence(command, method.upper(), params, data)
+        except ValueError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "status_code": 400
+            }
+
+        try:
+            items, done = self._talk(words, timeout=timeout)
+        except RouterOSLoginError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "status_code": 401
+            }
+        except RouterOSTrapError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "status_code": 400
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Command execution failed: {str(e)}",
+                "status_code": 500
+            }
+
+        return {"success": True, "data": self._shape_result(method.upper(), items, done, single)}
+
+    def get_device_info(self):
+        """Get basic device information"""
+        try:
+            (resource_items, _), (identity_items, _) = self._get_connection().talk_many([
+                ['/system/resource/print'],
+                ['/system/identity/print'],
+            ])
+            # mikrotik_api imports this module, so import the shared shape late
+            from .mikrotik_api import MikrotikAPIClient
+            return MikrotikAPIClient.device_info_from(
+                resource_items[0] if resource_items else {},
+                identity_items[0] if identity_items else {}
+            )
+        except Exception as e:
+            return {"error": f"Failed to get device info: {str(e)}"}
+
+    def close(self):
+        """Close the API socket"""
+        if self.connection is not None:
+            self.connection.close()
@@ -0,0 +1,249 @@
+"""RouterOS scripts: render commands as .rsc lines and run them in one upload
+
+Sending thousands of writes one command at a time costs a round trip each.
+A script is uploaded as a file, run with ``/import`` and deleted again, so
+the whole script costs three commands however long it is.
+
+``compile_script`` turns write operations in the execute_command shape
+(``{command, method, data}``) into such a script; ``run_operations`` runs
+one and reports a result per operation, like execute_batch does.
+"""
+import re
+import time
+import uuid
+
+from .mikrotik_api import MikrotikAPIManager, response_cache
+
+SCRIPT_PREFIX = 'cloudpilot-'
+
+# Ends each operation's record in the outcome variable ("\1E" in the script)
+RECORD_SEPARATOR = '\x1e'
+
+# :onerror, which hands the error message to the handler, arrived in RouterOS 7.13
+ONERROR_VERSION = (7, 13)
+
+# Menu names, commands and attribute names are written into the script as
+# they are, so they must be plain words; only values are quoted
+NAME_PATTERN = re.compile(r'^[a-z0-9][a-z0-9.-]*$')
+ITEM_ID_PATTERN = re.compile(r'^\*[0-9A-Fa-f]+$')
+
+
+def quote(value):
+    """Value as a RouterOS script string literal"""
+    if isinstance(value, bool):
+        return 'yes' if value else 'no'
+    if isinstance(value, (list, tuple)):
+        value = ','.join(str(v) for v in value)
+    text = str(value)
+    for char, escaped in (('\\', '\\\\'), ('"', '\\"'), ('$', '\\$'), ('?', '\\?'), ('\n', '\\n'), ('\r', '\\r')):
+        text = text.replace(char, escaped)
+    return f'"{text}"'
+
+
+def render_line(menu, action, attributes=None, ignore_errors=False):
+    """One script line, e.g. ``/ip hotspot user add name="x"``
+
+    ``menu`` uses the REST spelling ('ip/hotspot/user'). With
+    ``ignore_errors`` a failing line does not stop the rest of the script.
+    Raises ValueError for a menu, action or attribute name that is not a
+    plain RouterOS word, since those are not quoted.
+    """
+    path = [segment for segment in menu.strip('/').split('/') if segment] + [action]
+    for name in path:
+        if not NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid command path segment: {name!r}")
+    for key in attributes or {}:
+        if not NAME_PATTERN.match(str(key)):
+            raise ValueError(f"Invalid attribute name: {key!r}")
+    words = ['/' + ' '.join(path)]
+    words += [f'{key}={quote(value)}' for key, value in (attributes or {}).items()]
+    line = ' '.join(words)
+    if ignore_errors:
+        return f':do {{ {line} }} on-error={{}}'
+    return line
+
+
+def compile_operation(command, method, data=None):
+    """One write operation as a script line, with the API client's verb mapping
+
+    PUT adds an item, POST runs the command path as given and DELETE removes
+    the item whose id ends the path. An ``.id`` in the data becomes
+    ``numbers``. Reads cannot be compiled, since a script returns no data;
+    raises ValueError for them and for malformed operations.
+    """
+    method = method.upper()
+    path = command.strip('/')
+    segments = path.split('/')
+    item_id = segments[-1] if segments[-1].startswith('*') else None
+    if item_id and not ITEM_ID_PATTERN.match(item_id):
+        raise ValueError(f"Invalid item id: {item_id!r}")
+    menu = '/'.join(segments[:-1]) if item_id else path
+
+    if method == 'GET':
+        raise ValueError("GET cannot run in a script; use execute-batch for reads")
+    if method == 'PUT':
+        if item_id:
+            raise ValueError("PUT creates a new item; do not include an item id")
+        return render_line(menu, 'add', data)
+    if method == 'POST':
+        attributes = dict(data or {})
+        if '.id' in attributes:
+            attributes['numbers'] = attributes.pop('.id')
+        menu, _, action = path.rpartition('/')
+        return render_line(menu, action, attributes)
+    if method == 'DELETE':
+        if not item_id:
+            raise ValueError("DELETE requires an item id, e.g. 'ip/hotspot/user/*1'")
+        return render_line(menu, 'remove', {'numbers': item_id})
+    raise ValueError(f"Unsupported HTTP method: {method}")
+
+
+def supports_onerror(version):
+    """Whether a RouterOS version string ('7.14.2 (stable)') has ``:onerror``"""
+    match = re.match(r'(\d+)\.(\d+)', str(version or ''))
+    return bool(match) and (int(match[1]), int(match[2])) >= ONERROR_VERSION
+
+
+def compile_script(operations, variable, stop_on_error=False, capture_errors=True):
+    """Compile ``operations`` into one script; returns the source
+
+    Every operation gets a line of its own that appends a record to the
+    global ``variable``: ``+`` when it succeeds, ``-`` and the router's error
+    message when it fails, each ended by RECORD_SEPARATOR. So after the
+    import the variable holds one record per operation that ran. Catching
+    the message needs ``:onerror`` (RouterOS 7.13); without
+    ``capture_errors`` the older ``:do ... on-error`` is used and failures
+    are recorded without a message. With ``stop_on_error`` the first
+    failure ends the import.
+    """
+    stop = '; :error "stopped"' if stop_on_error else ''
+    lines = [f':global {variable} ""']
+    for operation in operations:
+        line = compile_operation(operation['command'], operation.get('method', 'GET'), operation.get('data'))
+        succeeded = f':global {variable}; :set {variable} (${variable} . "+\\1E")'
+        if capture_errors:
+            lines.append(
+                f':onerror e in={{ {line}; {succeeded} }} '
+                f'do={{ :global {variable}; :set {variable} (${variable} . "-" . $e . "\\1E"){stop} }}'
+            )
+        else:
+            lines.append(
+                f':do {{ {line}; {succeeded} }} '
+                f'on-error={{ :global {variable}; :set {variable} (${variable} . "-\\1E"){stop} }}'
+            )
+    return '\n'.join(lines) + '\n'
+
+
+def router_supports_onerror(router):
+    """Check the router's version (a cached read); False when it cannot be read"""
+    result = MikrotikAPIManager.execute_command(router, 'system/resource', 'GET')
+    data = result.get('data') if result.get('success') else None
+    if isinstance(data, list):
+        data = data[0] if data else None
+    return isinstance(data, dict) and supports_onerror(data.get('version'))
+
+
+def _upload_and_import(router, source, name, extra_steps=()):
+    """Upload, import and delete the script in one batch; returns (batch result, error)"""
+    result = MikrotikAPIManager.execute_batch(router, [
+        {'command': 'file', 'method': 'PUT', 'data': {'name': name, 'contents': source}},
+        {'command': 'import', 'method': 'POST', 'data': {'file-name': name}},
+        {'command': 'file/remove', 'method': 'POST', 'data': {'numbers': name}},
+        *extra_steps,
+    ], stop_on_error=False)
+    # A script can change anything on the router
+    response_cache.invalidate_router(router.pk)
+
+    error = result.get('error')
+    if not error:
+        upload, run = result['steps'][0], result['steps'][1]
+        if not upload['success']:
+            error = f"Uploading {name} failed: {upload['error']}"
+        elif not run['success']:
+            error = f"Importing {name} failed: {run['error']}"
+    return result, error
+
+
+def run_script(router, source, name=None):
+    """Upload ``source`` as a .rsc file, import it and delete the file
+
+    Returns a dict with ``success``, ``error`` and ``elapsed_ms``.
+    """
+    name = name or f'{SCRIPT_PREFIX}{uuid.uuid4().hex[:12]}.rsc'
+    started = time.monotonic()
+    _, error = _upload_and_import(router, source, name)
+    return {
+        'success': error is None,
+        'error': error,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+    }
+
+
+def run_operations(router, operations, stop_on_error=False):
+    """Run write operations on ``router`` as one compiled script
+
+    The script is uploaded, imported and deleted, and its outcome variable
+    read back and removed, all in one batch over one connection. Returns a
+    dict shaped like execute_batch's: ``steps`` holds one entry per
+    operation (``index``, ``command``, ``method``, ``line``, ``success`` and
+    ``error`` or ``skipped``), or is empty if the script never ran. Failed
+    operations carry the router's error message on RouterOS 7.13 and later;
+    older routers only report that the line failed.
+    Raises ValueError before touching the router if an operation cannot be
+    compiled.
+    """
+    token = uuid.uuid4().hex[:12]
+    name = f'{SCRIPT_PREFIX}{token}.rsc'
+    variable = f'cloudpilot{token}'
+    started = time.monotonic()
+    source = compile_script(operations, variable, stop_on_error, capture_errors=router_supports_onerror(router))
+
+    result, error = _upload_and_import(router, source, name, extra_steps=[
+        {'command': 'system/script/environment', 'params': {'name': variable, '.proplist': 'value'}},
+        {'command': 'system/script/environment/remove', 'method': 'POST', 'data': {'numbers': variable}},
+    ])
+    elapsed = round((time.monotonic() - started) * 1000, 1)
+    if not result['steps'] or not result['steps'][0]['success']:
+        return {'success': False, 'steps': [], 'error': error, 'elapsed_ms': elapsed}
+
+    read = result['steps'][3]
+    if not read['success']:
+        return {
+            'success': False,
+            'steps': [],
+            'error': error or f"Reading script results failed: {read['error']}",
+            'elapsed_ms': elapsed,
+        }
+    rows = read['result'] if isinstance(read['result'], list) else [read['result']]
+    value = str(rows[0].get('value', '')) if rows and rows[0] else ''
+    # The last piece is whatever follows the final separator: nothing
+    outcomes = value.split(RECORD_SEPARATOR)[:-1]
+    failed = any(outcome.startswith('-') for outcome in outcomes)
+
+    steps = []
+    for index, operation in enumerate(operations):
+        line = {
+            'index': index,
+            'command': operation['command'],
+            'method': operation.get('method', 'GET').upper(),
+            # Line 1 declares the outcome variable
+            'line': index + 2,
+        }
+        if index < len(outcomes):
+            line['success'] = outcomes[index] == '+'
+            if not line['success']:
+                line['error'] = outcomes[index][1:] or 'Command failed on the router'
+        elif index == len(outcomes) and not failed and error:
+            # The import itself stopped here, e.g. on a line it could not parse
+            line['success'] = False
+            line['error'] = error
+        else:
+            line['success'] = False
+            line['skipped'] = True
+        steps.append(line)
+
+    return {
+        'success': all(line['success'] for line in steps),
+        'steps': steps,
+        'elapsed_ms': elapsed,
+    }
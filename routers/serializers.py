@@ -68,7 +68,7 @@ class RouterSerializer(serializers.ModelSerializer):
         model = Router
         fields = [
             'id', 'name', 'host', 'port', 'username', 'password', 
-            'use_https', 'is_online', 'last_checked', 
+            'use_https', 'api_transport', 'api_port', 'is_online', 'last_checked', 
             'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'is_online', 'last_checked', 'created_at', 'updated_at']
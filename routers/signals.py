@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from mikrotik_cloudpilot.credentials import credential_cache
+from .models import Router, Package
+from .profile_sync import profile_sync
+
+
+@receiver(post_save, sender=Router)
+@receiver(post_delete, sender=Router)
+def evict_router_password(sender, instance, **kwargs):
+    """Drop the cached decrypted password whenever the router row changes."""
+    credential_cache.evict(instance)
+
+
+@receiver(pre_save, sender=Package)
+def remember_package_router(sender, instance, **kwargs):
+    """Note the router a package is moved away from, so its profile is removed there too."""
+    instance._previous_router_id = None
+    if instance.pk:
+        instance._previous_router_id = (
+            Package.objects.filter(pk=instance.pk).values_list('router_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Package)
+@receiver(post_delete, sender=Package)
+def sync_package_profiles(sender, instance, **kwargs):
+    """Push the package's hotspot user profile to its router after it changes."""
+    if not getattr(settings, 'ROUTER_PROFILE_SYNC_ON_SAVE', True):
+        return
+    profile_sync.request(instance.router_id)
+    previous = getattr(instance, '_previous_router_id', None)
+    if previous and previous != instance.router_id:
+        profile_sync.request(previous)
@@ -1,3 +1,409 @@
-from django.test import TestCase
+import queue
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from . import hotspot, scripts
+from .routeros_api import (
+    RouterOSAPIConnection,
+    RouterOSConnectionError,
+    RouterOSLoginError,
+    RouterOSTrapError,
+    encode_length,
+    encode_sentence,
+    parse_sentence,
+    read_length,
+    read_sentence,
+)
+
+
+class FakeRouter:
+    """Accepts one API connection on localhost, answers the login and queues the commands it reads"""
+
+    def __init__(self, password='secret'):
+        self.password = password
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        self.commands = queue.Queue()
+        self.sock = None
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        try:
+            self.sock, _ = self.listener.accept()
+            _, _, login = parse_sentence(read_sentence(self.sock))
+            if login.get('password') != self.password:
+                self.send('!trap', '=message=invalid user name or password (6)')
+            self.send('!done')
+            while True:
+                self.commands.put(parse_sentence(read_sentence(self.sock)))
+        except (OSError, RouterOSConnectionError):
+            # The client went away or the test closed the router
+            pass
+
+    def send(self, *words):
+        self.sock.sendall(encode_sentence(list(words)))
+
+    def next_command(self):
+        """(command, tag, attributes) of the next command the client sent"""
+        return self.commands.get(timeout=5)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.listener.close()
+
+
+class LengthEncodingTests(SimpleTestCase):
+    # Each encoded size ends just below the next boundary
+    SIZES = {
+        0: 1, 0x7F: 1,
+        0x80: 2, 0x3FFF: 2,
+        0x4000: 3, 0x1FFFFF: 3,
+        0x200000: 4, 0xFFFFFFF: 4,
+        0x10000000: 5, 0xFFFFFFFF: 5,
+    }
+
+    def test_encoded_sizes(self):
+        for length, size in self.SIZES.items():
+            with self.subTest(length=hex(length)):
+                self.assertEqual(len(encode_length(length)), size)
+
+    def test_read_length_round_trip(self):
+        client, server = socket.socketpair()
+        with client, server:
+            for length in self.SIZES:
+                with self.subTest(length=hex(length)):
+                    client.sendall(encode_length(length))
+                    self.assertEqual(read_length(server), length)
+
+    def test_invalid_control_byte(self):
+        client, server = socket.socketpair()
+        with client, server:
+            client.sendall(b'\xf8')
+            with self.assertRaises(RouterOSConnectionError):
+                read_length(server)
+
+    def test_read_length_on_closed_socket(self):
+        client, server = socket.socketpair()
+        with server:
+            client.close()
+            with self.assertRaises(RouterOSConnectionError):
+                read_length(server)
+
+
+class SentenceTests(SimpleTestCase):
+    def test_sentence_round_trip(self):
+        words = ['/ip/hotspot/user/add', '=name=' + 'x' * 200, '=comment=café', '.tag=7']
+        client, server = socket.socketpair()
+        with client, server:
+            client.sendall(encode_sentence(words))
+            self.assertEqual(read_sentence(server), words)
+
+    def test_parse_re(self):
+        reply_type, tag, attributes = parse_sentence(['!re', '=.id=*1', '=name=a=b', '=comment=', '.tag=3'])
+        self.assertEqual(reply_type, '!re')
+        self.assertEqual(tag, '3')
+        self.assertEqual(attributes, {'.id': '*1', 'name': 'a=b', 'comment': ''})
+
+    def test_parse_trap(self):
+        reply_type, tag, attributes = parse_sentence(['!trap', '=category=2', '=message=no such item'])
+        self.assertEqual(reply_type, '!trap')
+        self.assertIsNone(tag)
+        self.assertEqual(attributes, {'category': '2', 'message': 'no such item'})
+
+    def test_parse_done(self):
+        self.assertEqual(parse_sentence(['!done', '=ret=*5', '.tag=1']), ('!done', '1', {'ret': '*5'}))
+        self.assertEqual(parse_sentence([]), ('', None, {}))
+
+
+class RouterOSAPIConnectionTests(SimpleTestCase):
+    def setUp(self):
+        self.router = FakeRouter()
+        self.addCleanup(self.router.close)
+        self.connection = RouterOSAPIConnection('127.0.0.1', self.router.port, 'admin', 'secret', timeout=2)
+        self.connection.connect()
+        self.addCleanup(self.connection.close)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_login_rejected(self):
+        router = FakeRouter(password='other')
+        self.addCleanup(router.close)
+        connection = RouterOSAPIConnection('127.0.0.1', router.port, 'admin', 'secret', timeout=2)
+        with self.assertRaisesMessage(RouterOSLoginError, 'invalid user name or password'):
+            connection.connect()
+        self.assertFalse(connection.is_connected)
+
+    def test_replies_are_routed_by_tag(self):
+        future = self.executor.submit(self.connection.talk_many, [
+            ['/ip/hotspot/user/print'],
+            ['/system/identity/print'],
+        ])
+        first, second = self.router.next_command(), self.router.next_command()
+        self.assertEqual(first[0], '/ip/hotspot/user/print')
+        self.assertEqual(second[0], '/system/identity/print')
+        self.assertNotEqual(first[1], second[1])
+
+        # Answer out of order, with the replies interleaved
+        self.router.send('!re', '=name=alice', f'.tag={first[1]}')
+        self.router.send('!re', '=name=hap', f'.tag={second[1]}')
+        self.router.send('!done', f'.tag={second[1]}')
+        self.router.send('!re', '=name=bob', f'.tag={first[1]}')
+        self.router.send('!done', '=ret=ok', f'.tag={first[1]}')
+
+        users, identity = future.result(timeout=5)
+        self.assertEqual(users, ([{'name': 'alice'}, {'name': 'bob'}], {'ret': 'ok'}))
+        self.assertEqual(identity, ([{'name': 'hap'}], {}))
+
+    def test_untagged_and_unknown_replies_are_ignored(self):
+        future = self.executor.submit(self.connection.talk, ['/system/identity/print'])
+        _, tag, _ = self.router.next_command()
+        self.router.send('!re', '=name=stray')
+        self.router.send('!done', '.tag=999')
+        self.router.send('!done', f'.tag={tag}')
+        self.assertEqual(future.result(timeout=5), ([], {}))
+
+    def test_trap_raises_with_category(self):
+        future = self.executor.submit(self.connection.talk, ['/ip/hotspot/user/remove', '=numbers=*9'])
+        _, tag, attributes = self.router.next_command()
+        self.assertEqual(attributes, {'numbers': '*9'})
+        self.router.send('!trap', '=category=1', '=message=no such item', f'.tag={tag}')
+        self.router.send('!done', f'.tag={tag}')
+
+        with self.assertRaisesMessage(RouterOSTrapError, 'no such item') as raised:
+            future.result(timeout=5)
+        self.assertEqual(raised.exception.category, '1')
+        # A trap is the command's failure, not the connection's
+        self.assertTrue(self.connection.is_connected)
+
+    def test_timeout_closes_the_connection(self):
+        with self.assertRaisesMessage(RouterOSConnectionError, 'Timed out'):
+            self.connection.talk(['/system/resource/print'], timeout=0.2)
+        self.assertFalse(self.connection.is_connected)
+        with self.assertRaises(RouterOSConnectionError):
+            self.connection.talk(['/system/resource/print'])
+
+    def test_fatal_fails_pending_commands(self):
+        future = self.executor.submit(self.connection.talk, ['/system/resource/print'])
+        self.router.next_command()
+        self.router.send('!fatal', '=message=session terminated')
+
+        with self.assertRaisesMessage(RouterOSConnectionError, 'session terminated'):
+            future.result(timeout=5)
+        self.assertFalse(self.connection.is_connected)
+
+    def test_keepalive_enabled(self):
+        self.assertTrue(self.connection._sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+
+
+class ScriptCompilerTests(SimpleTestCase):
+    def test_quote(self):
+        self.assertEqual(scripts.quote('plain'), '"plain"')
+        self.assertEqual(scripts.quote('say "hi" $x?\\'), '"say \\"hi\\" \\$x\\?\\\\"')
+        self.assertEqual(scripts.quote('a\nb\rc'), '"a\\nb\\rc"')
+        self.assertEqual(scripts.quote(True), 'yes')
+        self.assertEqual(scripts.quote(False), 'no')
+        self.assertEqual(scripts.quote(['a', 'b']), '"a,b"')
+        self.assertEqual(scripts.quote(5), '"5"')
+
+    def test_render_line(self):
+        self.assertEqual(
+            scripts.render_line('ip/hotspot/user', 'add', {'name': 'x', 'disabled': True}),
+            '/ip hotspot user add name="x" disabled=yes',
+        )
+        self.assertEqual(
+            scripts.render_line('/ip/dns/', 'set', {'servers': ['1.1.1.1', '8.8.8.8']}, ignore_errors=True),
+            ':do { /ip dns set servers="1.1.1.1,8.8.8.8" } on-error={}',
+        )
+
+    def test_compile_operation(self):
+        self.assertEqual(
+            scripts.compile_operation('ip/hotspot/user', 'put', {'name': 'a'}),
+            '/ip hotspot user add name="a"',
+        )
+        self.assertEqual(
+            scripts.compile_operation('ip/hotspot/user/set', 'POST', {'.id': '*1A', 'profile': 'fast'}),
+            '/ip hotspot user set profile="fast" numbers="*1A"',
+        )
+        self.assertEqual(
+            scripts.compile_operation('/ip/hotspot/user/*2', 'DELETE'),
+            '/ip hotspot user remove numbers="*2"',
+        )
+        for command, method in [
+            ('ip/address', 'GET'),
+            ('ip/hotspot/user/*1', 'PUT'),
+            ('ip/hotspot/user', 'DELETE'),
+            ('ip/hotspot/user', 'PATCH'),
+        ]:
+            with self.subTest(command=command, method=method):
+                with self.assertRaises(ValueError):
+                    scripts.compile_operation(command, method)
+
+    def test_names_cannot_inject_script(self):
+        for command, method, data in [
+            ('ip/hotspot/user', 'PUT', {'name="x"; /system reboot; :put a': '1'}),
+            ('ip/hotspot/user;/system/reboot', 'PUT', {'name': 'x'}),
+            ('ip/hotspot/user/*1;/system/reboot', 'DELETE', None),
+            ('ip/Hotspot/user', 'PUT', {'name': 'x'}),
+        ]:
+            with self.subTest(command=command, data=data):
+                with self.assertRaises(ValueError):
+                    scripts.compile_operation(command, method, data)
+        self.assertEqual(
+            scripts.compile_operation('ip/hotspot/user', 'PUT', {'name': 'x"; /system reboot'}),
+            '/ip hotspot user add name="x\\"; /system reboot"',
+        )
+
+    def test_compile_script_with_onerror(self):
+        source = scripts.compile_script([
+            {'command': 'ip/hotspot/user', 'method': 'PUT', 'data': {'name': 'a'}},
+            {'command': 'ip/hotspot/user/*2', 'method': 'DELETE'},
+        ], 'V', stop_on_error=True)
+        self.assertEqual(source.splitlines(), [
+            ':global V ""',
+            ':onerror e in={ /ip hotspot user add name="a"; :global V; :set V ($V . "+\\1E") } '
+            'do={ :global V; :set V ($V . "-" . $e . "\\1E"); :error "stopped" }',
+            ':onerror e in={ /ip hotspot user remove numbers="*2"; :global V; :set V ($V . "+\\1E") } '
+            'do={ :global V; :set V ($V . "-" . $e . "\\1E"); :error "stopped" }',
+        ])
+
+    def test_compile_script_without_onerror(self):
+        source = scripts.compile_script(
+            [{'command': 'ip/hotspot/user', 'method': 'PUT', 'data': {'name': 'a'}}], 'V', capture_errors=False
+        )
+        self.assertEqual(source.splitlines()[1], (
+            ':do { /ip hotspot user add name="a"; :global V; :set V ($V . "+\\1E") } '
+            'on-error={ :global V; :set V ($V . "-\\1E") }'
+        ))
+
+    def test_compile_script_rejects_reads(self):
+        with self.assertRaises(ValueError):
+            scripts.compile_script([{'command': 'ip/address'}], 'V')
+
+    def test_supports_onerror(self):
+        self.assertTrue(scripts.supports_onerror('7.13'))
+        self.assertTrue(scripts.supports_onerror('7.14.2 (stable)'))
+        self.assertTrue(scripts.supports_onerror('8.0'))
+        self.assertFalse(scripts.supports_onerror('7.12.1 (stable)'))
+        self.assertFalse(scripts.supports_onerror('6.49.10 (long-term)'))
+        self.assertFalse(scripts.supports_onerror('Unknown'))
+        self.assertFalse(scripts.supports_onerror(None))
+
+
+class RunOperationsTests(SimpleTestCase):
+    OPERATIONS = [
+        {'command': 'ip/hotspot/user', 'method': 'PUT', 'data': {'name': 'a'}},
+        {'command': 'ip/hotspot/user/set', 'method': 'POST', 'data': {'.id': '*9', 'disabled': True}},
+        {'command': 'ip/hotspot/user/*2', 'method': 'DELETE'},
+    ]
+
+    def run_with(self, outcome, import_error=None, version='7.14.2 (stable)', **kwargs):
+        """run_operations against a router whose outcome variable ends up holding ``outcome``"""
+        def step(success, result=None, error=None):
+            return {'success': success, 'result': result} if success else {'success': False, 'error': error}
+
+        batch = {'success': import_error is None, 'steps': [
+            step(True),
+            step(import_error is None, error=import_error),
+            step(True),
+            step(True, [{'value': outcome}]),
+            step(True),
+        ]}
+        resource = {'success': True, 'data': {'version': version}}
+        with mock.patch.object(scripts.MikrotikAPIManager, 'execute_command', return_value=resource), \
+                mock.patch.object(scripts.MikrotikAPIManager, 'execute_batch', return_value=batch) as execute_batch:
+            result = scripts.run_operations(SimpleNamespace(pk=1), self.OPERATIONS, **kwargs)
+        return result, execute_batch.call_args.args[1]
+
+    def test_per_operation_results(self):
+        result, steps = self.run_with('+\x1e-failure: no such item\x1e+\x1e')
+        self.assertFalse(result['success'])
+        self.assertEqual(
+            [(line['index'], line['line'], line['success'], line.get('error')) for line in result['steps']],
+            [(0, 2, True, None), (1, 3, False, 'failure: no such item'), (2, 4, True, None)],
+        )
+        self.assertIn(':onerror e in=', steps[0]['data']['contents'])
+
+    def test_old_router_failures_have_no_message(self):
+        result, steps = self.run_with('+\x1e-\x1e+\x1e', version='7.9')
+        self.assertEqual(result['steps'][1]['error'], 'Command failed on the router')
+        self.assertNotIn(':onerror', steps[0]['data']['contents'])
+
+    def test_stop_on_error_skips_the_rest(self):
+        result, _ = self.run_with('+\x1e-bad value\x1e', import_error='Bad Request: stopped', stop_on_error=True)
+        self.assertEqual(
+            [(line['success'], line.get('skipped', False)) for line in result['steps']],
+            [(True, False), (False, False), (False, True)],
+        )
+
+    def test_import_error_lands_on_the_line_that_stopped(self):
+        result, _ = self.run_with('+\x1e', import_error='Bad Request: syntax error (line 3)')
+        self.assertTrue(result['steps'][0]['success'])
+        self.assertIn('syntax error', result['steps'][1]['error'])
+        self.assertTrue(result['steps'][2]['skipped'])
+
+    def test_all_succeeded(self):
+        result, _ = self.run_with('+\x1e+\x1e+\x1e')
+        self.assertTrue(result['success'])
+
+
+class HotspotTests(SimpleTestCase):
+    package = SimpleNamespace(pk=3, upload_speed_mbps=2, download_speed_mbps=5, duration_hours=24)
+
+    def test_duration_seconds(self):
+        for value, seconds in [
+            ('1d', 86400),
+            ('24h', 86400),
+            ('1w2d3h', 788400),
+            ('1h30m15s', 5415),
+            ('01:30:00', 5400),
+            ('1d02:00:00', 93600),
+            ('2w3d04:05:06', 1483506),
+            ('1m30s500ms', 90),
+            ('00:00:01.5', 1),
+            ('0s', 0),
+            ('45', 45),
+        ]:
+            with self.subTest(value=value):
+                self.assertEqual(hotspot.duration_seconds(value), seconds)
+        self.assertIsNone(hotspot.duration_seconds(''))
+        self.assertIsNone(hotspot.duration_seconds(None))
+
+    def test_managed_and_voucher_users(self):
+        payment = {'name': '0700', 'profile': 'cloudpilot-3', 'comment': 'payment 9'}
+        voucher = {'name': 'ABCD2345', 'profile': 'cloudpilot-3', 'comment': 'voucher 4/0'}
+        by_hand = {'name': 'admin', 'profile': 'default'}
+        self.assertTrue(hotspot.is_managed_user(payment))
+        self.assertTrue(hotspot.is_managed_user({'name': 'x', 'profile': 'cloudpilot-7'}))
+        self.assertFalse(hotspot.is_managed_user(voucher))
+        self.assertFalse(hotspot.is_managed_user(by_hand))
+        self.assertTrue(hotspot.is_voucher_user(voucher))
+        self.assertFalse(hotspot.is_voucher_user(payment))
+
+    def test_user_changes_compares_durations(self):
+        desired = hotspot.render_user('0700', 'pw', self.package, 'payment 9')
+        self.assertEqual(desired['limit-uptime'], '24h')
+        current = {'password': 'pw', 'profile': 'cloudpilot-3', 'limit-uptime': '1d'}
+        self.assertEqual(hotspot.user_changes(desired, current), {})
+        current = {'password': 'old', 'profile': 'default', 'limit-uptime': '1d00:00:01'}
+        self.assertEqual(hotspot.user_changes(desired, current), {
+            'password': 'pw', 'profile': 'cloudpilot-3', 'limit-uptime': '24h',
+        })
+
+    def test_profile_steps(self):
+        self.assertEqual(hotspot.profile_steps([self.package], {}), [{
+            'command': 'ip/hotspot/user/profile/add',
+            'method': 'POST',
+            'data': {'name': 'cloudpilot-3', 'rate-limit': '2M/5M'},
+        }])
+        current = {'cloudpilot-3': {'.id': '*4', 'name': 'cloudpilot-3', 'rate-limit': '1M/1M'}}
+        self.assertEqual(hotspot.profile_steps([self.package], current)[0]['data'], {
+            'name': 'cloudpilot-3', 'rate-limit': '2M/5M', '.id': '*4',
+        })
+        current['cloudpilot-3']['rate-limit'] = '2M/5M'
+        self.assertEqual(hotspot.profile_steps([self.package], current), [])
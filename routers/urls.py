@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     # Router management
@@ -7,8 +7,18 @@ urlpatterns = [
     path('<int:pk>/', views.router_detail, name='router-detail'),
     path('<int:pk>/test-connection/', views.test_connection, name='test-connection'),
     path('<int:pk>/execute-command/', views.execute_command, name='execute-command'),
+    path('<int:pk>/execute-batch/', views.execute_batch, name='execute-batch'),
+    path('<int:pk>/execute-script/', views.execute_script, name='execute-script'),
     path('<int:pk>/device-info/', views.get_device_info, name='get-device-info'),
     path('<int:pk>/packages/', views.get_router_packages, name='get-router-packages'),
+    path('fleet/execute-command/', views.execute_fleet_command, name='fleet-execute-command'),
+    path('device-info/', views.get_fleet_device_info, name='fleet-device-info'),
+    
+    # Async (ASGI) variants of the router I/O endpoints
+    path('async/<int:pk>/test-connection/', async_views.test_connection, name='async-test-connection'),
+    path('async/<int:pk>/execute-command/', async_views.execute_command, name='async-execute-command'),
+    path('async/<int:pk>/device-info/', async_views.get_device_info, name='async-get-device-info'),
+    path('async/device-info/', async_views.get_fleet_device_info, name='async-fleet-device-info'),
     
     # Package management
     path('packages/', views.package_list, name='package-list'),
@@ -4,9 +4,22 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from .models import Router, Package
 from .serializers import RouterSerializer, PackageSerializer
-from .mikrotik_api import MikrotikAPIManager
+from .mikrotik_api import MikrotikAPIManager, client_pool, response_cache, circuit_breakers
+from .async_mikrotik_api import async_client_pool
+from .scripts import compile_operation, compile_script, run_operations
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+import json
+
+
+def _flag(value, default=False):
+    """A boolean request option; form posts and query-style clients send strings"""
+    if value is None:
+        return default
+    return value not in [False, 'false', 'False', 0, '0', '']
+
 
 @api_view(['GET', 'POST'])
 @authentication_classes([JWTAuthentication])
@@ -52,7 +65,12 @@ def router_detail(request, pk):
 
     elif request.method == 'DELETE':
         router_name = router.name
+        router_id = router.pk
         router.delete()
+        client_pool.invalidate(router_id)
+        async_client_pool.invalidate(router_id)
+        response_cache.invalidate_router(router_id)
+        circuit_breakers.remove(router_id)
         return Response({
             'message': f'Router "{router_name}" has been successfully deleted'
         }, status=status.HTTP_200_OK)
@@ -73,10 +91,10 @@ def test_connection(request, pk):
         manager = MikrotikAPIManager()
         is_online = manager.test_connection(router)
         
-        # Update router status
+        # Update router status (leaves updated_at alone so pooled clients stay valid)
         router.is_online = is_online
         router.last_checked = timezone.now()
-        router.save()
+        router.save(update_fields=['is_online', 'last_checked'])
         
         return Response({
             'router_id': pk,
@@ -110,6 +128,7 @@ def execute_command(request, pk):
     method = request.data.get('method', 'GET').upper()
     params = request.data.get('params', None)  # Query parameters for GET
     data = request.data.get('data', None)      # JSON data for POST/PUT
+    use_cache = _flag(request.data.get('use_cache'), default=True)
     
     # Validate method
     if method not in ['GET', 'POST', 'PUT', 'DELETE']:
@@ -119,7 +138,7 @@ def execute_command(request, pk):
     
     try:
         manager = MikrotikAPIManager()
-        result = manager.execute_command(router, command, method, params, data)
+        result = manager.execute_command(router, command, method, params, data, use_cache=use_cache)
         
         if result.get('success'):
             return Response({
@@ -127,8 +146,22 @@ def execute_command(request, pk):
                 'command': command,
                 'method': method,
                 'result': result['data'],
+                'cached': result.get('cached', False),
                 'message': 'Command executed successfully'
             })
+        elif result.get('circuit_state'):
+            # Router is known to be down; failed fast without contacting it
+            return Response({
+                'router_id': pk,
+                'command': command,
+                'method': method,
+                'error': result['error'],
+                'circuit_state': result['circuit_state'],
+                'retry_after': result['retry_after'],
+                'status_code': result['status_code']
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={
+                'Retry-After': str(int(result['retry_after']) + 1)
+            })
         else:
             # Command failed on Mikrotik side
             return Response({
@@ -144,6 +177,273 @@ def execute_command(request, pk):
             'error': f'Command execution failed: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def execute_batch(request, pk):
+    """Execute an ordered list of commands on a specific router over one connection."""
+    try:
+        router = Router.objects.get(pk=pk, user=request.user)
+    except Router.DoesNotExist:
+        return Response({
+            'error': 'Router not found or access denied'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    steps = request.data.get('steps')
+    if not isinstance(steps, list) or not steps:
+        return Response({
+            'error': 'steps must be a non-empty list of commands'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    max_steps = getattr(settings, 'MIKROTIK_BATCH_MAX_STEPS', 100)
+    if len(steps) > max_steps:
+        return Response({
+            'error': f'A batch may contain at most {max_steps} steps'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Validate every step before touching the router
+    for index, step in enumerate(steps):
+        if not isinstance(step, dict) or not step.get('command'):
+            return Response({
+                'error': f'Step {index}: command is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if str(step.get('method', 'GET')).upper() not in ['GET', 'POST', 'PUT', 'DELETE']:
+            return Response({
+                'error': f'Step {index}: invalid HTTP method. Must be GET, POST, PUT, or DELETE'
+            }, status=status.HTTP_400_BAD_REQUEST)
+    
+    stop_on_error = _flag(request.data.get('stop_on_error'))
+    parallel_reads = _flag(request.data.get('parallel_reads'))
+    
+    try:
+        manager = MikrotikAPIManager()
+        result = manager.execute_batch(
+            router, steps,
+            stop_on_error=stop_on_error,
+            parallel_reads=parallel_reads
+        )
+        
+        return Response({
+            'router_id': pk,
+            'success': result['success'],
+            'steps': result['steps'],
+            'elapsed_ms': result['elapsed_ms'],
+            'message': 'Batch executed successfully' if result['success'] else 'One or more steps failed'
+        })
+    except Exception as e:
+        return Response({
+            'error': f'Batch execution failed: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def execute_script(request, pk):
+    """Run a list of write operations on a specific router as one uploaded script."""
+    try:
+        router = Router.objects.get(pk=pk, user=request.user)
+    except Router.DoesNotExist:
+        return Response({
+            'error': 'Router not found or access denied'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    operations = request.data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return Response({
+            'error': 'operations must be a non-empty list of commands'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    max_operations = getattr(settings, 'MIKROTIK_SCRIPT_MAX_OPERATIONS', 1000)
+    if len(operations) > max_operations:
+        return Response({
+            'error': f'A script may contain at most {max_operations} operations'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or not operation.get('command'):
+            return Response({
+                'error': f'Operation {index}: command is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if operation.get('data') is not None and not isinstance(operation['data'], dict):
+            return Response({
+                'error': f'Operation {index}: data must be an object'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        # Compile first so a bad operation is reported before touching the router
+        try:
+            compile_operation(operation['command'], str(operation.get('method', 'GET')), operation.get('data'))
+        except ValueError as e:
+            return Response({
+                'error': f'Operation {index}: {e}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+    
+    stop_on_error = _flag(request.data.get('stop_on_error'))
+    
+    if _flag(request.data.get('compile_only')):
+        return Response({
+            'router_id': pk,
+            'script': compile_script(operations, 'cloudpilotresult', stop_on_error)
+        })
+    
+    try:
+        result = run_operations(router, operations, stop_on_error=stop_on_error)
+        
+        if not result['steps']:
+            return Response({
+                'router_id': pk,
+                'success': False,
+                'steps': [],
+                'error': result['error'],
+                'elapsed_ms': result['elapsed_ms']
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        
+        return Response({
+            'router_id': pk,
+            'success': result['success'],
+            'steps': result['steps'],
+            'elapsed_ms': result['elapsed_ms'],
+            'message': 'Script executed successfully' if result['success'] else 'One or more operations failed'
+        })
+    except Exception as e:
+        return Response({
+            'error': f'Script execution failed: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def execute_fleet_command(request):
+    """Execute a command on many routers concurrently, streaming NDJSON results."""
+    command = request.data.get('command')
+    if not command:
+        return Response({
+            'error': 'Command is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    method = request.data.get('method', 'GET').upper()
+    params = request.data.get('params', None)
+    data = request.data.get('data', None)
+    
+    if method not in ['GET', 'POST', 'PUT', 'DELETE']:
+        return Response({
+            'error': 'Invalid HTTP method. Must be GET, POST, PUT, or DELETE'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        max_workers = request.data.get('max_workers')
+        max_workers = int(max_workers) if max_workers is not None else None
+        timeout = request.data.get('timeout')
+        timeout = float(timeout) if timeout is not None else None
+    except (TypeError, ValueError):
+        return Response({
+            'error': 'max_workers and timeout must be numbers'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if (max_workers is not None and max_workers < 1) or (timeout is not None and timeout <= 0):
+        return Response({
+            'error': 'max_workers and timeout must be positive'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Router filter (always scoped to the authenticated user)
+    routers = Router.objects.filter(user=request.user)
+    router_filter = request.data.get('routers') or {}
+    if not isinstance(router_filter, dict):
+        return Response({
+            'error': 'routers must be an object'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    ids = router_filter.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids):
+            return Response({
+                'error': 'routers.ids must be a list of router ids'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        routers = routers.filter(pk__in=ids)
+    if router_filter.get('is_online') is not None:
+        if not isinstance(router_filter['is_online'], bool):
+            return Response({
+                'error': 'routers.is_online must be true or false'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        routers = routers.filter(is_online=router_filter['is_online'])
+    if router_filter.get('name_contains'):
+        routers = routers.filter(name__icontains=router_filter['name_contains'])
+    if router_filter.get('host_contains'):
+        routers = routers.filter(host__icontains=router_filter['host_contains'])
+    routers = list(routers)
+    
+    if not routers:
+        return Response({
+            'error': 'No routers match the given filter'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    def stream():
+        succeeded = 0
+        failed = 0
+        started = timezone.now()
+        for line in MikrotikAPIManager.execute_fleet_command(
+            routers, command, method, params, data,
+            max_workers=max_workers, timeout=timeout
+        ):
+            if line['success']:
+                succeeded += 1
+            else:
+                failed += 1
+            yield json.dumps(line, default=str) + '\n'
+        
+        yield json.dumps({
+            'summary': {
+                'command': command,
+                'method': method,
+                'total': len(routers),
+                'succeeded': succeeded,
+                'failed': failed,
+                'elapsed_ms': round((timezone.now() - started).total_seconds() * 1000, 1)
+            }
+        }) + '\n'
+    
+    response = StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def get_fleet_device_info(request):
+    """Get device information from all of the user's routers in parallel."""
+    try:
+        deadline = request.query_params.get('deadline')
+        deadline = float(deadline) if deadline else None
+    except ValueError:
+        return Response({
+            'error': 'deadline must be a number of seconds'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if deadline is not None and deadline <= 0:
+        return Response({
+            'error': 'deadline must be positive'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    routers = Router.objects.filter(user=request.user)
+    started = timezone.now()
+    
+    try:
+        manager = MikrotikAPIManager()
+        results, complete = manager.get_fleet_device_info(routers, deadline=deadline)
+        
+        return Response({
+            'routers': results,
+            'complete': complete,
+            'elapsed_ms': round((timezone.now() - started).total_seconds() * 1000, 1),
+            'message': (
+                f'Device information retrieved for {len(results)} routers' if complete
+                else 'Some routers did not respond before the deadline'
+            )
+        })
+    except Exception as e:
+        return Response({
+            'error': f'Failed to get device info: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @api_view(['GET'])
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
@@ -158,7 +458,8 @@ def get_device_info(request, pk):
 
     try:
         manager = MikrotikAPIManager()
-        device_info = manager.get_device_info(router)
+        use_cache = request.query_params.get('refresh', '').lower() not in ['1', 'true', 'yes']
+        device_info = manager.get_device_info(router, use_cache=use_cache)
         
         return Response({
             'router_id': pk,